@@ -0,0 +1,301 @@
+# benchmarks/pipeline.py
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import dspy  # noqa: E402
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+STAGES = ["chunking", "predict", "predict_chunked", "exact_match", "semantic_match", "mapping"]
+# Input fields of a ChatAdapter request; the last one is followed by the "Respond with ..." instruction.
+FIELD_HEADER = re.compile(r"\[\[ ## (\w+) ## \]\]\n(.*?)(?=\n\n(?:\[\[ ## |Respond with )|\Z)", re.S)
+
+
+def _hash(*parts) -> int:
+    return zlib.crc32("\x00".join(str(part) for part in parts).encode("utf-8"))
+
+
+class FakeLM(dspy.BaseLM):
+    """
+    Deterministic stand-in for the extraction and categorization LMs.
+
+    Answers in ChatAdapter format: extraction requests get one or two cause/effect pairs cut
+    out of the input's own sentences, categorization requests one of the categories listed
+    in the prompt. Every response depends only on the prompt (and salt), so runs are
+    reproducible; each call sleeps for `latency` seconds +/- `jitter` (a fraction), also
+    derived from the prompt, to stand in for network time.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.5, salt: str = "pred"):
+        super().__init__(model="fake/benchmark")
+        self.latency = latency
+        self.jitter = jitter
+        self.salt = salt
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        messages = messages or [{"role": "user", "content": prompt}]
+        request = messages[-1]["content"]
+        fields = dict(FIELD_HEADER.findall(request))
+        if "cause_text" in fields:
+            content = self._categorize(fields["cause_text"])
+        else:
+            content = self._extract(fields.get("text", request))
+        if self.latency:
+            spread = (_hash(self.salt, request) % 1000 / 1000 - 0.5) * 2 * self.jitter
+            time.sleep(max(0.0, self.latency * (1 + spread)))
+        prompt_chars = sum(len(str(message.get("content", ""))) for message in messages)
+        return _Response(content, prompt_tokens=prompt_chars // 4, completion_tokens=len(content) // 4)
+
+    def _extract(self, text: str) -> str:
+        pairs = fake_pairs(text, self.salt)
+        marked = text
+        for i, pair in enumerate(pairs, start=1):
+            marked = marked.replace(pair["cause"], f"(C{i}) {pair['cause']} (C{i})", 1)
+        return (f"[[ ## reasoning ## ]]\nFound {len(pairs)} causal statements.\n\n"
+                f"[[ ## marked_text ## ]]\n{marked}\n\n"
+                f"[[ ## extracted_pairs ## ]]\n{pairs!r}\n\n[[ ## completed ## ]]")
+
+    def _categorize(self, cause_prompt: str) -> str:
+        match = re.search(r"one of: (.*?)\.\nText: (.*?)\n", cause_prompt, re.S)
+        categories, cause = (match.group(1).split(", "), match.group(2)) if match else (["Uncategorized"], "")
+        category = categories[_hash(self.salt, cause) % len(categories)]
+        return f"[[ ## reasoning ## ]]\nClosest category.\n\n[[ ## driver_category ## ]]\n{category}\n\n[[ ## completed ## ]]"
+
+
+class _Response:
+    def __init__(self, content: str, prompt_tokens: int, completion_tokens: int):
+        self.choices = [{"text": content}]
+        self.usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+        self.model = "fake/benchmark"
+
+
+def fake_pairs(text: str, salt: str) -> list:
+    """
+    One or two pairs from the sentences of text, each sentence split in half into cause and effect.
+    Different salts pick overlapping but different pairs (used for gold vs. predicted).
+    """
+    sentences = [s for s in re.split(r"(?<=[.!?])\s+", text) if len(s.split()) >= 4]
+    pairs = []
+    for sentence in sentences[:: max(1, len(sentences) // 2)][:2]:
+        words = sentence.rstrip(".!?").split()
+        cut = 2 + _hash(salt, sentence) % max(1, len(words) - 3)
+        pairs.append({"cause": " ".join(words[:cut]), "effect": " ".join(words[cut:]),
+                      "cause_polarity": "positive", "effect_polarity": "positive", "type": "Type 1"})
+    return pairs
+
+
+def hash_encoder(texts) -> np.ndarray:
+    """
+    Deterministic 384-dimensional pseudo-embeddings (same shape as all-MiniLM-L6-v2).
+    """
+    return np.array([np.random.default_rng(_hash(text.lower())).standard_normal(384) for text in texts],
+                    dtype=np.float32)
+
+
+def sentence_pool() -> list:
+    """
+    Sentences of the WHO-DON texts in data/result_df_31_Oct.csv and data/train_set.json.
+    """
+    from src.data_utils import iter_sentence_spans
+
+    texts = pd.read_csv(os.path.join(REPO_ROOT, "data", "result_df_31_Oct.csv"))["Raw_Text"].dropna().tolist()
+    texts += pd.read_json(os.path.join(REPO_ROOT, "data", "train_set.json"))["text"].tolist()
+    pool = []
+    for text in dict.fromkeys(texts):
+        text = re.sub(r"\(C\d+\)\s*", "", text)  # drop the annotation markers of the labeled data
+        pool.extend(text[start:end].strip() for start, end in iter_sentence_spans(text))
+    return [sentence for sentence in dict.fromkeys(pool) if len(sentence.split()) >= 4]
+
+
+def synthetic_corpus(rows: int, seed: int = 0, min_sentences: int = 3, max_sentences: int = 15) -> pd.DataFrame:
+    """
+    A corpus CSV-like frame (DonId, Text) of `rows` reports, each a random run of sentences
+    from the real pool. Sentences recur across reports the way WHO-DON boilerplate does.
+    """
+    pool = sentence_pool()
+    rng = random.Random(seed)
+    texts = [" ".join(rng.choices(pool, k=rng.randint(min_sentences, max_sentences))) for _ in range(rows)]
+    return pd.DataFrame({"DonId": [f"SYN-DON{i:06d}" for i in range(rows)], "Text": texts})
+
+
+def synthetic_causes(rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    `rows` causes drawn from the extracted causes in data/result_df_31_Oct.csv.
+    """
+    from src.mapping import load_extracted_causes
+
+    causes = load_extracted_causes(os.path.join(REPO_ROOT, "data", "result_df_31_Oct.csv"))
+    return causes.sample(n=rows, replace=True, random_state=seed).reset_index(drop=True)
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+class StageTimer:
+    """
+    Collects one result per stage: wall time, items and throughput, process peak RSS after
+    the stage, and the stage's LM calls (count and latency percentiles) from src.lm_metrics.
+    """
+
+    def __init__(self):
+        self.results = []
+
+    def run(self, stage: str, items: int, fn):
+        from src.lm_metrics import get_lm_metrics, summarize
+
+        mark = get_lm_metrics().mark()
+        start = time.perf_counter()
+        output = fn()
+        seconds = time.perf_counter() - start
+        result = {"stage": stage, "items": items, "seconds": round(seconds, 4),
+                  "items_per_s": round(items / seconds, 2) if seconds > 0 else None,
+                  "peak_rss_mb": _peak_rss_mb()}
+        lm_summary = summarize(get_lm_metrics().records(since=mark))
+        if not lm_summary.empty:
+            total = lm_summary.iloc[0]
+            result.update(lm_calls=int(total["calls"]), lm_p50_s=round(total["p50_s"], 4),
+                          lm_p95_s=round(total["p95_s"], 4), prompt_tokens=int(total["prompt_tokens"]))
+        self.results.append(result)
+        print(json.dumps(result), file=sys.stderr)
+        return output
+
+
+def run_benchmark(rows: int, stages=STAGES, latency: float = 0.0, max_workers: int = 8, seed: int = 0,
+                  embeddings: str = "fake", embedding_workers: int = 1, precision: str = "float32") -> dict:
+    """
+    Runs the selected stages on a synthetic corpus of `rows` reports and returns their timings.
+    """
+    from dspy.teleprompt import LabeledFewShot
+
+    from src.category_index import CategoryIndex
+    from src.data_utils import iter_sentence_chunks, iter_token_chunks
+    from src.embedding_service import EmbeddingService, configure_embeddings
+    from src.embedding_store import EmbeddingStore, use_embedding_store
+    from src.evaluation import extracted_pairs_exact_match, extracted_pairs_semantic_match, score_predictions
+    from src.instrumented_lm import InstrumentedLM
+    from src.mapping import CauseCategorizationModule, process_dataframe
+    from src.model_pipeline import CauseEffectSignature, predict_cause_effect, predict_cause_effect_with_chunking
+
+    # Scratch embedding cache, so every run starts cold and nothing is written to data/cache.
+    store_dir = tempfile.mkdtemp(prefix="bench_embeddings_")
+    configure_embeddings(num_workers=embedding_workers, precision=precision)
+    service = EmbeddingService(encoder=hash_encoder if embeddings == "fake" else None)
+    use_embedding_store(EmbeddingStore(store_dir=store_dir, service=service))
+
+    lm = InstrumentedLM(FakeLM(latency=latency))
+    dspy.configure(lm=lm)
+    train = pd.read_json(os.path.join(REPO_ROOT, "data", "train_set.json"))
+    trainset = [dspy.Example(**row).with_inputs("text") for row in train.to_dict("records")]
+    program = LabeledFewShot(k=min(7, len(trainset))).compile(dspy.ChainOfThought(CauseEffectSignature),
+                                                               trainset=trainset)
+    program.set_lm(lm)
+
+    timer = StageTimer()
+    corpus = timer.run("corpus", rows, lambda: synthetic_corpus(rows, seed=seed))
+    predictions = None
+    if "chunking" in stages:
+        def chunk_all():
+            sentence_chunks = sum(1 for text in corpus["Text"] for _ in iter_sentence_chunks(text))
+            token_chunks = sum(1 for text in corpus["Text"] for _ in iter_token_chunks(text, max_tokens=256))
+            return sentence_chunks, token_chunks
+        timer.run("chunking", rows, chunk_all)
+    if {"predict", "exact_match", "semantic_match"} & set(stages):
+        predictions = timer.run("predict", rows, lambda: predict_cause_effect(corpus, program, max_workers=max_workers))
+    if "predict_chunked" in stages:
+        timer.run("predict_chunked", rows, lambda: predict_cause_effect_with_chunking(
+            corpus, program, max_workers=max_workers, max_tokens=256, merge=True))
+    if predictions is not None and {"exact_match", "semantic_match"} & set(stages):
+        devset = [dspy.Example(text=text, extracted_pairs=fake_pairs(text, "gold")).with_inputs("text")
+                  for text in corpus["Text"]]
+        preds = [dspy.Prediction(extracted_pairs=pairs) for pairs in predictions["PredictedExtractedPairs"]]
+        for stage, metric in (("exact_match", extracted_pairs_exact_match),
+                              ("semantic_match", extracted_pairs_semantic_match)):
+            if stage in stages:
+                timer.run(stage, rows, lambda metric=metric: score_predictions(devset, preds, [metric]))
+    if "mapping" in stages:
+        causes = synthetic_causes(rows, seed=seed)
+        index = CategoryIndex.from_excel(os.path.join(REPO_ROOT, "data", "drivers.xlsx"))
+        categorizer = CauseCategorizationModule(index)
+        timer.run("mapping", rows, lambda: process_dataframe(causes, categorizer, max_workers=max_workers))
+    return {"rows": rows, "stages": timer.results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Pipeline throughput on synthetic WHO-DON corpora with a deterministic fake LM.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000],
+                        help="Corpus sizes in rows (e.g. 100 1000 10000 100000).")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean fake LM latency per call in seconds.")
+    parser.add_argument("--max-workers", type=int, default=8, help="Concurrent LM requests.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--embeddings", choices=["fake", "real"], default="fake",
+                        help="fake: hash-seeded vectors; real: the SentenceTransformer model (must be available).")
+    parser.add_argument("--embedding-workers", type=int, default=1, help="Processes for large embedding jobs.")
+    parser.add_argument("--precision", choices=["float32", "float16", "int8"], default="float32",
+                        help="Precision of the category vectors and the embedding cache.")
+    parser.add_argument("--in-process", action="store_true",
+                        help="Run all sizes in this process (peak RSS then accumulates across sizes).")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file instead of stdout.")
+    args = parser.parse_args(argv)
+
+    options = ["--stages", *args.stages, "--latency", str(args.latency), "--max-workers", str(args.max_workers),
+               "--seed", str(args.seed), "--embeddings", args.embeddings,
+               "--embedding-workers", str(args.embedding_workers), "--precision", args.precision]
+    runs = []
+    for rows in args.sizes:
+        if args.in_process or len(args.sizes) == 1:
+            runs.append(run_benchmark(rows, stages=args.stages, latency=args.latency, max_workers=args.max_workers,
+                                      seed=args.seed, embeddings=args.embeddings,
+                                      embedding_workers=args.embedding_workers, precision=args.precision))
+        else:
+            # One fresh interpreter per size, so peak RSS belongs to that size alone.
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--sizes", str(rows), *options],
+                                  cwd=REPO_ROOT, stdout=subprocess.PIPE, text=True, check=True)
+            runs.extend(json.loads(proc.stdout)["runs"])
+
+    report = {
+        "created": time.time(),
+        "commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": {"stages": args.stages, "latency_s": args.latency, "max_workers": args.max_workers,
+                   "seed": args.seed, "embeddings": args.embeddings,
+                   "embedding_workers": args.embedding_workers, "precision": args.precision},
+        "runs": runs,
+    }
+    text = json.dumps(report, indent=4)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# benchmarks/startup_time.py
+import argparse
+import ast
+import glob
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["torch", "sentence_transformers", "transformers", "dspy", "litellm", "streamlit"]
+
+
+def page_imports(path: str) -> list:
+    """
+    Returns the module-level import statements of a page script as source lines,
+    i.e. what Streamlit executes before the page renders anything.
+    """
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+    return [ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+
+
+def _probe_code(imports: list) -> str:
+    loaded = f"[m for m in {HEAVY_MODULES!r} if m in sys.modules]"
+    return "\n".join(["import sys", *imports, f"print(__import__('json').dumps({loaded}))"])
+
+
+def _parse_importtime(stderr: str, top: int) -> list:
+    """
+    Parses `python -X importtime` output into the `top` slowest top-level imports
+    (cumulative microseconds, module name).
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        if name.startswith("  "):
+            continue  # nested import, already counted in its parent's cumulative time
+        rows.append({"module": name.strip(), "cumulative_ms": int(cumulative_us) / 1000})
+    rows.sort(key=lambda row: row["cumulative_ms"], reverse=True)
+    return rows[:top]
+
+
+def time_imports(imports: list, repeats: int = 3, top: int = 10) -> dict:
+    """
+    Runs the given import lines in fresh interpreters and reports the wall time,
+    which heavy modules got loaded, and the slowest top-level imports.
+    """
+    code = _probe_code(imports)
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    timings = []
+    stderr, stdout = "", "[]"
+    for _ in range(repeats):
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=REPO_ROOT, env=env, capture_output=True, text=True,
+        )
+        timings.append(time.perf_counter() - start)
+        if proc.returncode != 0:
+            return {"error": proc.stderr.strip().splitlines()[-1:] or ["import failed"]}
+        stderr, stdout = proc.stderr, proc.stdout
+    return {
+        "median_s": round(statistics.median(timings), 3),
+        "min_s": round(min(timings), 3),
+        "runs_s": [round(t, 3) for t in timings],
+        "heavy_modules_loaded": json.loads(stdout.strip().splitlines()[-1]),
+        "slowest_imports": _parse_importtime(stderr, top),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cold-start import time of the Streamlit app and each page.")
+    parser.add_argument("--repeats", type=int, default=3, help="Fresh interpreters per page.")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to report per page.")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file instead of stdout.")
+    args = parser.parse_args(argv)
+
+    pages = ["app.py"] + sorted(
+        os.path.relpath(p, REPO_ROOT) for p in glob.glob(os.path.join(REPO_ROOT, "pages", "*.py"))
+    )
+    report = {
+        "python": sys.version.split()[0],
+        "baseline": time_imports([], repeats=args.repeats, top=0),
+        "pages": {
+            page: time_imports(page_imports(os.path.join(REPO_ROOT, page)), repeats=args.repeats, top=args.top)
+            for page in pages
+        },
+    }
+    text = json.dumps(report, indent=4)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
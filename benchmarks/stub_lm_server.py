@@ -0,0 +1,137 @@
+# benchmarks/stub_lm_server.py
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pipeline import FakeLM  # noqa: E402
+
+
+class StubLMServer(ThreadingHTTPServer):
+    """
+    OpenAI-compatible /v1/chat/completions endpoint answering with FakeLM, for exercising
+    the LM router (failover, hedging, concurrency limits) without a real provider.
+
+    Parameters:
+    port (int): 0 picks a free port; see url.
+    latency (float): Mean seconds per response (+/- jitter, a fraction).
+    failure_rate (float): Share of requests answered with HTTP 500.
+    hang_rate (float): Share of requests that sleep hang_s seconds before answering, to trigger timeouts.
+    seed (int): Seeds the failure/hang draws.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.0, jitter: float = 0.5, failure_rate: float = 0.0,
+                 hang_rate: float = 0.0, hang_s: float = 30.0, seed: int = 0, name: str = "stub"):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.lm = FakeLM(latency=latency, jitter=jitter)
+        self.failure_rate = failure_rate
+        self.hang_rate = hang_rate
+        self.hang_s = hang_s
+        self.name = name
+        self.requests = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        """
+        Base URL to use as a backend's api_base (with an "openai/..." model name).
+        """
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def draw(self) -> str:
+        with self._lock:
+            self.requests += 1
+            roll = self._random.random()
+        if roll < self.failure_rate:
+            with self._lock:
+                self.failures += 1
+            return "fail"
+        return "hang" if roll < self.failure_rate + self.hang_rate else "ok"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        server = self.server
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        with server._lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            outcome = server.draw()
+            if outcome == "fail":
+                self._send(500, {"error": {"message": f"{server.name}: injected failure", "type": "server_error"}})
+                return
+            if outcome == "hang":
+                time.sleep(server.hang_s)
+            response = server.lm.forward(messages=request.get("messages", []))
+            self._send(200, {
+                "id": f"chatcmpl-{server.name}-{server.requests}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "stub"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": response.choices[0]["text"]}}],
+                "usage": {**response.usage,
+                          "total_tokens": response.usage["prompt_tokens"] + response.usage["completion_tokens"]},
+            })
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up (timeout or a hedged request that lost the race).
+            pass
+        finally:
+            with server._lock:
+                server.in_flight -= 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub LM server backed by the benchmark FakeLM.")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.2, help="Mean seconds per response.")
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of requests answered with HTTP 500.")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Share of requests delayed by --hang-s.")
+    parser.add_argument("--hang-s", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    server = StubLMServer(args.port, latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                          hang_rate=args.hang_rate, hang_s=args.hang_s, seed=args.seed,
+                          name=f"stub{args.port}")
+    print(f"Serving on {server.url} (model name e.g. openai/stub, api_key any)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
-import dspy
-import streamlit as st
+import json
+import logging
 import os
+import threading
 from dotenv import load_dotenv
 
 # Load environment variables from .env
@@ -11,16 +12,91 @@ DEFAULT_LM_MODEL = "openai/o3-mini"
 ALTERNATIVE_LM_MODEL = "ollama_chat/llama3.2"
 ALTERNATIVE_LM_API_BASE = "http://localhost:11434"
 DEFAULT_LM_API_KEY = os.getenv("OPENAI_API_KEY")
+# USD per million (input, output) tokens, used to estimate the cost of each LM call.
+LM_PRICES = {
+    DEFAULT_LM_MODEL: (1.10, 4.40),
+    ALTERNATIVE_LM_MODEL: (0.0, 0.0),
+}
+# Backends of the "pool" LM (see src.lm_router.build_router): name, weight (share of traffic),
+# max_concurrency (requests in flight) and timeout are routing settings, the rest goes to dspy.LM.
+# LM_POOL_FILE may point to a JSON list of such specs, e.g. several keys or local servers.
+LM_POOL = [
+    {"name": "openai", "model": DEFAULT_LM_MODEL, "api_key": DEFAULT_LM_API_KEY, "max_tokens": 5000,
+     "temperature": 1.0, "weight": 3, "max_concurrency": 8},
+    {"name": "llama", "model": ALTERNATIVE_LM_MODEL, "api_base": ALTERNATIVE_LM_API_BASE, "api_key": "",
+     "weight": 1, "max_concurrency": 2},
+]
+LM_POOL_FILE = os.getenv("LM_POOL_FILE")
+# Seconds before a hedged duplicate of a slow request is sent (None disables hedging).
+LM_ROUTER_OPTIONS = {"max_attempts": 3, "timeout": 120.0, "hedge_after": None}
 
+# Sentence embeddings (see src.embedding_service): texts per encoder batch, worker processes
+# for large encode jobs (1 = in-process) and the precision category and corpus vectors are
+# kept in ("float32", "float16" or "int8").
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "1"))
+EMBEDDING_PRECISION = os.getenv("EMBEDDING_PRECISION", "float32")
 
-def configure_lm(model=""):
+logger = logging.getLogger(__name__)
+
+_lm_router = None
+
+
+def _set_default_lm(lm):
+    """
+    Make lm DSPy's default LM.
+    dspy only lets the thread that first configured it change its settings, while Streamlit
+    runs every rerun in a new thread. In that case the existing default is kept and callers
+    bind the LM to their program explicitly (see load_model); any other configuration error
+    is raised.
+    """
+    import importlib
+
+    import dspy
+
+    # The module, not the dspy.settings object of the same name, records the owner thread.
+    owner = getattr(importlib.import_module("dspy.dsp.utils.settings"), "config_owner_thread_id", None)
+    if owner not in (None, threading.get_ident()):
+        logger.debug("dspy settings are owned by thread %s; keeping the default LM, callers bind %s", owner, lm)
+        return
+    dspy.configure(lm=lm)
+
+
+def _get_lm_router():
+    """
+    Builds the pooled LM once per process, so backend health and load carry over between runs.
+    """
+    global _lm_router
+    if _lm_router is None:
+        from src.lm_router import build_router
+
+        specs = LM_POOL
+        if LM_POOL_FILE:
+            with open(LM_POOL_FILE, encoding="utf-8") as f:
+                specs = json.load(f)
+        _lm_router = build_router(specs, **LM_ROUTER_OPTIONS)
+    return _lm_router
+
+
+def configure_lm(model="", response_cache=None, namespace="", instrument=True):
     """
     Configure and return the language model based on the given model_type.
-    model can be either "openai" or "llama".
+    model can be either "openai", "llama" or "pool" (every backend of LM_POOL, see src.lm_router).
+    If a ResponseCache is given, the LM is wrapped in a CachedLM so identical requests
+    are answered from the cache; namespace should identify the compiled program (its demos).
+    With instrument, every call (cache hits included) is recorded in the process-wide
+    LMMetrics collector (see src.lm_metrics).
+    dspy is imported here rather than at module level, so importing config stays
+    cheap for pages that never talk to an LM.
     """
-    if model.lower() == "openai":
+    import dspy
+
+    if model.lower() == "pool":
+        logger.info("Using LM pool")
+        lm = _get_lm_router()
+    elif model.lower() == "openai":
         # max_tokens=5000, temperature=1.0: only specify when using o3-mini, bug of dpsy
-        st.write("Using OpenAI model")
+        logger.info("Using OpenAI model")
         lm = dspy.LM(
             DEFAULT_LM_MODEL,
             api_key=DEFAULT_LM_API_KEY,
@@ -28,7 +104,15 @@ def configure_lm(model=""):
             temperature=1.0,
         )
     else:
-        st.write("Using Llama model")
+        logger.info("Using Llama model")
         lm = dspy.LM(ALTERNATIVE_LM_MODEL, api_base=ALTERNATIVE_LM_API_BASE, api_key="")
-    dspy.configure(lm=lm)
+    if response_cache is not None:
+        from src.lm_cache import CachedLM
+
+        lm = CachedLM(lm, response_cache, namespace=namespace)
+    if instrument:
+        from src.instrumented_lm import InstrumentedLM
+
+        lm = InstrumentedLM(lm, prices=LM_PRICES)
+    _set_default_lm(lm)
     return lm
@@ -1,14 +1,14 @@
 import streamlit as st
 import pandas as pd
 import random
-from src.data_utils import load_train_data
+from src.resources import load_train_data_cached
 from src.model_pipeline import build_and_train_model
 import dspy
 
 st.title("Train Cause/Effect Extraction Model")
 
 st.write("1. Load training data from JSON.")
-df_train = load_train_data("data/train_set.json")
+df_train = load_train_data_cached("data/train_set.json")
 
 st.write(df_train)
 
@@ -30,3 +30,30 @@ if st.button("Train Model"):
     model = build_and_train_model(train_examples)
     model.save("./models/cause_effect_model.json")
     st.success("Model trained and saved!")
+
+st.write("4. Or search several few-shot candidates and keep the best one on the dev set.")
+k_values = st.multiselect("Demo counts (k)", [1, 2, 3, 4, 5, 6, 7], default=[3, 5, 7])
+subsets_per_k = st.slider("Random demo subsets per k", 1, 5, 2)
+use_bootstrap = st.checkbox("Also try BootstrapFewShot (runs the LM on the training set)")
+max_workers = st.slider("Concurrent LM requests", 1, 16, 4)
+
+if not k_values:
+    st.warning("Select at least one demo count (k) to search.")
+if st.button("Search Best Model", disabled=not k_values):
+    from src.model_search import save_search_results, search_few_shot_models
+    from src.progress import Progress, StreamlitSink
+
+    df_dev = load_train_data_cached("./data/dev_set.json")
+    dev_examples = [
+        dspy.Example(text=row["text"], marked_text=row["marked_text"], extracted_pairs=row["extracted_pairs"]).with_inputs("text")
+        for _, row in df_dev.iterrows()
+    ]
+    best, leaderboard, programs = search_few_shot_models(
+        train_examples, dev_examples, k_values=k_values, subsets_per_k=subsets_per_k, bootstrap=use_bootstrap,
+        max_workers=max_workers, progress=Progress(StreamlitSink(), min_interval=0.5),
+    )
+    leaderboard_path = save_search_results(best, leaderboard, "./models/cause_effect_model.json")
+    st.write("### Leaderboard")
+    st.dataframe(leaderboard)
+    st.success(f"Best candidate {leaderboard.loc[0, 'name']} saved to ./models/cause_effect_model.json "
+               f"(leaderboard: {leaderboard_path})")
@@ -2,20 +2,21 @@
 import streamlit as st
 import pandas as pd
 import dspy
-from config import configure_lm
-from src.data_utils import load_train_data
-from src.model_pipeline import load_model
+from src.resources import get_dspy_model, load_train_data_cached
 from src.evaluation import (
     extracted_pairs_exact_match,
     extracted_pairs_semantic_match,
-    run_evaluation
+    run_multi_metric_evaluation
 )
+from src.lm_metrics import get_lm_metrics, render_lm_metrics
+from src.pairs import parse_stats
+from src.progress import Progress, StreamlitSink
 
 st.title("Evaluate Model Performance")
 
 # 1. Load a dev set for evaluation.
 # Here we assume that your training JSON can also serve as a dev set.
-df_dev = load_train_data("./data/train_set.json")
+df_dev = load_train_data_cached("./data/train_set.json")
 dev_examples = []
 for idx, row in df_dev.iterrows():
     ex = dspy.Example(
@@ -27,30 +28,44 @@ for idx, row in df_dev.iterrows():
 
 st.write("Loaded", len(dev_examples), "development examples for evaluation.")
 
+max_workers = st.slider("Concurrent LM requests", min_value=1, max_value=16, value=4)
+
 # 2. Load the saved model.
 if st.button("Load Model for Evaluation"):
-    model = load_model("./models/cause_effect_model.json")
+    model = get_dspy_model("./models/cause_effect_model.json")
     st.success("Model loaded successfully!")
+    metrics_mark = get_lm_metrics().mark()
     
-    # 3. Create an evaluator using DSPy's Evaluate.
-    evaluator = dspy.evaluate.evaluate.Evaluate(
-        devset=dev_examples,
-        display_progress=True,
-        display_table=5
-    )
-    
-    # 4. Run evaluation with the exact match metric.
-    avg_exact, scores_exact = evaluator(
-        model, metric=extracted_pairs_exact_match, return_all_scores=True
+    # 3. Predict every dev example once and score the stored predictions with both metrics.
+    summary, results_df = run_multi_metric_evaluation(
+        model,
+        dev_examples,
+        metrics=[extracted_pairs_exact_match, extracted_pairs_semantic_match],
+        max_workers=max_workers,
+        progress=Progress(StreamlitSink(), min_interval=0.5),
     )
+
+    # 4. Exact match metric.
     st.write("### Exact Match Evaluation")
-    st.write("Average Exact Match Score:", avg_exact)
-    st.write("Scores per example:", scores_exact)
-    
-    # 5. Run evaluation with the semantic similarity metric.
-    avg_semantic, scores_semantic = evaluator(
-        model, metric=extracted_pairs_semantic_match, return_all_scores=True
-    )
+    st.write("Average Exact Match Score (%):", summary["extracted_pairs_exact_match"])
+    st.write("Scores per example (0-1):", results_df["extracted_pairs_exact_match"].tolist())
+
+    # 5. Semantic similarity metric.
     st.write("### Semantic Evaluation")
-    st.write("Average Semantic Score:", avg_semantic)
-    st.write("Scores per example:", scores_semantic)
+    st.write("Average Semantic Score (%):", summary["extracted_pairs_semantic_match"])
+    st.write("Scores per example (0-1):", results_df["extracted_pairs_semantic_match"].tolist())
+
+    st.write("### LM Output Quality")
+    st.write("How the predicted pairs were parsed (failed = no list of pairs could be recovered):", parse_stats())
+
+    st.write("### Per-example Results")
+    st.dataframe(results_df)
+    st.write("Results saved to ./data/output/evaluation_results.json and evaluation_results.csv")
+
+    st.write("### LM Calls")
+    render_lm_metrics(get_lm_metrics().records(since=metrics_mark))
+    from src.lm_cache import find_response_cache
+
+    response_cache = find_response_cache(model.lm)
+    if response_cache is not None:
+        st.write("LM response cache:", response_cache.stats())
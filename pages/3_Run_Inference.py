@@ -1,16 +1,24 @@
+import time
+from collections import deque
 import streamlit as st
 import pandas as pd
-import dspy
-from config import configure_lm
-from src.data_utils import load_inference_data  # now includes chunking functions if needed
-from src.model_pipeline import load_model, predict_cause_effect, predict_cause_effect_with_chunking
+from src.columnar import DEFAULT_PAIRS_PATH, ResultWriter, jsonl_to_pairs_parquet
+from src.lm_metrics import DEFAULT_METRICS_PATH, get_lm_metrics, render_lm_metrics
+from src.model_pipeline import (
+    iter_predict_cause_effect,
+    iter_predict_cause_effect_with_chunking,
+    stream_predict_cause_effect,
+    with_demo_selector,
+)
+from src.progress import Progress, StreamlitSink
+from src.resources import get_demo_index, get_dspy_model, get_lm, read_csv_cached
 
 st.title("Run Inference on New Data")
 
 # --- Global LM configuration ---
 # Configure the LM before anything else so that dspy.settings.lm is set.
-lm = configure_lm()
-dspy.settings.configure(lm=lm)
+# The configured LM, the loaded model and the corpus rows read below are cached across reruns.
+lm = get_lm()
 st.write("Global LM configured:", lm)
 
 # Initialize model in session state if not already present
@@ -19,41 +27,113 @@ if "model" not in st.session_state:
 
 # 1. Load the trained model and store it in session state.
 if st.button("Load Trained Model"):
-    st.session_state.model = load_model("./models/cause_effect_model.json")
+    st.session_state.model = get_dspy_model("./models/cause_effect_model.json")
     st.success("Model loaded successfully!")
 
-# 2. Load inference data from a CSV file.
-df_infer = load_inference_data("./data/corpus.csv")
-if "Text" not in df_infer.columns:
+# 2. Check the inference CSV. Only its header is read here: the streaming run reads the
+# corpus in chunks, and the other methods load just the rows they predict.
+corpus_path = "./data/corpus.csv"
+corpus_columns = read_csv_cached(corpus_path, nrows=0).columns
+if "Text" not in corpus_columns:
     st.error("No 'Text' column in the CSV. Please check file format.")
 else:
     # 3. Let the user select the prediction method.
-    method = st.radio("Select Prediction Method", ("Full Text", "Chunked Text"))
-    
+    method = st.radio("Select Prediction Method", ("Full Text", "Chunked Text", "Full Corpus (streaming, resumable)"))
+    max_workers = st.slider("Concurrent LM requests", min_value=1, max_value=16, value=4)
+    if method != "Full Corpus (streaming, resumable)":
+        num_rows = st.number_input("Rows to predict", min_value=1, value=5)
+    preview_rows = 50  # only the most recent rows are kept for the live table
+    # Instead of the demos saved with the model, send each text with the training
+    # examples most similar to it, within a token budget.
+    retrieve_demos = st.checkbox("Retrieve demos per input (shorter prompts)")
+    if retrieve_demos:
+        demo_k = st.slider("Demos per input", min_value=1, max_value=7, value=3)
+        demo_budget = st.number_input("Demo token budget", min_value=100, max_value=20000, value=1500, step=100)
+
     # 4. Run predictions based on the selected method.
     if st.button("Run Prediction"):
+        demo_selector = None
+        if retrieve_demos and st.session_state.model is not None:
+            from src.demo_retrieval import DemoSelector
+
+            demo_selector = DemoSelector(get_demo_index(), k=demo_k, max_demo_tokens=int(demo_budget))
+        model = with_demo_selector(st.session_state.model, demo_selector)
+        metrics_mark = get_lm_metrics().mark()
         if st.session_state.model is None:
             st.error("Please load the trained model first!")
+        elif method == "Full Corpus (streaming, resumable)":
+            # Each prediction is appended to the JSONL file as soon as it is produced;
+            # rows already in the file are skipped, so an interrupted run picks up where it stopped.
+            stream_path = "./data/output/extracted_cause_effect.jsonl"
+            # Progress is shown in one status line, refreshed at most twice a second.
+            progress = Progress(StreamlitSink(), min_interval=0.5)
+            table = st.empty()
+            recent = deque(maxlen=preview_rows)
+            processed = 0
+            last_render = 0.0
+            for record in stream_predict_cause_effect(corpus_path, model, stream_path,
+                                                      text_col='Text', max_workers=max_workers, progress=progress):
+                processed += 1
+                recent.append(record)
+                if time.monotonic() - last_render >= 0.5:
+                    table.dataframe(pd.DataFrame(recent))
+                    last_render = time.monotonic()
+            table.dataframe(pd.DataFrame(recent))
+            st.success(f"Streaming run finished: {processed} new predictions appended to {stream_path}")
+            num_pairs = jsonl_to_pairs_parquet(stream_path, DEFAULT_PAIRS_PATH)
+            st.write(f"{num_pairs} cause/effect pairs written to {DEFAULT_PAIRS_PATH}")
         else:
+            progress = Progress(StreamlitSink(), min_interval=0.5)
+            df_selected = read_csv_cached(corpus_path, nrows=int(num_rows))
             if method == "Full Text":
-                results_df = predict_cause_effect(df_infer.head(5), st.session_state.model, text_col='Text')
+                rows = iter_predict_cause_effect(df_selected, model, text_col='Text',
+                                                 max_workers=max_workers, progress=progress)
             else:  # Chunked Text
                 # Here, you can adjust the chunk size and overlap as needed.
-                results_df = predict_cause_effect_with_chunking(df_infer.head(5), st.session_state.model, text_col='Text', chunk_size=4, overlap=1)
-            
-            st.write("Prediction Results Preview:")
-            st.write(results_df.head())
+                rows = iter_predict_cause_effect_with_chunking(df_selected, model, text_col='Text',
+                                                               chunk_size=4, overlap=1, max_workers=max_workers,
+                                                               progress=progress)
 
-            # Automatically save the results to disk for later review.
+            # Results are shown and written to disk as they arrive: the live table is
+            # refreshed at most twice a second and rows are flushed to the files with it.
+            st.write("Prediction Results Preview:")
+            table = st.empty()
+            recent = deque(maxlen=preview_rows)
             results_path = "./data/output/extracted_cause_effect.csv"
-            results_df.to_csv(results_path, index=False)
-            st.success(f"Predictions saved to {results_path}")
-
-            # Provide an option for the user to download the CSV.
-            results_csv = results_df.to_csv(index=False)
-            st.download_button(
-                label="Download Predictions as CSV",
-                data=results_csv,
-                file_name="cause_effect_predictions.csv",
-                mime="text/csv"
-            )
+            last_render = 0.0
+            with ResultWriter(results_path, pairs_path=DEFAULT_PAIRS_PATH) as writer:
+                for row in rows:
+                    writer.add(row)
+                    recent.append(row)
+                    if time.monotonic() - last_render >= 0.5:
+                        writer.flush()
+                        table.dataframe(pd.DataFrame(recent))
+                        last_render = time.monotonic()
+            table.dataframe(pd.DataFrame(recent))
+            if method == "Chunked Text":
+                st.write(f"LM calls: {progress.counters['lm_calls']} "
+                         f"(saved {progress.counters['lm_calls_saved']} by deduplicating repeated chunks)")
+            st.success(f"{writer.rows_written} predictions saved to {results_path} "
+                       f"({writer.pairs_written} pairs in {DEFAULT_PAIRS_PATH})")
+
+            # The download is served from the file written above rather than a second serialization.
+            with open(results_path, "rb") as results_file:
+                st.download_button(
+                    label="Download Predictions as CSV",
+                    data=results_file,
+                    file_name="cause_effect_predictions.csv",
+                    mime="text/csv"
+                )
+
+        if demo_selector is not None and demo_selector.stats()["calls"]:
+            stats = demo_selector.stats()
+            st.write(f"Demo retrieval: {stats['avg_demos']:.1f} demos per call, "
+                     f"{stats['saved_tokens']} of {stats['fixed_demo_tokens']} demo prompt tokens saved "
+                     f"({stats['saved_fraction']:.0%}) compared to the model's fixed demos.")
+
+        # Throughput, tokens and cost of this run's LM calls, also saved as a metrics file.
+        run_records = get_lm_metrics().records(since=metrics_mark)
+        if run_records:
+            with st.expander("LM calls for this run", expanded=True):
+                render_lm_metrics(run_records)
+            get_lm_metrics().export(DEFAULT_METRICS_PATH, since=metrics_mark)
@@ -1,33 +1,82 @@
 # pages/3_Review_Results.py
+import math
+import os
 import streamlit as st
 import pandas as pd
+from src.resources import get_review_store
+from src.review_store import EDITABLE_COLUMNS
 
 st.title("Review/Feedback on Predictions")
 
-# Define the path to the saved predictions CSV.
+# Define the paths to the saved predictions: one row per cause/effect pair (Parquet),
+# falling back to the per-text CSV written by older runs. Mapped driver categories are
+# joined on the cause text when available.
+pred_pairs_path = "./data/output/extracted_cause_effect_pairs.parquet"
 pred_csv_path = "./data/output/extracted_cause_effect.csv"
+mapped_path = "./data/mapped_categories.csv"
+source_path = pred_pairs_path if os.path.exists(pred_pairs_path) else pred_csv_path
 
-# Try to load the predictions from disk.
 try:
-    df_pred = pd.read_csv(pred_csv_path)
-    st.write("### Preview of Predictions")
-    st.dataframe(df_pred.head(20))
-    
-    # Show basic summary statistics.
-    st.write("### Summary Metrics")
-    st.write(f"Total records: {len(df_pred)}")
-    
-    if 'PredictedCause' in df_pred.columns:
-        st.write("#### Count by Predicted Cause")
-        st.dataframe(df_pred['PredictedCause'].value_counts().reset_index().rename(columns={'index': 'Cause', 'PredictedCause': 'Count'}))
-    
-    if 'PredictedEffect' in df_pred.columns:
-        st.write("#### Count by Predicted Effect")
-        st.dataframe(df_pred['PredictedEffect'].value_counts().reset_index().rename(columns={'index': 'Effect', 'PredictedEffect': 'Count'}))
-    
-    # Optionally, allow further interactive review:
-    st.write("### Detailed Data")
-    st.data_editor(df_pred, num_rows="dynamic")
-    
+    # The predictions are imported into a local SQLite store once per version of the file;
+    # everything below is a paginated or aggregated query against it.
+    store = get_review_store()
+    with st.spinner("Indexing predictions..."):
+        store.sync(source_path)
+        if os.path.exists(mapped_path):
+            store.attach_categories(mapped_path)
 except Exception as e:
-    st.error(f"Error loading predictions from {pred_csv_path}: {e}")
+    st.error(f"Error loading predictions from {source_path}: {e}")
+    st.stop()
+
+# --- Filters ---
+st.sidebar.subheader("Filters")
+all_label = "(all)"
+don_id = st.sidebar.selectbox("DonId", [all_label] + store.distinct("DonId"))
+cause_query = st.sidebar.text_input("Cause contains")
+causality_type = st.sidebar.selectbox("Causality type", [all_label] + store.distinct("type"))
+category = st.sidebar.selectbox("Driver category", [all_label] + store.distinct("category"))
+filters = {
+    "don_id": None if don_id == all_label else don_id,
+    "cause": cause_query or None,
+    "type": None if causality_type == all_label else causality_type,
+    "category": None if category == all_label else category,
+}
+
+# --- Summary metrics (cached in the store until the data or the edits change) ---
+total = store.count(filters)
+st.write("### Summary Metrics")
+st.write(f"Matching pairs: {total} (of {len(store)} in {source_path})")
+summary_tabs = st.tabs(["Cause", "Effect", "Causality Type", "Driver Category"])
+for tab, column in zip(summary_tabs, ["cause", "effect", "type", "category"]):
+    with tab:
+        st.dataframe(store.value_counts(column, filters=filters))
+
+# --- Paginated detail view with editing ---
+st.write("### Detailed Data")
+page_size = st.selectbox("Rows per page", [25, 50, 100, 200], index=1)
+num_pages = max(1, math.ceil(total / page_size))
+page = st.number_input(f"Page (1-{num_pages})", min_value=1, max_value=num_pages, value=1) - 1
+df_page = store.fetch_page(page, page_size, filters=filters)
+edited = st.data_editor(
+    df_page,
+    disabled=[column for column in df_page.columns if column not in EDITABLE_COLUMNS],
+    hide_index=True,
+    key=f"review_page_{page}_{page_size}_{sorted(filters.items())}",
+)
+
+# Only the changed cells are stored, as entries of the edit log.
+changes = []
+for (_, before), (_, after) in zip(df_page.iterrows(), edited.iterrows()):
+    for column in EDITABLE_COLUMNS:
+        old, new = before[column], after[column]
+        if not (pd.isna(old) and pd.isna(new)) and old != new:
+            changes.append((int(before["id"]), column, None if pd.isna(new) else str(new)))
+if changes:
+    st.write(f"{len(changes)} unsaved change(s).")
+if st.button("Save edits", disabled=not changes):
+    saved = store.apply_edits(changes)
+    st.success(f"Saved {saved} edit(s) to the review log.")
+    st.rerun()
+
+with st.expander("Edit log"):
+    st.dataframe(store.edit_log())
@@ -0,0 +1,6 @@
+# src/__main__.py
+import sys
+
+from src.cli import main
+
+sys.exit(main())
@@ -0,0 +1,250 @@
+# src/category_index.py
+import json
+import os
+from collections import deque
+
+import numpy as np
+
+from src.embedding_service import QuantizedVectors, embedding_settings
+from src.embedding_store import DEFAULT_EMBEDDING_MODEL, get_embedding_store
+
+DEFAULT_DRIVERS_PATH = "./data/drivers.xlsx"
+DEFAULT_DRIVERS_SHEET = "only consolidated names"
+DEFAULT_DRIVERS_COLUMN = "Consolidated Name"
+DEFAULT_INDEX_PATH = "./data/cache/category_index.npz"
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+class _Automaton:
+    """
+    Aho-Corasick automaton over lowercased category names.
+    Each node stores the ids of the patterns ending there (including via failure links),
+    so one pass over the text reports every occurrence of every category.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = patterns
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        for pattern_id, pattern in enumerate(patterns):
+            node = 0
+            for ch in pattern:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                node = nxt
+            self.out[node].append(pattern_id)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(ch, 0)
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+    def iter_matches(self, text: str):
+        """
+        Yields (start, end, pattern_id) for every occurrence of every pattern in text.
+        """
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            for pattern_id in self.out[node]:
+                yield i + 1 - len(self.patterns[pattern_id]), i + 1, pattern_id
+
+
+class CategoryIndex:
+    """
+    Precompiled index over the driver categories from drivers.xlsx.
+
+    - lookup: O(1) exact or normalized (case/whitespace-insensitive) category lookup.
+    - find: Aho-Corasick multi-pattern search for category names inside free text,
+      restricted to whole words and preferring the leftmost, then longest, match.
+    - vectors: L2-normalized category embeddings, so cosine similarity against them is a
+      single matrix product; kept as float32, float16 or int8 (precision), in which case
+      top_k re-scores the best candidates with the exact vectors from the embedding store.
+
+    The index can be saved to and loaded from a single .npz file.
+    """
+
+    def __init__(self, categories, embeddings=None, model_name: str = DEFAULT_EMBEDDING_MODEL, source_signature=None,
+                 precision: str = None):
+        self.categories = [str(cat).strip() for cat in categories]
+        self.model_name = model_name
+        self.source_signature = source_signature
+        if isinstance(embeddings, QuantizedVectors):
+            precision = embeddings.precision
+        self.precision = precision or embedding_settings()["precision"]
+        self._exact = {cat: cat for cat in self.categories}
+        self._normalized = {}
+        for cat in self.categories:
+            self._normalized.setdefault(self.normalize(cat), cat)
+        self._automaton = _Automaton([self.normalize(cat) for cat in self.categories])
+        if embeddings is None or isinstance(embeddings, QuantizedVectors):
+            self._vectors = embeddings
+        else:
+            self._vectors = QuantizedVectors.from_float(embeddings, self.precision)
+
+    def __len__(self) -> int:
+        return len(self.categories)
+
+    @staticmethod
+    def normalize(text) -> str:
+        return " ".join(str(text).lower().split())
+
+    @classmethod
+    def from_excel(cls, path: str = DEFAULT_DRIVERS_PATH, sheet_name: str = DEFAULT_DRIVERS_SHEET,
+                   column: str = DEFAULT_DRIVERS_COLUMN, model_name: str = DEFAULT_EMBEDDING_MODEL,
+                   precision: str = None):
+        """
+        Builds the index from the driver sheet (unique, non-empty consolidated names).
+        """
+        import pandas as pd
+
+        driver_cat = pd.read_excel(path, sheet_name=sheet_name)
+        categories = [str(cat).strip() for cat in driver_cat[column].dropna().unique().tolist()]
+        return cls(categories, model_name=model_name, source_signature=file_signature(path), precision=precision)
+
+    @property
+    def vectors(self) -> QuantizedVectors:
+        """
+        Normalized category embeddings at self.precision, computed on first use through the shared embedding store.
+        """
+        if self._vectors is None:
+            self._vectors = QuantizedVectors.from_float(self._exact_rows(range(len(self.categories))), self.precision)
+        return self._vectors
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """
+        Normalized category embedding matrix as float32 (dequantized for float16/int8).
+        """
+        return self.vectors.dequantize()
+
+    def _exact_rows(self, rows) -> np.ndarray:
+        vectors = get_embedding_store(self.model_name).encode([self.categories[i] for i in rows])
+        return _normalize_rows(vectors)
+
+    def lookup(self, text):
+        """
+        Returns the category equal to text, ignoring case and extra whitespace, or None.
+        """
+        category = self._exact.get(text)
+        if category is not None:
+            return category
+        return self._normalized.get(self.normalize(text))
+
+    def find_all(self, text: str) -> list:
+        """
+        Returns non-overlapping whole-word category mentions in text as (start, end, category),
+        scanning left to right and taking the longest category at each position.
+        Offsets refer to the lowercased, whitespace-normalized text.
+        """
+        normalized = self.normalize(text)
+        candidates = []
+        for start, end, pattern_id in self._automaton.iter_matches(normalized):
+            pattern = self._automaton.patterns[pattern_id]
+            if _is_word_char(pattern[0]) and start > 0 and _is_word_char(normalized[start - 1]):
+                continue
+            if _is_word_char(pattern[-1]) and end < len(normalized) and _is_word_char(normalized[end]):
+                continue
+            candidates.append((start, end, self.categories[pattern_id]))
+        candidates.sort(key=lambda match: (match[0], -(match[1] - match[0])))
+        selected = []
+        last_end = -1
+        for start, end, category in candidates:
+            if start >= last_end:
+                selected.append((start, end, category))
+                last_end = end
+        return selected
+
+    def find(self, text: str):
+        """
+        Returns the leftmost-longest category mentioned in text, or None.
+        """
+        matches = self.find_all(text)
+        return matches[0][2] if matches else None
+
+    def similarities(self, vectors) -> np.ndarray:
+        """
+        Cosine similarity of each row in vectors against every category.
+        """
+        return self.vectors.similarities(_normalize_rows(np.asarray(vectors, dtype=np.float32)))
+
+    def top_k(self, vectors, k: int = 2, rescore: bool = True):
+        """
+        Returns (scores, indices) of the k most similar categories per row, best first.
+        With reduced precision and rescore, the best candidates get their exact scores.
+        """
+        return self.vectors.top_k(_normalize_rows(np.asarray(vectors, dtype=np.float32)), k=k,
+                                  exact_rows=self._exact_rows if rescore else None)
+
+    def save(self, path: str = DEFAULT_INDEX_PATH):
+        """
+        Writes categories, embeddings and metadata to a .npz file.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        meta = {"model_name": self.model_name, "source_signature": self.source_signature}
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                categories=np.array(self.categories, dtype=str),
+                meta=np.array(json.dumps(meta)),
+                **self.vectors.to_arrays(),
+            )
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_INDEX_PATH):
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            return cls(
+                data["categories"].tolist(),
+                embeddings=QuantizedVectors.from_arrays(data),
+                model_name=meta["model_name"],
+                source_signature=meta["source_signature"],
+            )
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def file_signature(path: str) -> list:
+    """
+    Returns [mtime_ns, size] of a file, used to detect that a source file changed.
+    """
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def load_or_build_category_index(drivers_path: str = DEFAULT_DRIVERS_PATH, index_path: str = DEFAULT_INDEX_PATH,
+                                 model_name: str = DEFAULT_EMBEDDING_MODEL, precision: str = None) -> CategoryIndex:
+    """
+    Loads the serialized category index if it was built from the current drivers file
+    with the same model and precision (default: embedding_settings()), otherwise rebuilds
+    it from the Excel sheet and saves it.
+    """
+    precision = precision or embedding_settings()["precision"]
+    if os.path.exists(index_path):
+        index = CategoryIndex.load(index_path)
+        if (index.source_signature == file_signature(drivers_path) and index.model_name == model_name
+                and index.precision == precision):
+            return index
+    index = CategoryIndex.from_excel(drivers_path, model_name=model_name, precision=precision)
+    index.save(index_path)
+    return index
@@ -0,0 +1,362 @@
+# src/cli.py
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+DEFAULT_MODEL_PATH = "./models/cause_effect_model.json"
+
+logger = logging.getLogger(__name__)
+
+
+def _load_examples(json_path: str, sample: int = None, seed: int = 42) -> list:
+    """
+    Reads a train/dev JSON file into dspy.Example objects with "text" as input.
+    """
+    import dspy
+
+    from src.data_utils import load_train_data
+
+    examples = [
+        dspy.Example(
+            text=row["text"],
+            marked_text=row["marked_text"],
+            extracted_pairs=row["extracted_pairs"]
+        ).with_inputs("text")
+        for _, row in load_train_data(json_path).iterrows()
+    ]
+    if sample and sample < len(examples):
+        examples = random.Random(seed).sample(examples, sample)
+    return examples
+
+
+def _rate_limiter(args):
+    from src.concurrency import RateLimiter
+
+    if not (args.requests_per_minute or args.tokens_per_minute):
+        return None
+    return RateLimiter(requests_per_minute=args.requests_per_minute, tokens_per_minute=args.tokens_per_minute)
+
+
+def _demo_selector(args):
+    from src.demo_retrieval import DemoSelector, load_or_build_demo_index
+
+    if not args.retrieve_demos:
+        return None
+    index = load_or_build_demo_index(args.demo_train_path)
+    logger.info("Retrieving up to %d demos per input from %d training examples (budget %d tokens)",
+                args.retrieve_demos, len(index), args.demo_token_budget)
+    return DemoSelector(index, k=args.retrieve_demos, max_demo_tokens=args.demo_token_budget)
+
+
+def _log_demo_savings(selector):
+    if selector is None:
+        return
+    stats = selector.stats()
+    logger.info("Demo retrieval: %.1f demos/call, %d of %d fixed-demo prompt tokens saved (%.0f%%)",
+                stats["avg_demos"], stats["saved_tokens"], stats["fixed_demo_tokens"], 100 * stats["saved_fraction"])
+
+
+def cmd_train(args):
+    from src.model_pipeline import build_and_train_model
+
+    train_examples = _load_examples(args.train_path, sample=args.sample, seed=args.seed)
+    logger.info("Training on %d examples from %s", len(train_examples), args.train_path)
+    if args.search:
+        from src.model_search import save_search_results, search_few_shot_models
+
+        dev_examples = _load_examples(args.dev_path)
+        best, leaderboard, programs = search_few_shot_models(
+            train_examples, dev_examples, k_values=args.k_values, subsets_per_k=args.subsets,
+            bootstrap=args.bootstrap, metric=args.metric, max_workers=args.max_workers,
+            rate_limiter=_rate_limiter(args), lm_model=args.lm,
+        )
+        if best is None:
+            raise SystemExit("No candidates to search: --k-values needs a positive k "
+                             "and the training set at least one example")
+        print(leaderboard.to_string(index=False))
+        leaderboard_path = save_search_results(best, leaderboard, args.output, programs=programs,
+                                               candidates_dir=args.candidates_dir)
+        logger.info("Best candidate %s saved to %s, leaderboard in %s",
+                    leaderboard.loc[0, "name"], args.output, leaderboard_path)
+        return
+    model = build_and_train_model(train_examples, lm_model=args.lm)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    model.save(args.output)
+    logger.info("Model saved to %s", args.output)
+
+
+def cmd_infer(args):
+    from src.data_utils import iter_inference_data
+    from src.model_pipeline import (
+        load_model,
+        predict_cause_effect,
+        predict_cause_effect_with_chunking,
+        stream_predict_cause_effect,
+    )
+    from src.columnar import PairParquetWriter, jsonl_to_pairs_parquet
+    from src.progress import Progress
+
+    if args.output is None:
+        args.output = "./data/output/extracted_cause_effect" + (".jsonl" if args.method == "stream" else ".csv")
+    elif args.method == "stream" and args.output.endswith(".csv"):
+        # Readers of a .csv path would choke on the JSONL records.
+        raise SystemExit(f"--method stream writes JSONL; use an --output path not ending in .csv (got {args.output})")
+    demo_selector = _demo_selector(args)
+    model = load_model(args.model, use_cache=not args.no_cache, lm_model=args.lm, demo_selector=demo_selector)
+    rate_limiter = _rate_limiter(args)
+    # Per-row progress goes to the default (log) sink, at most every --log-interval seconds.
+    progress = Progress(min_interval=args.log_interval)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    start = time.perf_counter()
+    processed = 0
+
+    if args.method == "stream":
+        for _ in stream_predict_cause_effect(
+            args.input, model, args.output, text_col=args.text_col, key_col=args.key_col,
+            chunksize=args.batch_size, max_rows=args.max_rows,
+            max_workers=args.max_workers, rate_limiter=rate_limiter, progress=progress,
+        ):
+            processed += 1
+        if args.pairs_output:
+            num_pairs = jsonl_to_pairs_parquet(args.output, args.pairs_output)
+            logger.info("%d pairs written to %s", num_pairs, args.pairs_output)
+    else:
+        # Batches are predicted and appended to the output CSV one at a time, so memory
+        # stays bounded by --batch-size rather than by the corpus size.
+        header = True
+        remaining = args.max_rows
+        pairs_writer = PairParquetWriter(args.pairs_output) if args.pairs_output else None
+        for batch in iter_inference_data(args.input, chunksize=args.batch_size):
+            if remaining is not None:
+                batch = batch.head(remaining)
+            if args.method == "chunked":
+                results = predict_cause_effect_with_chunking(
+                    batch, model, text_col=args.text_col, chunk_size=args.chunk_size, overlap=args.overlap,
+                    max_tokens=args.max_tokens, merge=args.merge, near_duplicates=args.near_duplicates,
+                    max_workers=args.max_workers, rate_limiter=rate_limiter, progress=progress,
+                )
+            else:
+                results = predict_cause_effect(
+                    batch, model, text_col=args.text_col, max_workers=args.max_workers, rate_limiter=rate_limiter,
+                    progress=progress,
+                )
+            results.to_csv(args.output, mode="w" if header else "a", header=header, index=False)
+            header = False
+            if pairs_writer is not None:
+                pairs_writer.write(results)
+            processed += len(batch)
+            logger.info("%d rows processed (%.1f rows/s)", processed, processed / (time.perf_counter() - start))
+            if remaining is not None:
+                remaining -= len(batch)
+                if remaining <= 0:
+                    break
+        if pairs_writer is not None:
+            pairs_writer.close()
+            logger.info("%d pairs written to %s", pairs_writer.rows_written, args.pairs_output)
+    logger.info("Done: %d rows in %.1fs, predictions in %s", processed, time.perf_counter() - start, args.output)
+    _log_demo_savings(demo_selector)
+
+
+def cmd_evaluate(args):
+    from src.evaluation import (
+        extracted_pairs_exact_match,
+        extracted_pairs_semantic_match,
+        run_multi_metric_evaluation,
+    )
+    from src.model_pipeline import load_model
+    from src.pairs import parse_stats
+
+    metrics = {"exact": extracted_pairs_exact_match, "semantic": extracted_pairs_semantic_match}
+    dev_examples = _load_examples(args.dev_path, sample=args.sample, seed=args.seed)
+    demo_selector = _demo_selector(args)
+    model = load_model(args.model, use_cache=not args.no_cache, lm_model=args.lm, demo_selector=demo_selector)
+    summary, _ = run_multi_metric_evaluation(
+        model,
+        dev_examples,
+        metrics=[metrics[name] for name in args.metrics],
+        max_workers=args.max_workers,
+        rate_limiter=_rate_limiter(args),
+        output_dir=args.output_dir,
+    )
+    for name, score in summary.items():
+        print(f"{name}: {score}%")
+    print(f"parse_stats: {parse_stats()}")
+    if demo_selector is not None:
+        print(f"demo_retrieval: {demo_selector.stats()}")
+
+
+def cmd_map(args):
+    from config import configure_lm
+    from src.category_index import load_or_build_category_index
+    from src.columnar import write_table
+    from src.mapping import CauseCategorizationModule, load_extracted_causes
+
+    configure_lm(args.lm)
+    index = load_or_build_category_index(args.drivers)
+    result_df = load_extracted_causes(args.input)
+    if args.max_rows is not None:
+        result_df = result_df.head(args.max_rows)
+    categorizer = CauseCategorizationModule(
+        index, fast_path=not args.no_fast_path, min_similarity=args.min_similarity, min_margin=args.min_margin
+    )
+    # Categorize in batches so progress is visible; identical causes within a batch
+    # cost one call, and repeats across batches are answered by the LM response cache.
+    categories = []
+    causes = result_df[args.cause_col].tolist()
+    for start in range(0, len(causes), args.batch_size):
+        categories.extend(categorizer.categorize_many(causes[start:start + args.batch_size],
+                                                      max_workers=args.max_workers))
+        logger.info("%d/%d causes categorized", len(categories), len(causes))
+    result_df = result_df.assign(Cause_driver_category=categories)
+    write_table(result_df, args.output)
+    print(categorizer.tier_stats().to_string(index=False))
+    logger.info("Categorized causes saved to %s", args.output)
+
+
+def _add_common_arguments(parser, batch_size: int):
+    parser.add_argument("--lm", default="", help='LM backend passed to configure_lm: "openai", "pool" or "" for local Llama.')
+    parser.add_argument("--max-workers", type=int, default=4, help="Concurrent LM requests.")
+    parser.add_argument("--batch-size", type=int, default=batch_size, help="Rows processed per batch.")
+    parser.add_argument("--max-rows", type=int, default=None, help="Stop after this many rows.")
+    parser.add_argument("--requests-per-minute", type=float, default=None, help="Throttle LM requests.")
+    parser.add_argument("--tokens-per-minute", type=float, default=None, help="Throttle LM tokens (estimated).")
+    parser.add_argument("--lm-metrics", default=None, metavar="PATH",
+                        help="Write per-stage LM latency/token/cost metrics to this JSON file.")
+    parser.add_argument("--lm-calls", default=None, metavar="PATH",
+                        help="Also append one JSON line per LM call to this file.")
+
+
+def _add_demo_arguments(parser):
+    parser.add_argument("--retrieve-demos", type=int, default=None, metavar="K",
+                        help="Use the K training examples nearest to each input as demos instead of the saved ones.")
+    parser.add_argument("--demo-token-budget", type=int, default=1500, help="Max demo tokens per prompt.")
+    parser.add_argument("--demo-train-path", default="./data/train_set.json", help="Examples to retrieve demos from.")
+
+
+def _add_embedding_arguments(parser):
+    parser.add_argument("--embedding-workers", type=int, default=None,
+                        help="Processes encoding large embedding jobs (default EMBEDDING_WORKERS, 1 = in-process).")
+    parser.add_argument("--embedding-batch-size", type=int, default=None, help="Texts per embedding batch.")
+    parser.add_argument("--embedding-precision", choices=["float32", "float16", "int8"], default=None,
+                        help="Precision of the category/demo vectors and the embedding cache; int8 re-scores the top matches.")
+
+
+def _configure_embeddings(args):
+    from src.embedding_service import configure_embeddings
+
+    configure_embeddings(batch_size=args.embedding_batch_size, num_workers=args.embedding_workers,
+                         precision=args.embedding_precision)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m src", description="Headless cause/effect extraction pipeline.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log debug output of the pipeline modules.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train = subparsers.add_parser("train", help="Compile the few-shot model and save it.")
+    train.add_argument("--train-path", default="./data/train_set.json")
+    train.add_argument("--output", default=DEFAULT_MODEL_PATH)
+    train.add_argument("--sample", type=int, default=None, help="Train on a random sample of this size.")
+    train.add_argument("--seed", type=int, default=42)
+    train.add_argument("--search", action="store_true",
+                       help="Compile several few-shot candidates, score them on --dev-path and keep the best.")
+    train.add_argument("--dev-path", default="./data/dev_set.json")
+    train.add_argument("--k-values", type=int, nargs="+", default=[3, 5, 7], help="Demo counts to try.")
+    train.add_argument("--subsets", type=int, default=2, help="Random demo subsets per k.")
+    train.add_argument("--bootstrap", action="store_true", help="Also try BootstrapFewShot per k.")
+    train.add_argument("--metric", choices=["semantic", "exact"], default="semantic", help="Ranking metric.")
+    train.add_argument("--candidates-dir", default=None, help="Also save every candidate program here.")
+    train.add_argument("--max-workers", type=int, default=4, help="Concurrent LM requests during --search.")
+    train.add_argument("--requests-per-minute", type=float, default=None, help="Throttle LM requests.")
+    train.add_argument("--tokens-per-minute", type=float, default=None, help="Throttle LM tokens (estimated).")
+    train.add_argument("--lm", default="", help='LM backend passed to configure_lm: "openai", "pool" or "" for local Llama.')
+    _add_embedding_arguments(train)
+    train.set_defaults(func=cmd_train)
+
+    infer = subparsers.add_parser("infer", help="Extract cause/effect pairs from a corpus CSV.")
+    infer.add_argument("--model", default=DEFAULT_MODEL_PATH)
+    infer.add_argument("--input", default="./data/corpus.csv")
+    infer.add_argument("--output", default=None,
+                       help="CSV for the full/chunked methods (default ./data/output/extracted_cause_effect.csv), "
+                            "JSONL for stream (default ./data/output/extracted_cause_effect.jsonl).")
+    infer.add_argument("--method", choices=["full", "chunked", "stream"], default="full",
+                       help="stream appends JSONL records and resumes an interrupted run.")
+    infer.add_argument("--pairs-output", default=None,
+                       help="Also write one row per cause/effect pair to this Parquet file.")
+    infer.add_argument("--text-col", default="Text")
+    infer.add_argument("--key-col", default="OriginalIndex", help="Resume key for --method stream.")
+    infer.add_argument("--chunk-size", type=int, default=4, help="Sentences per chunk.")
+    infer.add_argument("--overlap", type=int, default=1, help="Overlapping sentences between chunks.")
+    infer.add_argument("--max-tokens", type=int, default=None, help="Pack chunks by LM tokens instead.")
+    infer.add_argument("--merge", action="store_true", help="One row per document with merged pairs.")
+    infer.add_argument("--near-duplicates", action="store_true", help="Also reuse near-duplicate chunks.")
+    infer.add_argument("--no-cache", action="store_true", help="Bypass the LM response cache.")
+    infer.add_argument("--log-interval", type=float, default=10.0, help="Seconds between progress log lines.")
+    _add_common_arguments(infer, batch_size=500)
+    _add_demo_arguments(infer)
+    _add_embedding_arguments(infer)
+    infer.set_defaults(func=cmd_infer)
+
+    evaluate = subparsers.add_parser("evaluate", help="Score a saved model on a dev set.")
+    evaluate.add_argument("--model", default=DEFAULT_MODEL_PATH)
+    evaluate.add_argument("--dev-path", default="./data/dev_set.json")
+    evaluate.add_argument("--metrics", nargs="+", choices=["exact", "semantic"], default=["exact", "semantic"])
+    evaluate.add_argument("--output-dir", default="./data/output")
+    evaluate.add_argument("--sample", type=int, default=None, help="Evaluate on a random sample of this size.")
+    evaluate.add_argument("--seed", type=int, default=42)
+    evaluate.add_argument("--no-cache", action="store_true", help="Bypass the LM response cache.")
+    _add_common_arguments(evaluate, batch_size=500)
+    _add_demo_arguments(evaluate)
+    _add_embedding_arguments(evaluate)
+    evaluate.set_defaults(func=cmd_evaluate)
+
+    mapping = subparsers.add_parser("map", help="Map extracted causes onto driver categories.")
+    mapping.add_argument("--input", default="./data/result_df_31_Oct.csv")
+    mapping.add_argument("--drivers", default="./data/drivers.xlsx")
+    mapping.add_argument("--output", default="./data/mapped_categories.csv", help="Parquet if it ends with .parquet.")
+    mapping.add_argument("--cause-col", default="Cause_by_OpenAI")
+    mapping.add_argument("--no-fast-path", action="store_true", help="Send every cause to the LLM.")
+    mapping.add_argument("--min-similarity", type=float, default=0.6)
+    mapping.add_argument("--min-margin", type=float, default=0.1)
+    _add_common_arguments(mapping, batch_size=2000)
+    _add_embedding_arguments(mapping)
+    mapping.set_defaults(func=cmd_map)
+    return parser
+
+
+def _report_lm_metrics(args):
+    from src.lm_metrics import get_lm_metrics
+
+    metrics = get_lm_metrics()
+    if not len(metrics):
+        return
+    total = metrics.summary().iloc[0]
+    logger.info("LM calls: %d (%d cached, %d errors), %d prompt + %d completion tokens, est. $%.4f, p95 %.2fs",
+                total["calls"], total["cache_hits"], total["errors"], total["prompt_tokens"],
+                total["completion_tokens"], total["cost_usd"], total["p95_s"])
+    if getattr(args, "lm_metrics", None):
+        metrics.export(args.lm_metrics, records_path=args.lm_calls)
+        logger.info("LM metrics written to %s", args.lm_metrics)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+    if not args.verbose:
+        # Keep the pipeline's own messages but not the per-request chatter of the LM client.
+        for name in ("LiteLLM", "httpx", "httpcore"):
+            logging.getLogger(name).setLevel(logging.WARNING)
+    _configure_embeddings(args)
+    args.func(args)
+    _report_lm_metrics(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
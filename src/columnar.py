@@ -0,0 +1,237 @@
+# src/columnar.py
+import json
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.pairs import parse_pairs
+
+DEFAULT_PAIRS_PATH = "./data/output/extracted_cause_effect_pairs.parquet"
+
+# One row per extracted cause/effect pair (long format). Pairs from chunked inference
+# keep the chunk they came from; merged pairs also keep where the spans start in the text.
+PAIRS_SCHEMA = pa.schema([
+    ("OriginalIndex", pa.int64()),
+    ("DonId", pa.string()),
+    ("pair_index", pa.int32()),
+    ("cause", pa.string()),
+    ("effect", pa.string()),
+    ("cause_polarity", pa.string()),
+    ("effect_polarity", pa.string()),
+    ("type", pa.string()),
+    ("chunk_start", pa.int64()),
+    ("chunk_end", pa.int64()),
+    ("sentence_ids", pa.list_(pa.int32())),
+    ("cause_start", pa.int64()),
+    ("effect_start", pa.int64()),
+])
+PAIR_FIELDS = ["cause", "effect", "cause_polarity", "effect_polarity", "type"]
+
+
+def _as_pairs(value) -> list:
+    if isinstance(value, list):
+        return value
+    if isinstance(value, str):
+        return [pair.to_dict() for pair in parse_pairs(value)]
+    return []
+
+
+def _optional(value):
+    return None if value is None or (isinstance(value, float) and pd.isna(value)) else value
+
+
+def _optional_str(value):
+    value = _optional(value)
+    return None if value is None else str(value)
+
+
+def _optional_int(value):
+    # CSV columns with missing values come back as floats (e.g. ChunkStart 120.0).
+    value = _optional(value)
+    return None if value is None else int(value)
+
+
+def _sentence_ids(value):
+    # A predictions CSV holds the list as its string form, e.g. "[0, 1]".
+    value = _optional(value)
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return None
+    if value is None:
+        return None
+    return [int(sentence_id) for sentence_id in value]
+
+
+def pairs_to_table(results_df: pd.DataFrame, pairs_col: str = "PredictedExtractedPairs") -> pa.Table:
+    """
+    Converts prediction rows (full text, chunked or merged) into the long PAIRS_SCHEMA table.
+    The pairs and SentenceIds columns may hold lists or their string form (as read back from a
+    predictions CSV); strings are parsed once here, so readers of the Parquet file never have to
+    literal_eval anything.
+    """
+    rows = []
+    for record in results_df.to_dict("records"):
+        sentence_ids = _sentence_ids(record.get("SentenceIds"))
+        for pair_index, pair in enumerate(_as_pairs(record.get(pairs_col))):
+            if not isinstance(pair, dict):
+                continue
+            row = {
+                "OriginalIndex": _optional_int(record.get("OriginalIndex")),
+                "DonId": _optional_str(record.get("DonId")),
+                "pair_index": pair_index,
+                "chunk_start": _optional_int(record.get("ChunkStart")),
+                "chunk_end": _optional_int(record.get("ChunkEnd")),
+                "sentence_ids": _sentence_ids(pair["sentence_ids"]) if "sentence_ids" in pair else sentence_ids,
+                "cause_start": pair.get("cause_start"),
+                "effect_start": pair.get("effect_start"),
+            }
+            for field in PAIR_FIELDS:
+                row[field] = _optional_str(pair.get(field))
+            rows.append(row)
+    return pa.Table.from_pylist(rows, schema=PAIRS_SCHEMA)
+
+
+class PairParquetWriter:
+    """
+    Appends prediction batches to one Parquet file of cause/effect pairs. Pairs are buffered
+    until row_group_size of them are pending and then written as one row group, so streaming
+    many small batches doesn't produce thousands of tiny row groups (slow to read column by
+    column), while memory stays bounded by one row group. close() writes what is left.
+    """
+
+    def __init__(self, path: str = DEFAULT_PAIRS_PATH, compression: str = "zstd", row_group_size: int = 64 * 1024):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.row_group_size = row_group_size
+        self.rows_written = 0
+        self._pending = []
+        self._pending_rows = 0
+        self._writer = pq.ParquetWriter(path, PAIRS_SCHEMA, compression=compression)
+
+    def write(self, results_df: pd.DataFrame, pairs_col: str = "PredictedExtractedPairs") -> int:
+        """
+        Adds the pairs of one batch of prediction rows and returns how many pairs it had.
+        rows_written counts them right away; they reach the file with the next full row
+        group or on close().
+        """
+        table = pairs_to_table(results_df, pairs_col=pairs_col)
+        if table.num_rows:
+            self._pending.append(table)
+            self._pending_rows += table.num_rows
+            self.rows_written += table.num_rows
+            if self._pending_rows >= self.row_group_size:
+                self.flush()
+        return table.num_rows
+
+    def flush(self):
+        """
+        Writes the pending pairs as one row group.
+        """
+        if not self._pending_rows:
+            return
+        table = pa.concat_tables(self._pending)
+        self._writer.write_table(table, row_group_size=table.num_rows)
+        self._pending = []
+        self._pending_rows = 0
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ResultWriter:
+    """
+    Writes streamed prediction rows to a CSV file in small batches, so results are on disk
+    while a run is still going and only the current batch is held in memory. The pairs
+    Parquet file, if any, gets them in row groups of PairParquetWriter.row_group_size pairs,
+    the last one on close().
+    """
+
+    def __init__(self, csv_path: str, pairs_path: str = None):
+        os.makedirs(os.path.dirname(csv_path) or ".", exist_ok=True)
+        self.csv_path = csv_path
+        self.rows_written = 0
+        self._buffer = []
+        self._header = True
+        self._pairs = PairParquetWriter(pairs_path) if pairs_path else None
+
+    @property
+    def pairs_written(self) -> int:
+        return self._pairs.rows_written if self._pairs is not None else 0
+
+    def add(self, row: dict):
+        self._buffer.append(row)
+
+    def flush(self):
+        if not self._buffer:
+            return
+        batch = pd.DataFrame(self._buffer)
+        batch.to_csv(self.csv_path, mode="w" if self._header else "a", header=self._header, index=False)
+        if self._pairs is not None:
+            self._pairs.write(batch)
+        self._header = False
+        self.rows_written += len(self._buffer)
+        self._buffer = []
+
+    def close(self):
+        self.flush()
+        if self._header:
+            # Nothing was predicted: still leave an empty file behind.
+            open(self.csv_path, "w").close()
+        if self._pairs is not None:
+            self._pairs.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_pairs_parquet(results_df: pd.DataFrame, path: str = DEFAULT_PAIRS_PATH,
+                        pairs_col: str = "PredictedExtractedPairs") -> int:
+    """
+    Writes the prediction rows as a long-format pairs Parquet file. Returns the number of pairs.
+    """
+    with PairParquetWriter(path) as writer:
+        return writer.write(results_df, pairs_col=pairs_col)
+
+
+def jsonl_to_pairs_parquet(jsonl_path: str, path: str = DEFAULT_PAIRS_PATH, chunksize: int = 1000) -> int:
+    """
+    Converts the JSONL file of a streaming run into the pairs Parquet file, chunksize records at a time.
+    """
+    with PairParquetWriter(path) as writer:
+        if os.path.exists(jsonl_path) and os.path.getsize(jsonl_path):
+            for chunk in pd.read_json(jsonl_path, lines=True, chunksize=chunksize, dtype=False):
+                writer.write(chunk)
+        return writer.rows_written
+
+
+def read_pairs(path: str = DEFAULT_PAIRS_PATH, columns=None, filters=None) -> pd.DataFrame:
+    """
+    Reads the pairs Parquet file, loading only `columns` (all if None) and, with pyarrow
+    `filters` such as [("type", "=", "Type 1")], only the matching row groups and rows.
+    """
+    return pq.read_table(path, columns=list(columns) if columns else None, filters=filters).to_pandas()
+
+
+def write_table(df: pd.DataFrame, path: str):
+    """
+    Saves a result table as Parquet when path ends with .parquet, as CSV otherwise.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if path.endswith(".parquet"):
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
@@ -0,0 +1,112 @@
+# src/concurrency.py
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RateLimiter:
+    """
+    Token-bucket rate limiter for LM traffic.
+    Limits both the number of requests and the (estimated) number of prompt tokens
+    sent per minute. Either limit can be left as None to disable it.
+    Safe to share between worker threads.
+    """
+
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._lock = threading.Lock()
+        self._request_budget = float(requests_per_minute or 0)
+        self._token_budget = float(tokens_per_minute or 0)
+        self._last_refill = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute:
+            self._request_budget = min(
+                self.requests_per_minute,
+                self._request_budget + elapsed * self.requests_per_minute / 60.0,
+            )
+        if self.tokens_per_minute:
+            self._token_budget = min(
+                self.tokens_per_minute,
+                self._token_budget + elapsed * self.tokens_per_minute / 60.0,
+            )
+
+    def acquire(self, tokens: int = 0):
+        """
+        Blocks until one request carrying `tokens` tokens may be sent, then consumes it.
+        A request larger than the whole per-minute token budget is let through once the
+        bucket is full, so it cannot block forever.
+        """
+        while True:
+            with self._lock:
+                self._refill()
+                wait = 0.0
+                if self.requests_per_minute and self._request_budget < 1:
+                    wait = max(wait, (1 - self._request_budget) * 60.0 / self.requests_per_minute)
+                if self.tokens_per_minute:
+                    needed = min(tokens, self.tokens_per_minute)
+                    if self._token_budget < needed:
+                        wait = max(wait, (needed - self._token_budget) * 60.0 / self.tokens_per_minute)
+                if wait == 0.0:
+                    if self.requests_per_minute:
+                        self._request_budget -= 1
+                    if self.tokens_per_minute:
+                        self._token_budget -= min(tokens, self.tokens_per_minute)
+                    return
+            time.sleep(wait)
+
+
+def iter_concurrently(fn, items, max_workers: int = 1, rate_limiter: RateLimiter = None, cost=None):
+    """
+    Applies fn to every item with up to `max_workers` calls in flight and yields the
+    results in input order as soon as they are available.
+
+    Args:
+        fn (callable): Function called once per item (typically one LM request).
+        items (iterable): Inputs; consumed lazily, so generators are fine.
+        max_workers (int): Maximum number of concurrent calls. 1 runs sequentially.
+        rate_limiter (RateLimiter, optional): Shared limiter acquired before each call.
+        cost (callable, optional): Maps an item to its estimated token count for the limiter.
+            Worker threads run fn in a copy of the caller's context, so context variables
+            (such as the LM metric tags of src.lm_metrics) carry over.
+
+    Yields:
+        The result of fn for each item, in the same order as `items`.
+    """
+    def call(item):
+        if rate_limiter is not None:
+            rate_limiter.acquire(cost(item) if cost is not None else 0)
+        return fn(item)
+
+    if max_workers <= 1:
+        for item in items:
+            yield call(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(pool.submit(contextvars.copy_context().run, call, item))
+                # Keep the submission window bounded so huge inputs are not all queued at once.
+                if len(pending) >= 2 * max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # If the consumer stops early, don't start calls nobody will read.
+            for future in pending:
+                future.cancel()
+
+
+def map_concurrently(fn, items, max_workers: int = 1, rate_limiter: RateLimiter = None, cost=None) -> list:
+    """
+    List-returning version of iter_concurrently.
+    """
+    return list(iter_concurrently(fn, items, max_workers=max_workers, rate_limiter=rate_limiter, cost=cost))
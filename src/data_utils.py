@@ -1,5 +1,9 @@
 # src/data_utils.py
+import json
+import os
 import re
+from functools import lru_cache
+from typing import NamedTuple
 import pandas as pd
 
 def load_train_data(json_path: str) -> pd.DataFrame:
@@ -22,6 +26,25 @@ def load_inference_data(csv_path: str) -> pd.DataFrame:
     # Optional: add cleaning or filtering steps (e.g., drop duplicates, handle missing values)
     return df
 
+def iter_inference_data(csv_path: str, chunksize: int = 500):
+    """
+    Read the inference CSV lazily, yielding DataFrames of at most `chunksize` rows.
+    The row index keeps counting across chunks, so it matches the index
+    load_inference_data would have produced for the whole file.
+    """
+    with pd.read_csv(csv_path, chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield chunk
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough LM token count for a piece of text (about 4 characters per token for English).
+    Used for rate limiting, where an approximation is good enough.
+    """
+    if not isinstance(text, str):
+        text = str(text)
+    return max(1, len(text) // 4)
+
 def chunk_text(text: str, chunk_size: int = 200, overlap: int = 20) -> list:
     """
     Splits the text into chunks of a specified size with a given overlap.
@@ -68,4 +91,155 @@ def chunk_text_by_sentences(text: str, chunk_size: int = 4, overlap: int = 1) ->
         # Move index forward but maintain overlap
         i += chunk_size - overlap
     
-    return chunks
\ No newline at end of file
+    return chunks
+
+
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+
+class ChunkRecord(NamedTuple):
+    """
+    Location of one chunk inside its source text. Only offsets are stored;
+    the chunk text is the slice text[start:end] of the original document.
+    """
+    doc_id: object
+    start: int
+    end: int
+    sentence_ids: tuple
+
+    def text_of(self, text: str) -> str:
+        return text[self.start:self.end]
+
+@lru_cache(maxsize=1)
+def _tiktoken_encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+def count_tokens(text: str) -> int:
+    """
+    Number of LM tokens in text, using tiktoken's o200k_base encoding (o3-mini's tokenizer)
+    when available and falling back to estimate_tokens otherwise.
+    """
+    encoding = _tiktoken_encoding()
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def iter_sentence_spans(text: str):
+    """
+    Yields (start, end) character offsets of each sentence in text, using the same
+    boundaries as chunk_text_by_sentences but without building new strings.
+    """
+    start = len(text) - len(text.lstrip())
+    stop = len(text.rstrip())
+    if start >= stop:
+        return
+    for match in _SENTENCE_BOUNDARY.finditer(text, start, stop):
+        yield start, match.start()
+        start = match.end()
+    yield start, stop
+
+def iter_sentence_chunks(text: str, doc_id=None, chunk_size: int = 4, overlap: int = 1):
+    """
+    Offset-based equivalent of chunk_text_by_sentences: yields a ChunkRecord for every
+    window of `chunk_size` sentences, consecutive windows sharing `overlap` sentences.
+    """
+    if not isinstance(text, str):
+        text = str(text)
+    spans = list(iter_sentence_spans(text))
+    i = 0
+    while i < len(spans):
+        j = min(i + chunk_size, len(spans))
+        yield ChunkRecord(doc_id, spans[i][0], spans[j - 1][1], tuple(range(i, j)))
+        i += chunk_size - overlap
+
+def iter_token_chunks(text: str, doc_id=None, max_tokens: int = 256, overlap: int = 1, token_counter=count_tokens):
+    """
+    Packs whole sentences into chunks of at most `max_tokens` LM tokens.
+
+    Args:
+        text (str): The document to split.
+        doc_id: Identifier copied into every ChunkRecord (e.g. the OriginalIndex).
+        max_tokens (int): Token budget per chunk. A single sentence longer than the
+            budget becomes a chunk of its own.
+        overlap (int): Number of sentences repeated at the start of the next chunk.
+        token_counter (callable): Function returning the token count of a string.
+
+    Yields:
+        ChunkRecord: Offsets and sentence ids of each chunk, in document order.
+    """
+    if not isinstance(text, str):
+        text = str(text)
+    spans = list(iter_sentence_spans(text))
+    sizes = [token_counter(text[start:end]) for start, end in spans]
+    i = 0
+    while i < len(spans):
+        j = i + 1
+        total = sizes[i]
+        while j < len(spans) and total + sizes[j] <= max_tokens:
+            total += sizes[j]
+            j += 1
+        yield ChunkRecord(doc_id, spans[i][0], spans[j - 1][1], tuple(range(i, j)))
+        if j >= len(spans):
+            break
+        i = max(j - overlap, i + 1)
+
+def _normalize_span(value) -> str:
+    return " ".join(str(value).split()).lower()
+
+def merge_chunk_pairs(text: str, chunk_pairs) -> list:
+    """
+    Merges the cause/effect pairs extracted from overlapping chunks of one document.
+
+    Args:
+        text (str): The source document the chunks were cut from.
+        chunk_pairs (iterable): (ChunkRecord, list of pair dicts) tuples.
+
+    Returns:
+        List[dict]: Pairs with duplicate (cause, effect) removed, ignoring case and
+        whitespace. Each pair gains 'sentence_ids' of the chunk it was first found in and
+        'cause_start'/'effect_start', the absolute character offsets of the spans in text
+        (-1 when the LM paraphrased and the span is not found verbatim).
+    """
+    merged = {}
+    for record, pairs in chunk_pairs:
+        for pair in pairs or []:
+            try:
+                key = (_normalize_span(pair["cause"]), _normalize_span(pair["effect"]))
+            except (KeyError, TypeError):
+                continue
+            if key in merged:
+                continue
+            merged[key] = {
+                **pair,
+                "sentence_ids": list(record.sentence_ids),
+                "cause_start": text.find(str(pair["cause"]).strip(), record.start, record.end),
+                "effect_start": text.find(str(pair["effect"]).strip(), record.start, record.end),
+            }
+    return list(merged.values())
+
+def load_completed_keys(jsonl_path: str, key_col: str = 'OriginalIndex') -> set:
+    """
+    Collect the values of `key_col` already recorded in a JSONL predictions file.
+    A partially written last line (e.g. after a crash) is ignored.
+    """
+    completed = set()
+    if not os.path.exists(jsonl_path):
+        return completed
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if key_col in record:
+                completed.add(record[key_col])
+    return completed
+
+def load_predictions_jsonl(jsonl_path: str) -> pd.DataFrame:
+    """
+    Read a JSONL predictions file written by the streaming pipeline into a DataFrame.
+    """
+    return pd.read_json(jsonl_path, lines=True)
@@ -0,0 +1,133 @@
+# src/dedup.py
+import hashlib
+import re
+
+import numpy as np
+
+# Mersenne prime used for the universal hash family of the MinHash permutations.
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_WORD = re.compile(r"\w+")
+
+
+def normalize_chunk(text: str) -> str:
+    """
+    Normalizes a chunk for exact deduplication by collapsing runs of whitespace.
+    Case and punctuation are kept, so two chunks with the same key get the same prompt.
+    """
+    return " ".join(str(text).split())
+
+
+def chunk_fingerprint(text: str) -> str:
+    """
+    Returns the SHA-1 of the normalized chunk text.
+    """
+    return hashlib.sha1(normalize_chunk(text).encode("utf-8")).hexdigest()
+
+
+def _shingles(text: str, size: int) -> set:
+    words = _WORD.findall(str(text).lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class MinHasher:
+    """
+    MinHash signatures over word shingles, for estimating Jaccard similarity between chunks.
+    """
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 3, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self._a = rng.integers(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+             for s in _shingles(text, self.shingle_size)],
+            dtype=np.uint64,
+        )
+        # (a * h + b) mod p, truncated to 32 bits; the uint64 product wraps, which is fine
+        # for hashing purposes.
+        permuted = ((hashes[:, None] * self._a + self._b) % _MERSENNE_PRIME) & _MAX_HASH
+        return permuted.min(axis=0)
+
+
+class LSHIndex:
+    """
+    Banded locality-sensitive hashing index over MinHash signatures.
+    Returns an already indexed chunk whose estimated Jaccard similarity reaches `threshold`.
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, threshold: float = 0.9):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = {}
+
+    def _band_keys(self, signature):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def query(self, signature):
+        """
+        Returns the key of the most similar indexed chunk above the threshold, or None.
+        """
+        best_key, best_sim = None, self.threshold
+        seen = set()
+        for band, band_key in self._band_keys(signature):
+            for key in self._buckets[band].get(band_key, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                sim = float(np.mean(self._signatures[key] == signature))
+                if sim >= best_sim:
+                    best_key, best_sim = key, sim
+        return best_key
+
+    def add(self, key, signature):
+        self._signatures[key] = signature
+        for band, band_key in self._band_keys(signature):
+            self._buckets[band].setdefault(band_key, []).append(key)
+
+
+def dedupe_texts(texts, near_duplicates: bool = False, threshold: float = 0.9, num_perm: int = 64, bands: int = 16):
+    """
+    Groups identical (and optionally near-identical) texts so each group is sent to the LM once.
+
+    Args:
+        texts (list[str]): Chunk texts, e.g. every chunk of every row.
+        near_duplicates (bool): Also merge chunks whose MinHash Jaccard estimate is >= threshold.
+        threshold (float): Similarity needed for a near-duplicate match.
+        num_perm, bands (int): MinHash signature length and number of LSH bands.
+
+    Returns:
+        (list[int], list[int]): Indices of the representative texts to predict, and for every
+        input text the position (in the first list) of the representative that covers it.
+    """
+    representatives = []
+    assignment = []
+    by_fingerprint = {}
+    hasher = MinHasher(num_perm=num_perm) if near_duplicates else None
+    index = LSHIndex(num_perm=num_perm, bands=bands, threshold=threshold) if near_duplicates else None
+
+    for i, text in enumerate(texts):
+        fingerprint = chunk_fingerprint(text)
+        slot = by_fingerprint.get(fingerprint)
+        if slot is None and index is not None:
+            signature = hasher.signature(text)
+            slot = index.query(signature)
+            if slot is None:
+                index.add(len(representatives), signature)
+        if slot is None:
+            slot = len(representatives)
+            representatives.append(i)
+        by_fingerprint.setdefault(fingerprint, slot)
+        assignment.append(slot)
+    return representatives, assignment
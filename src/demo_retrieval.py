@@ -0,0 +1,207 @@
+# src/demo_retrieval.py
+import json
+import os
+import threading
+
+import dspy
+import numpy as np
+
+from src.category_index import _normalize_rows, file_signature
+from src.data_utils import count_tokens, load_train_data
+from src.embedding_service import QuantizedVectors, embedding_settings
+from src.embedding_store import DEFAULT_EMBEDDING_MODEL, get_embedding_store, normalize_text
+
+DEFAULT_TRAIN_PATH = "./data/train_set.json"
+DEFAULT_DEMO_INDEX_PATH = "./data/cache/demo_index.npz"
+DEMO_FIELDS = ("text", "marked_text", "extracted_pairs")
+
+
+def demo_tokens(demo) -> int:
+    """
+    LM tokens a demo adds to the prompt (its text, marked text and pairs; formatting overhead ignored).
+    """
+    return sum(count_tokens(str(demo.get(field, ""))) for field in DEMO_FIELDS)
+
+
+class DemoIndex:
+    """
+    Embedding index over the training examples, used to pick few-shot demos per input.
+
+    Holds the examples, their L2-normalized text embeddings (at `precision`, like
+    CategoryIndex) and their token counts, and can be saved to and loaded from a single .npz file.
+    """
+
+    def __init__(self, records, embeddings=None, model_name: str = DEFAULT_EMBEDDING_MODEL, source_signature=None,
+                 precision: str = None):
+        self.records = [{field: record.get(field) for field in DEMO_FIELDS} for record in records]
+        self.model_name = model_name
+        self.source_signature = source_signature
+        if isinstance(embeddings, QuantizedVectors):
+            precision = embeddings.precision
+        self.precision = precision or embedding_settings()["precision"]
+        self.demos = [dspy.Example(**record).with_inputs("text") for record in self.records]
+        self.tokens = np.array([demo_tokens(demo) for demo in self.demos], dtype=np.int64)
+        self._by_text = {normalize_text(record["text"]): i for i, record in enumerate(self.records)}
+        if embeddings is None or isinstance(embeddings, QuantizedVectors):
+            self._vectors = embeddings
+        else:
+            self._vectors = QuantizedVectors.from_float(embeddings, self.precision)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @classmethod
+    def from_train_json(cls, path: str = DEFAULT_TRAIN_PATH, model_name: str = DEFAULT_EMBEDDING_MODEL,
+                        precision: str = None):
+        df = load_train_data(path)
+        return cls(df.to_dict("records"), model_name=model_name, source_signature=file_signature(path),
+                   precision=precision)
+
+    @property
+    def vectors(self) -> QuantizedVectors:
+        if self._vectors is None:
+            self._vectors = QuantizedVectors.from_float(self._exact_rows(range(len(self.records))), self.precision)
+        return self._vectors
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        return self.vectors.dequantize()
+
+    def _exact_rows(self, rows) -> np.ndarray:
+        vectors = get_embedding_store(self.model_name).encode([self.records[i]["text"] for i in rows])
+        return _normalize_rows(vectors)
+
+    def position(self, text):
+        """
+        Returns the index of the training example with this text (ignoring extra whitespace), or None.
+        """
+        return self._by_text.get(normalize_text(text))
+
+    def similarities(self, text: str, rescore_top: int = 0) -> np.ndarray:
+        """
+        Cosine similarity of text to every training example; with reduced precision, the
+        rescore_top best get their exact scores.
+        """
+        query = _normalize_rows(get_embedding_store(self.model_name).encode([text]))
+        sims = self.vectors.similarities(query)
+        return self.vectors.rescored(query, sims, self._exact_rows, rescore_top)[0]
+
+    def save(self, path: str = DEFAULT_DEMO_INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        meta = {"model_name": self.model_name, "source_signature": self.source_signature}
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                records=np.array(json.dumps(self.records)),
+                meta=np.array(json.dumps(meta)),
+                **self.vectors.to_arrays(),
+            )
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_DEMO_INDEX_PATH):
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            return cls(
+                json.loads(str(data["records"])),
+                embeddings=QuantizedVectors.from_arrays(data),
+                model_name=meta["model_name"],
+                source_signature=meta["source_signature"],
+            )
+
+
+def load_or_build_demo_index(train_path: str = DEFAULT_TRAIN_PATH, index_path: str = DEFAULT_DEMO_INDEX_PATH,
+                             model_name: str = DEFAULT_EMBEDDING_MODEL, precision: str = None) -> DemoIndex:
+    """
+    Loads the serialized demo index if it was built from the current training file with
+    the same model and precision, otherwise rebuilds it (embedding every training text) and saves it.
+    """
+    precision = precision or embedding_settings()["precision"]
+    if os.path.exists(index_path):
+        index = DemoIndex.load(index_path)
+        if (index.source_signature == file_signature(train_path) and index.model_name == model_name
+                and index.precision == precision):
+            return index
+    index = DemoIndex.from_train_json(train_path, model_name=model_name, precision=precision)
+    index.save(index_path)
+    return index
+
+
+class DemoSelector:
+    """
+    Picks up to k training demos per input: the nearest by embedding similarity whose total
+    token count stays within max_demo_tokens. Demos that would exceed the budget are skipped
+    in favour of the next nearest that fits. A training example identical to the input is
+    never used as its own demo.
+
+    Also tallies how many demo tokens the selection saved compared to the program's fixed demos.
+    """
+
+    def __init__(self, index: DemoIndex, k: int = 3, max_demo_tokens: int = 1500):
+        self.index = index
+        self.k = k
+        self.max_demo_tokens = max_demo_tokens
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {"calls": 0, "demos": 0, "fixed_demo_tokens": 0, "selected_demo_tokens": 0}
+
+    def select(self, text: str):
+        """
+        Returns (demos, tokens): the chosen dspy.Example demos, most similar last so it sits
+        next to the input, and their total token count.
+        """
+        # Exact scores for the candidates that can realistically be picked, skips included.
+        sims = self.index.similarities(text, rescore_top=4 * self.k)
+        own = self.index.position(text)
+        chosen, budget = [], self.max_demo_tokens
+        for i in np.argsort(-sims, kind="stable"):
+            if len(chosen) >= self.k:
+                break
+            if i == own or self.index.tokens[i] > budget:
+                continue
+            chosen.append(i)
+            budget -= self.index.tokens[i]
+        chosen.reverse()
+        return [self.index.demos[i] for i in chosen], int(sum(self.index.tokens[i] for i in chosen))
+
+    def record(self, num_demos: int, selected_tokens: int, fixed_tokens: int):
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["demos"] += num_demos
+            self._stats["selected_demo_tokens"] += selected_tokens
+            self._stats["fixed_demo_tokens"] += fixed_tokens
+
+    def stats(self) -> dict:
+        """
+        Returns calls, average demos per call, demo tokens sent with the program's fixed demos
+        vs. the selected ones, and the tokens (and fraction of demo tokens) saved.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        saved = stats["fixed_demo_tokens"] - stats["selected_demo_tokens"]
+        stats["avg_demos"] = stats["demos"] / stats["calls"] if stats["calls"] else 0.0
+        stats["saved_tokens"] = saved
+        stats["saved_fraction"] = saved / stats["fixed_demo_tokens"] if stats["fixed_demo_tokens"] else 0.0
+        return stats
+
+
+class RetrievalFewShot(dspy.Module):
+    """
+    Wraps a compiled program so every call uses demos retrieved for its input instead of the
+    fixed demos baked in at compile time. The program itself (and its LM) is unchanged;
+    the demos are passed per call, so concurrent predictions don't interfere.
+    """
+
+    def __init__(self, program, selector: DemoSelector):
+        super().__init__()
+        self.program = program
+        self.selector = selector
+        self.lm = getattr(program, "lm", None)
+        self.fixed_demo_tokens = sum(demo_tokens(demo) for demo in program.predictors()[0].demos)
+
+    def forward(self, text: str, **kwargs):
+        demos, tokens = self.selector.select(text)
+        self.selector.record(len(demos), tokens, self.fixed_demo_tokens)
+        return self.program(text=text, demos=demos, **kwargs)
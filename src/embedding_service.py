@@ -0,0 +1,260 @@
+# src/embedding_service.py
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from config import EMBEDDING_BATCH_SIZE, EMBEDDING_PRECISION, EMBEDDING_WORKERS
+
+DEFAULT_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+# In-memory precision of embedding matrices and the numpy dtype their values are kept in.
+PRECISIONS = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+_settings = {"batch_size": EMBEDDING_BATCH_SIZE, "num_workers": EMBEDDING_WORKERS, "precision": EMBEDDING_PRECISION}
+_services = {}
+_services_lock = threading.Lock()
+
+
+def embedding_settings() -> dict:
+    """
+    Returns the process-wide defaults: batch_size, num_workers and precision.
+    """
+    return dict(_settings)
+
+
+def configure_embeddings(batch_size: int = None, num_workers: int = None, precision: str = None):
+    """
+    Overrides the process-wide defaults from config (EMBEDDING_BATCH_SIZE, EMBEDDING_WORKERS,
+    EMBEDDING_PRECISION); None keeps a setting. Call it before the embedding stores and indexes
+    are created, as their precision is fixed then. Services created earlier are shut down, so
+    the next get_embedding_service uses the new batch size and workers.
+    """
+    if precision is not None and precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}, expected one of {', '.join(PRECISIONS)}")
+    for name, value in (("batch_size", batch_size), ("num_workers", num_workers), ("precision", precision)):
+        if value is not None:
+            _settings[name] = value
+    with _services_lock:
+        for service in _services.values():
+            service.close()
+        _services.clear()
+
+
+# --- process pool workers -------------------------------------------------------
+
+_worker_service = None
+
+
+def _init_worker(model_name, encoder, threads):
+    global _worker_service
+    if encoder is None:
+        import torch
+
+        # Each worker gets its share of the cores instead of every worker using all of them.
+        torch.set_num_threads(threads)
+    _worker_service = EmbeddingService(model_name, num_workers=1, encoder=encoder)
+
+
+def _encode_shard(texts, batch_size):
+    return _worker_service.encode_many(texts, batch_size=batch_size)
+
+
+class EmbeddingService:
+    """
+    Encodes texts with a SentenceTransformer model, in batches of batch_size.
+
+    With num_workers > 1, jobs of at least min_parallel_texts texts are cut into shards and
+    encoded by a pool of worker processes (spawned on first use, each loading its own copy of
+    the model), so large jobs use every core; smaller jobs are encoded in this process.
+    The result is always one float32 row per text, in input order.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_EMBEDDING_MODEL, batch_size: int = None, num_workers: int = None,
+                 min_parallel_texts: int = 512, encoder=None):
+        """
+        Parameters:
+        model_name (str): SentenceTransformer model to load.
+        batch_size (int): Texts per forward pass (default: embedding_settings()).
+        num_workers (int): Worker processes for large jobs; 1 encodes everything in-process.
+        min_parallel_texts (int): Smaller jobs are not worth shipping to the workers.
+        encoder (callable, optional): Function mapping a list of strings to a 2D array, used
+            instead of the model (must be a module-level function to run in the workers).
+        """
+        self.model_name = model_name
+        self.batch_size = batch_size or _settings["batch_size"]
+        self.num_workers = num_workers or _settings["num_workers"]
+        self.min_parallel_texts = min_parallel_texts
+        self._encoder = encoder
+        self._model = None
+        self._pool = None
+        self._lock = threading.Lock()
+        self.texts_encoded = 0
+        self.seconds = 0.0
+
+    @property
+    def model(self):
+        """
+        The underlying SentenceTransformer, loaded only when something has to be encoded.
+        """
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                threads = max(1, (os.cpu_count() or 1) // self.num_workers)
+                # spawn rather than fork: forking a process that already runs torch threads can deadlock.
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.num_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.model_name, self._encoder, threads),
+                )
+            return self._pool
+
+    def _encode_local(self, texts, batch_size):
+        if self._encoder is None:
+            return self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+        return np.concatenate([np.asarray(self._encoder(texts[start:start + batch_size]), dtype=np.float32)
+                               for start in range(0, len(texts), batch_size)])
+
+    def encode_many(self, texts, batch_size: int = None) -> np.ndarray:
+        """
+        Returns a float32 matrix with one embedding row per text.
+        """
+        texts = [str(text) for text in texts]
+        batch_size = batch_size or self.batch_size
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        start = time.perf_counter()
+        if self.num_workers > 1 and len(texts) >= self.min_parallel_texts:
+            # A few shards per worker, so a slow shard doesn't leave the other workers idle.
+            shard = max(batch_size, -(-len(texts) // (self.num_workers * 4)))
+            shards = [texts[i:i + shard] for i in range(0, len(texts), shard)]
+            vectors = np.concatenate(list(self._get_pool().map(_encode_shard, shards, [batch_size] * len(shards))))
+        else:
+            vectors = self._encode_local(texts, batch_size)
+        self.texts_encoded += len(texts)
+        self.seconds += time.perf_counter() - start
+        return np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+
+
+def get_embedding_service(model_name: str = DEFAULT_EMBEDDING_MODEL) -> EmbeddingService:
+    """
+    Returns the process-wide EmbeddingService for a model (one loaded model, one worker pool).
+    """
+    with _services_lock:
+        if model_name not in _services:
+            _services[model_name] = EmbeddingService(model_name)
+        return _services[model_name]
+
+
+# --- quantized vectors ------------------------------------------------------------
+
+class QuantizedVectors:
+    """
+    A matrix of L2-normalized embeddings kept as float32, float16 or int8 (one scale per row,
+    symmetric around 0), to cut the memory of category and corpus vectors by 2x or 4x.
+
+    Queries stay float32 and are scored against the dequantized rows block by block, so the
+    full float32 matrix never exists at once. Because int8 scores are slightly off, top_k
+    and rescored() can re-score the best candidates against exact vectors fetched on demand.
+    """
+
+    def __init__(self, codes, scales=None, precision: str = "float32"):
+        self.codes = np.asarray(codes, dtype=PRECISIONS[precision])
+        self.scales = None if scales is None else np.asarray(scales, dtype=np.float32)
+        self.precision = precision
+
+    @classmethod
+    def from_float(cls, vectors, precision: str = "float32"):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if precision != "int8":
+            return cls(vectors.astype(PRECISIONS[precision], copy=False), precision=precision)
+        scales = np.maximum(np.abs(vectors).max(axis=1, initial=0.0) / 127.0, 1e-12)
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return cls(codes, scales, "int8")
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (0 if self.scales is None else self.scales.nbytes)
+
+    def dequantize(self, rows=slice(None)) -> np.ndarray:
+        """
+        Returns the selected rows (a slice or index array) as float32.
+        """
+        if self.precision == "float32":
+            return self.codes[rows]
+        vectors = self.codes[rows].astype(np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[rows][:, None]
+        return vectors
+
+    def similarities(self, queries, block_rows: int = 4096) -> np.ndarray:
+        """
+        Dot products of each (normalized) query row with every stored row.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.precision == "float32":
+            return queries @ self.codes.T
+        sims = np.empty((len(queries), len(self)), dtype=np.float32)
+        for start in range(0, len(self), block_rows):
+            sims[:, start:start + block_rows] = queries @ self.dequantize(slice(start, start + block_rows)).T
+        return sims
+
+    def rescored(self, queries, sims, exact_rows, top: int) -> np.ndarray:
+        """
+        Replaces each query's `top` best approximate scores with exact ones.
+        exact_rows maps an array of row indices to their float32 vectors; only the
+        candidates' vectors are fetched. Returns a new similarity matrix.
+        """
+        if self.precision == "float32" or exact_rows is None or top <= 0:
+            return sims
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        top = min(top, sims.shape[1])
+        candidates = np.argpartition(-sims, top - 1, axis=1)[:, :top]
+        rows = np.unique(candidates)
+        exact = np.asarray(exact_rows(rows), dtype=np.float32)
+        position = np.searchsorted(rows, candidates)
+        sims = sims.copy()
+        np.put_along_axis(sims, candidates, np.einsum("qd,qkd->qk", queries, exact[position]), axis=1)
+        return sims
+
+    def top_k(self, queries, k: int = 2, exact_rows=None, oversample: int = 4):
+        """
+        Returns (scores, indices) of the k most similar rows per query, best first. With
+        exact_rows (see rescored), the k * oversample best candidates are re-scored first.
+        """
+        sims = self.similarities(queries)
+        sims = self.rescored(queries, sims, exact_rows, k * oversample)
+        k = min(k, sims.shape[1])
+        indices = np.argsort(-sims, axis=1)[:, :k]
+        return np.take_along_axis(sims, indices, axis=1), indices
+
+    def to_arrays(self) -> dict:
+        """
+        Arrays for np.savez; from_arrays restores them.
+        """
+        arrays = {"embeddings": self.codes, "precision": np.array(self.precision)}
+        if self.scales is not None:
+            arrays["scales"] = self.scales
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, data):
+        precision = str(data["precision"]) if "precision" in data else "float32"
+        return cls(data["embeddings"], data["scales"] if "scales" in data else None, precision)
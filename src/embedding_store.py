@@ -0,0 +1,222 @@
+# src/embedding_store.py
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from src.embedding_service import DEFAULT_EMBEDDING_MODEL, EmbeddingService, embedding_settings, get_embedding_service
+
+DEFAULT_STORE_DIR = "./data/cache/embeddings"
+
+
+def normalize_text(text) -> str:
+    """
+    Normalizes a string before it is used as a cache key: surrounding whitespace is
+    stripped and inner runs of whitespace are collapsed to a single space.
+    The MiniLM tokenizer splits on whitespace anyway, so this does not change the embedding.
+    """
+    return " ".join(str(text).split())
+
+
+def text_key(model_name: str, text) -> str:
+    """
+    Returns the content address of a (model name, normalized text) pair.
+    """
+    payload = f"{model_name}\x00{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha1(payload).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Content-addressed, on-disk embedding cache for a single SentenceTransformer model.
+
+    Vectors live in a memory-mapped float32 (`vectors.f32`) or float16 (`vectors.f16`)
+    matrix with one row per text; `index.json` records which content key owns each row.
+    Recently used rows are additionally kept in an in-memory LRU. Only strings that have
+    never been seen are sent to the EmbeddingService, together in one encode_many job.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_EMBEDDING_MODEL, store_dir: str = DEFAULT_STORE_DIR,
+                 max_memory_items: int = 50_000, encoder=None, dtype: str = None, service: EmbeddingService = None):
+        """
+        Parameters:
+        model_name (str): SentenceTransformer model used to encode cache misses.
+        store_dir (str): Root folder for the cache; each model gets its own subfolder.
+        max_memory_items (int): Number of vectors kept in the in-memory LRU.
+        encoder (callable, optional): Function mapping a list of strings to a 2D array.
+            Defaults to the model of the shared EmbeddingService, loaded on first miss.
+        dtype (str, optional): "float32" or "float16" (half the disk and memory, a separate
+            cache folder). Defaults to float16 when embedding_settings() asks for reduced precision.
+        service (EmbeddingService, optional): Encodes the misses; defaults to
+            get_embedding_service(model_name), or an in-process service around encoder.
+        """
+        if dtype is None:
+            dtype = "float32" if embedding_settings()["precision"] == "float32" else "float16"
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"EmbeddingStore dtype must be float32 or float16, not {dtype!r}")
+        self.model_name = model_name
+        self.dtype = np.dtype(dtype)
+        folder = model_name.replace("/", "__") + ("" if dtype == "float32" else f"@{dtype}")
+        self.store_dir = os.path.join(store_dir, folder)
+        self.max_memory_items = max_memory_items
+        if service is None and encoder is not None:
+            service = EmbeddingService(model_name, num_workers=1, encoder=encoder)
+        self._service = service
+        self._lock = threading.RLock()
+        self._lru = OrderedDict()
+        self._rows = {}
+        self._dim = None
+        self._matrix = None
+        self.hits = 0
+        self.misses = 0
+        self._load_index()
+
+    @property
+    def vectors_path(self) -> str:
+        return os.path.join(self.store_dir, "vectors.f16" if self.dtype == np.float16 else "vectors.f32")
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.store_dir, "index.json")
+
+    @property
+    def service(self) -> EmbeddingService:
+        return self._service or get_embedding_service(self.model_name)
+
+    @property
+    def model(self):
+        """
+        The underlying SentenceTransformer, loaded only when something has to be encoded.
+        """
+        return self.service.model
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        self._dim = index["dim"]
+        self._rows = {key: row for row, key in enumerate(index["keys"])}
+        # Drop rows that were written to disk but never made it into the index (e.g. after a crash).
+        expected_size = len(self._rows) * self._dim * self.dtype.itemsize
+        if os.path.exists(self.vectors_path) and os.path.getsize(self.vectors_path) > expected_size:
+            with open(self.vectors_path, "r+b") as f:
+                f.truncate(expected_size)
+
+    def _write_index(self):
+        keys = [None] * len(self._rows)
+        for key, row in self._rows.items():
+            keys[row] = key
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_name, "dim": self._dim, "keys": keys}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _disk_matrix(self):
+        if self._matrix is None or self._matrix.shape[0] != len(self._rows):
+            if not self._rows:
+                return None
+            self._matrix = np.memmap(self.vectors_path, dtype=self.dtype, mode="r",
+                                     shape=(len(self._rows), self._dim))
+        return self._matrix
+
+    def _remember(self, key, vector):
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_memory_items:
+            self._lru.popitem(last=False)
+
+    def _lookup(self, key):
+        vector = self._lru.get(key)
+        if vector is not None:
+            self._lru.move_to_end(key)
+            return vector
+        row = self._rows.get(key)
+        if row is None:
+            return None
+        vector = np.array(self._disk_matrix()[row])
+        self._remember(key, vector)
+        return vector
+
+    def _encode(self, texts, batch_size=None):
+        # Rounded to the stored dtype, so a vector is the same whether it was just encoded or read back.
+        return self.service.encode_many(texts, batch_size=batch_size).astype(self.dtype, copy=False)
+
+    def _append(self, keys, vectors):
+        os.makedirs(self.store_dir, exist_ok=True)
+        if self._dim is None:
+            self._dim = vectors.shape[1]
+        with open(self.vectors_path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=self.dtype).tobytes())
+        start = len(self._rows)
+        for offset, key in enumerate(keys):
+            self._rows[key] = start + offset
+        self._matrix = None
+        self._write_index()
+
+    def encode(self, texts, batch_size: int = None) -> np.ndarray:
+        """
+        Returns a float32 matrix with one embedding row per input string.
+        Cached vectors are read from memory or disk; all misses are encoded in a single
+        encode_many job (in batches of batch_size, default the service's) and appended
+        to the store before returning.
+        """
+        texts = [normalize_text(text) for text in texts]
+        with self._lock:
+            keys = [text_key(self.model_name, text) for text in texts]
+            found = {}
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key in found or key in missing:
+                    continue
+                vector = self._lookup(key)
+                if vector is None:
+                    missing[key] = text
+                else:
+                    found[key] = vector
+            self.hits += len(found)
+            self.misses += len(missing)
+
+            if missing:
+                new_keys = list(missing)
+                new_vectors = self._encode([missing[key] for key in new_keys], batch_size=batch_size)
+                self._append(new_keys, new_vectors)
+                for key, vector in zip(new_keys, new_vectors):
+                    found[key] = vector
+                    self._remember(key, vector)
+
+            if not keys:
+                return np.zeros((0, self._dim or 0), dtype=np.float32)
+            return np.stack([found[key] for key in keys]).astype(np.float32, copy=False)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_embedding_store(model_name: str = DEFAULT_EMBEDDING_MODEL, store_dir: str = DEFAULT_STORE_DIR) -> EmbeddingStore:
+    """
+    Returns the process-wide EmbeddingStore for a model, so evaluation and mapping
+    share one cache and at most one loaded SentenceTransformer.
+    """
+    with _stores_lock:
+        key = (model_name, os.path.abspath(store_dir))
+        if key not in _stores:
+            _stores[key] = EmbeddingStore(model_name=model_name, store_dir=store_dir)
+        return _stores[key]
+
+
+def use_embedding_store(store: EmbeddingStore, store_dir: str = DEFAULT_STORE_DIR) -> EmbeddingStore:
+    """
+    Makes store the process-wide store that get_embedding_store returns for its model,
+    e.g. one with a custom encoder or a scratch directory for benchmarks.
+    """
+    with _stores_lock:
+        _stores[(store.model_name, os.path.abspath(store_dir))] = store
+    return store
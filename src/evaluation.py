@@ -1,85 +1,227 @@
-import torch
-import torch.nn.functional as F
-from sentence_transformers import SentenceTransformer
-from dspy.evaluate.evaluate import Evaluate
-import ast
-
-# Load SentenceTransformer for semantic evaluation.
-model_sbert = SentenceTransformer('all-MiniLM-L6-v2')
+import os
+import time
+import numpy as np
+import pandas as pd
+from src.concurrency import iter_concurrently
+from src.embedding_store import get_embedding_store
+from src.lm_metrics import lm_tags
+from src.pairs import parse_pairs, parse_pairs_checked
+from src.progress import Progress
 
 def parse_extracted_pairs(pairs):
     """
-    If pairs is a string representation of a list of dictionaries, convert it to a list.
+    If pairs is a string representation of a list of dictionaries, convert it to a list
+    of pair dictionaries (see src.pairs.parse_pairs; unparseable strings give []).
     Otherwise, return as is.
     """
     if isinstance(pairs, str):
-        try:
-            parsed = ast.literal_eval(pairs)
-            if isinstance(parsed, list):
-                return parsed
-            else:
-                return []
-        except Exception as e:
-            print(f"Parsing error: {e}")
-            return []
+        return [pair.to_dict() for pair in parse_pairs(pairs)]
     return pairs
 
 def extracted_pairs_exact_match(example, prediction):
     """
     Computes an exact match score for the extracted cause-effect pairs.
-    Converts the list of pair dictionaries into sets of tuples (cause, effect)
-    after lowercasing and stripping. Returns 1.0 if they match exactly, else 0.0.
+    Compares the sets of (cause, effect) keys after lowercasing and stripping.
+    Returns 1.0 if they match exactly, else 0.0; a malformed pair (no text cause or
+    effect) on either side scores 0.0, even if the remaining pairs match.
     """
-    gold_pairs = parse_extracted_pairs(example.extracted_pairs)
-    pred_pairs = parse_extracted_pairs(prediction.extracted_pairs)
-
-    if not gold_pairs or not pred_pairs:
-        return 0.0
+    gold_pairs, gold_invalid = parse_pairs_checked(example.extracted_pairs)
+    pred_pairs, pred_invalid = parse_pairs_checked(prediction.extracted_pairs)
 
-    try:
-        gold_set = set((pair["cause"].strip().lower(), pair["effect"].strip().lower()) for pair in gold_pairs)
-        pred_set = set((pair["cause"].strip().lower(), pair["effect"].strip().lower()) for pair in pred_pairs)
-    except KeyError as e:
-        print(f"KeyError: {e}")
+    if not gold_pairs or not pred_pairs or gold_invalid or pred_invalid:
         return 0.0
 
+    gold_set = {pair.key for pair in gold_pairs}
+    pred_set = {pair.key for pair in pred_pairs}
     return 1.0 if gold_set == pred_set else 0.0
 
+def _pair_texts(pairs):
+    """
+    Returns the stripped cause and effect strings of a sequence of CausalPair.
+    """
+    causes = [pair.cause.strip() for pair in pairs]
+    effects = [pair.effect.strip() for pair in pairs]
+    return causes, effects
+
+def _encode_unique(texts):
+    """
+    Encodes every distinct string in a single SentenceTransformer call; strings already
+    in the shared embedding store are not re-encoded.
+    Returns a {text: row} lookup and the L2-normalized embedding matrix, so that
+    cosine similarities reduce to dot products.
+    """
+    unique_texts = list(dict.fromkeys(texts))
+    if not unique_texts:
+        return {}, None
+    embeddings = get_embedding_store().encode(unique_texts)
+    embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    return {text: i for i, text in enumerate(unique_texts)}, embeddings
+
+def _pair_matrix(pairs, index, embeddings):
+    """
+    Stacks [cause | effect] embeddings side by side, one row per pair.
+    """
+    causes, effects = _pair_texts(pairs)
+    cause_emb = embeddings[[index[text] for text in causes]]
+    effect_emb = embeddings[[index[text] for text in effects]]
+    return np.concatenate([cause_emb, effect_emb], axis=1)
+
+def _semantic_score(gold_pairs, pred_pairs, index, embeddings):
+    """
+    Scores one example from precomputed embeddings. Because the rows of
+    _pair_matrix concatenate unit vectors, a single matrix multiply yields
+    cause_sim + effect_sim for every (pred, gold) combination.
+    """
+    pred_matrix = _pair_matrix(pred_pairs, index, embeddings)
+    gold_matrix = _pair_matrix(gold_pairs, index, embeddings)
+    sims = (pred_matrix @ gold_matrix.T) / 2.0
+    # The best match per predicted pair never drops below 0.0, as in the original loop.
+    best_sims = np.maximum(sims.max(axis=1), 0.0).tolist()
+    return sum(best_sims) / len(best_sims)
+
+def batch_semantic_match(examples, predictions):
+    """
+    Computes extracted_pairs_semantic_match for a whole dev set at once.
+    All unique gold and predicted causes/effects across every example are
+    encoded in one call; each example is then scored with a single matrix multiply.
+    Returns a list of scores aligned with the examples.
+    """
+    parsed = []
+    texts = []
+    for example, prediction in zip(examples, predictions):
+        gold_pairs = parse_pairs(example.extracted_pairs)
+        pred_pairs = parse_pairs(prediction.extracted_pairs)
+        if not gold_pairs or not pred_pairs:
+            parsed.append(None)
+            continue
+        parsed.append((gold_pairs, pred_pairs))
+        for pairs in (gold_pairs, pred_pairs):
+            causes, effects = _pair_texts(pairs)
+            texts.extend(causes)
+            texts.extend(effects)
+
+    index, embeddings = _encode_unique(texts)
+    return [
+        0.0 if item is None else _semantic_score(item[0], item[1], index, embeddings)
+        for item in parsed
+    ]
+
 def extracted_pairs_semantic_match(example, prediction):
     """
     Computes a semantic similarity score for the extracted cause-effect pairs.
     For each predicted pair, finds the best matching gold pair using cosine similarity,
     then returns the average of these best scores.
     """
-    gold_pairs = parse_extracted_pairs(example.extracted_pairs)
-    pred_pairs = parse_extracted_pairs(prediction.extracted_pairs)
+    return batch_semantic_match([example], [prediction])[0]
 
-    if not gold_pairs or not pred_pairs:
-        return 0.0
+# Metrics that can score a whole dev set at once instead of example by example.
+BATCH_METRICS = {
+    extracted_pairs_semantic_match: batch_semantic_match,
+}
+
+def predict_devset(model, devset, max_workers=1, rate_limiter=None, progress=None):
+    """
+    Runs the model once on every dev example, optionally with several requests in flight.
+    Returns a list of (prediction, latency_seconds, error) tuples aligned with devset;
+    prediction is None when the call raised (counted as "errors" in progress).
+    """
+    progress = progress or Progress()
+
+    def timed_predict(example):
+        start = time.perf_counter()
+        try:
+            with lm_tags(stage="evaluate"):
+                prediction = model(**example.inputs())
+            error = None
+        except Exception as e:
+            prediction, error = None, repr(e)
+            progress.incr("errors")
+        return prediction, time.perf_counter() - start, error
+
+    return list(progress.track(
+        iter_concurrently(timed_predict, devset, max_workers=max_workers, rate_limiter=rate_limiter),
+        "predict dev set",
+        total=len(devset),
+    ))
+
+def score_predictions(devset, predictions, metrics):
+    """
+    Applies every metric to stored predictions without calling the model again.
+    Failed predictions (None) score 0.0. Returns {metric_name: [score, ...]}.
+    """
+    scores = {}
+    ok = [i for i, prediction in enumerate(predictions) if prediction is not None]
+    for metric in metrics:
+        name = metric.__name__
+        metric_scores = [0.0] * len(devset)
+        batch_metric = BATCH_METRICS.get(metric)
+        if batch_metric is not None:
+            batch_scores = batch_metric([devset[i] for i in ok], [predictions[i] for i in ok])
+            for i, score in zip(ok, batch_scores):
+                metric_scores[i] = float(score)
+        else:
+            for i in ok:
+                metric_scores[i] = float(metric(devset[i], predictions[i]))
+        scores[name] = metric_scores
+    return scores
+
+def run_multi_metric_evaluation(model, devset, metrics, max_workers=1, rate_limiter=None, output_dir="./data/output",
+                                progress=None):
+    """
+    Predicts every dev example exactly once and scores the stored predictions with all metrics.
+
+    Args:
+        model: DSPy program to evaluate.
+        devset (list[dspy.Example]): Examples with inputs set via with_inputs("text").
+        metrics (list[callable]): Metrics with the (example, prediction) signature.
+        max_workers (int): Concurrent prediction requests.
+        rate_limiter (RateLimiter, optional): Shared request/token limiter.
+        output_dir (str, optional): If given, the per-example table is written there as
+            evaluation_results.json and evaluation_results.csv.
+        progress (Progress, optional): Progress reporter for the prediction pass.
 
-    sims = []
-    for pred in pred_pairs:
-        pred_cause = pred["cause"].strip()
-        pred_effect = pred["effect"].strip()
-        pred_cause_emb = model_sbert.encode(pred_cause, convert_to_tensor=True)
-        pred_effect_emb = model_sbert.encode(pred_effect, convert_to_tensor=True)
-        best_sim = 0.0
-        for gold in gold_pairs:
-            gold_cause = gold["cause"].strip()
-            gold_effect = gold["effect"].strip()
-            gold_cause_emb = model_sbert.encode(gold_cause, convert_to_tensor=True)
-            gold_effect_emb = model_sbert.encode(gold_effect, convert_to_tensor=True)
-            cause_sim = F.cosine_similarity(gold_cause_emb, pred_cause_emb, dim=0).item()
-            effect_sim = F.cosine_similarity(gold_effect_emb, pred_effect_emb, dim=0).item()
-            sim = (cause_sim + effect_sim) / 2.0
-            best_sim = max(best_sim, sim)
-        sims.append(best_sim)
-    return sum(sims) / len(sims)
-
-def run_evaluation(model, devset, metric, display_table=5, display_progress=True, return_all_scores=False):
+    Returns:
+        (dict, pd.DataFrame): Score per metric as a percentage (0-100, like dspy's Evaluate),
+        and one row per example with the text, gold and predicted pairs, prediction latency,
+        error and each metric's raw (0-1) score.
+    """
+    outcomes = predict_devset(model, devset, max_workers=max_workers, rate_limiter=rate_limiter, progress=progress)
+    predictions = [prediction for prediction, _, _ in outcomes]
+    scores = score_predictions(devset, predictions, metrics)
+
+    rows = []
+    for i, (example, (prediction, latency, error)) in enumerate(zip(devset, outcomes)):
+        row = {
+            "text": example.text,
+            "expected_pairs": example.extracted_pairs,
+            "predicted_pairs": getattr(prediction, "extracted_pairs", None),
+            "predicted_marked_text": getattr(prediction, "marked_text", None),
+            "latency_s": round(latency, 4),
+            "error": error,
+        }
+        for name, metric_scores in scores.items():
+            row[name] = metric_scores[i]
+        rows.append(row)
+    results_df = pd.DataFrame(rows)
+    summary = {name: (round(100 * sum(values) / len(values), 2) if values else 0.0) for name, values in scores.items()}
+
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        results_df.to_json(os.path.join(output_dir, "evaluation_results.json"), orient="records", indent=4)
+        results_df.to_csv(os.path.join(output_dir, "evaluation_results.csv"), index=False)
+    return summary, results_df
+
+def run_evaluation(model, devset, metric, display_table=5, display_progress=True, return_all_scores=False, max_workers=1):
     """
     Runs evaluation on the provided dev set using DSPy's Evaluate class and the given metric.
+    If a list of metrics is given, the model is run once per example and all metrics are
+    applied to the stored predictions (see run_multi_metric_evaluation); the result is then
+    (summary, per-example DataFrame).
     """
+    if isinstance(metric, (list, tuple)):
+        return run_multi_metric_evaluation(model, devset, list(metric), max_workers=max_workers)
+    from dspy.evaluate.evaluate import Evaluate
+
     evaluator = Evaluate(
         devset=devset,
         display_table=display_table,
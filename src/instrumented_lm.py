@@ -0,0 +1,51 @@
+# src/instrumented_lm.py
+import time
+
+import dspy
+
+from src.lm_metrics import LMMetrics, _hidden_params, _retries, _usage, current_tags, estimate_cost, get_lm_metrics
+
+
+class InstrumentedLM(dspy.BaseLM):
+    """
+    Wraps a configured LM (a dspy.LM or a CachedLM) and records every call in an LMMetrics
+    collector: wall time, prompt/completion tokens, estimated cost, retries, whether it was
+    answered from a cache, errors, and the lm_tags active at the call site.
+    Drop-in replacement for the wrapped LM, like CachedLM.
+    """
+
+    def __init__(self, lm, metrics: LMMetrics = None, prices: dict = None):
+        super().__init__(model=lm.model, model_type=lm.model_type, cache=lm.cache)
+        self.lm = lm
+        self.kwargs = lm.kwargs
+        self.metrics = metrics if metrics is not None else get_lm_metrics()
+        self.prices = prices
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        record = {"started_at": time.time(), "model": self.model, **current_tags()}
+        start = time.perf_counter()
+        try:
+            response = self.lm.forward(prompt=prompt, messages=messages, **kwargs)
+        except Exception as e:
+            record.update(latency_s=time.perf_counter() - start, prompt_tokens=0, completion_tokens=0,
+                          cost_usd=0.0, retries=0, cache_hit=False, error=type(e).__name__)
+            self.metrics.add(record)
+            raise
+        latency = time.perf_counter() - start
+        cache_hit = bool(getattr(response, "cache_hit", False) or _hidden_params(response).get("cache_hit"))
+        prompt_tokens, completion_tokens = (0, 0) if cache_hit else _usage(response)
+        # A RouterLM reports which of its backends answered; price the call at that model's rates.
+        model = getattr(response, "backend_model", None) or self.model
+        record.update(
+            backend=getattr(response, "backend", None),
+            latency_s=latency,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cost_usd=0.0 if cache_hit else estimate_cost(model, prompt_tokens, completion_tokens,
+                                                         self.prices, response),
+            retries=_retries(response),
+            cache_hit=cache_hit,
+            error=None,
+        )
+        self.metrics.add(record)
+        return response
@@ -0,0 +1,206 @@
+# src/lm_cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import dspy
+
+DEFAULT_CACHE_PATH = "./data/cache/lm_responses.sqlite"
+
+
+def file_hash(path: str) -> str:
+    """
+    Returns the SHA-256 of a file, e.g. a compiled models/*.json program.
+    The compiled demos live in that file, so its hash identifies the demo set.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def request_key(model: str, namespace: str, prompt=None, messages=None, kwargs=None) -> str:
+    """
+    Builds the cache key of one LM request.
+    The rendered messages already contain the signature instructions, the demos and the
+    input text; `namespace` (the compiled program's file hash) makes the demo set explicit,
+    so swapping models/*.json never serves stale answers.
+    """
+    kwargs = {k: v for k, v in (kwargs or {}).items() if not k.startswith("api_")}
+    payload = json.dumps(
+        {"model": model, "namespace": namespace, "prompt": prompt, "messages": messages, "kwargs": kwargs},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite-backed store of LM outputs with hit/miss counters and size-bounded LRU eviction.
+    One connection is shared by all threads behind a lock.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = 100_000, max_bytes: int = 512 * 1024 * 1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                namespace TEXT,
+                outputs TEXT,
+                size INTEGER,
+                created REAL,
+                last_used REAL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)")
+        self._conn.commit()
+
+    def __deepcopy__(self, memo):
+        # dspy copies LMs with copy.deepcopy; all copies should keep sharing one cache.
+        return self
+
+    def get(self, key: str):
+        """
+        Returns the cached list of outputs for `key`, or None on a miss.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT outputs FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return json.loads(row[0])
+
+    def put(self, key: str, outputs: list, model: str = "", namespace: str = ""):
+        """
+        Stores the outputs of one request and evicts the least recently used entries
+        if the cache grew beyond max_entries or max_bytes.
+        """
+        payload = json.dumps(outputs, default=str)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, namespace, payload, len(payload), now, now),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        while count > self.max_entries or (total > self.max_bytes and count > 1):
+            excess = max(count - self.max_entries, 1)
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_used LIMIT ?", (excess,)
+            ).fetchall()
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", [(key,) for key, _ in rows])
+            self.evictions += len(rows)
+            count -= len(rows)
+            total -= sum(size for _, size in rows)
+
+    def stats(self) -> dict:
+        """
+        Returns hit/miss/eviction counters together with the current cache size.
+        """
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+
+class _CachedResponse:
+    """
+    Minimal stand-in for a LiteLLM response, enough for dspy.BaseLM.__call__.
+    """
+
+    def __init__(self, outputs, model):
+        self.choices = [{"text": text} for text in outputs]
+        self.usage = {}
+        self.model = model
+        self.cache_hit = True
+
+
+class CachedLM(dspy.BaseLM):
+    """
+    Wraps a configured dspy.LM and answers repeated requests from a ResponseCache.
+    Drop-in replacement for the wrapped LM: it can be passed to dspy.configure and
+    assigned to model.lm.
+    """
+
+    def __init__(self, lm, cache: ResponseCache, namespace: str = ""):
+        super().__init__(model=lm.model, model_type=lm.model_type, cache=lm.cache)
+        self.lm = lm
+        self.kwargs = lm.kwargs
+        self.response_cache = cache
+        self.namespace = namespace
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        if kwargs.get("logprobs"):
+            return self.lm.forward(prompt=prompt, messages=messages, **kwargs)
+        key = request_key(self.model, self.namespace, prompt, messages, {**self.kwargs, **kwargs})
+        outputs = self.response_cache.get(key)
+        if outputs is not None:
+            return _CachedResponse(outputs, self.model)
+        response = self.lm.forward(prompt=prompt, messages=messages, **kwargs)
+        outputs = [c.message.content if hasattr(c, "message") else c["text"] for c in response.choices]
+        self.response_cache.put(key, outputs, model=self.model, namespace=self.namespace)
+        return response
+
+
+def find_response_cache(lm):
+    """
+    Returns the ResponseCache used by lm or by any LM it wraps (via .lm), or None.
+    """
+    while lm is not None:
+        if isinstance(lm, CachedLM):
+            return lm.response_cache
+        lm = getattr(lm, "lm", None)
+    return None
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_response_cache(path: str = DEFAULT_CACHE_PATH) -> ResponseCache:
+    """
+    Returns the process-wide ResponseCache stored at `path`.
+    """
+    with _caches_lock:
+        key = os.path.abspath(path)
+        if key not in _caches:
+            _caches[key] = ResponseCache(path)
+        return _caches[key]
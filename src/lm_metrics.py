@@ -0,0 +1,219 @@
+# src/lm_metrics.py
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_METRICS_PATH = "./data/output/lm_metrics.json"
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is open-ended.
+LATENCY_BUCKETS_S = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SUMMARY_COLUMNS = ["stage", "calls", "errors", "cache_hits", "retries", "prompt_tokens", "completion_tokens",
+                   "cost_usd", "calls_per_s", "mean_s", "p50_s", "p95_s", "p99_s"]
+
+_TAGS = contextvars.ContextVar("lm_tags", default={})
+
+
+@contextmanager
+def lm_tags(**tags):
+    """
+    Tags every LM call made inside the block (in this thread, or in workers started through
+    iter_concurrently) with the given fields, e.g. lm_tags(stage="predict", don_id=...).
+    Nested blocks add to the outer tags; None values are ignored.
+    """
+    token = _TAGS.set({**_TAGS.get(), **{key: value for key, value in tags.items() if value is not None}})
+    try:
+        yield
+    finally:
+        _TAGS.reset(token)
+
+
+def current_tags() -> dict:
+    return dict(_TAGS.get())
+
+
+def _usage(response) -> tuple:
+    usage = getattr(response, "usage", None) or {}
+    if not isinstance(usage, dict):
+        usage = dict(usage)
+    return int(usage.get("prompt_tokens") or 0), int(usage.get("completion_tokens") or 0)
+
+
+def _hidden_params(response) -> dict:
+    return getattr(response, "_hidden_params", None) or {}
+
+
+def _retries(response) -> int:
+    # Reported by LiteLLM's router, or as a `retries` attribute by wrappers that retry themselves;
+    # plain completions don't report their retries.
+    retries = getattr(response, "retries", None)
+    if retries is None:
+        retries = (_hidden_params(response).get("additional_headers") or {}).get("x-litellm-attempted-retries")
+    return int(retries or 0)
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, prices: dict = None, response=None) -> float:
+    """
+    USD cost of one call: from prices ({model: (input, output) USD per million tokens}) when the
+    model is listed, otherwise the cost LiteLLM computed for the response, otherwise 0.
+    """
+    if prices and model in prices:
+        input_price, output_price = prices[model]
+        return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+    return float(_hidden_params(response).get("response_cost") or 0.0)
+
+
+class LMMetrics:
+    """
+    Thread-safe collector of per-call LM records (the most recent max_records are kept).
+
+    Every record has seq, started_at, model, backend (which RouterLM backend answered), latency_s,
+    prompt_tokens, completion_tokens, cost_usd, retries, cache_hit and error, plus the tags active when the call was made
+    (stage, don_id, ...). Use mark()/records(since=...) to look at one run only.
+    """
+
+    def __init__(self, max_records: int = 200_000):
+        self._lock = threading.Lock()
+        self._records = deque(maxlen=max_records)
+        self._seq = itertools.count(1)
+
+    def __deepcopy__(self, memo):
+        # dspy copies LMs with copy.deepcopy; all copies should report to one collector.
+        return self
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._records)
+
+    def add(self, record: dict):
+        with self._lock:
+            record["seq"] = next(self._seq)
+            self._records.append(record)
+
+    def mark(self) -> int:
+        """
+        Returns the sequence number of the latest record, to pass to records(since=...) later.
+        """
+        with self._lock:
+            return self._records[-1]["seq"] if self._records else 0
+
+    def records(self, since: int = 0) -> list:
+        with self._lock:
+            return [record for record in self._records if record["seq"] > since]
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+    def summary(self, since: int = 0) -> pd.DataFrame:
+        return summarize(self.records(since))
+
+    def export(self, path: str = DEFAULT_METRICS_PATH, since: int = 0, records_path: str = None) -> str:
+        """
+        Writes the summary and latency histogram (per stage and overall) to a JSON file and,
+        with records_path, appends the raw call records to a JSONL file. Returns path.
+        """
+        records = self.records(since)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "created": time.time(),
+                "summary": summarize(records).to_dict(orient="records"),
+                "latency_histogram": latency_histogram(records).to_dict(orient="records"),
+            }, f, indent=4, default=str)
+        if records_path:
+            os.makedirs(os.path.dirname(records_path) or ".", exist_ok=True)
+            with open(records_path, "a", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record, default=str) + "\n")
+        return path
+
+
+def _stage_rows(records):
+    df = pd.DataFrame(records)
+    if df.empty:
+        return
+    df["stage"] = df["stage"].fillna("(untagged)") if "stage" in df else "(untagged)"
+    yield "all", df
+    for stage, group in df.groupby("stage", sort=True):
+        yield stage, group
+
+
+def summarize(records) -> pd.DataFrame:
+    """
+    One row per stage (and "all"): calls, errors, cache hits, retries, tokens, cost,
+    throughput (calls per second of wall time between the first start and last finish)
+    and the mean/p50/p95/p99 latency in seconds.
+    """
+    rows = []
+    for stage, df in _stage_rows(records):
+        latencies = df["latency_s"].to_numpy()
+        wall = (df["started_at"] + df["latency_s"]).max() - df["started_at"].min()
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        rows.append({
+            "stage": stage,
+            "calls": len(df),
+            "errors": int(df["error"].notna().sum()),
+            "cache_hits": int(df["cache_hit"].sum()),
+            "retries": int(df["retries"].sum()),
+            "prompt_tokens": int(df["prompt_tokens"].sum()),
+            "completion_tokens": int(df["completion_tokens"].sum()),
+            "cost_usd": float(df["cost_usd"].sum()),
+            "calls_per_s": float(len(df) / wall) if wall > 0 else 0.0,
+            "mean_s": float(latencies.mean()),
+            "p50_s": float(p50),
+            "p95_s": float(p95),
+            "p99_s": float(p99),
+        })
+    return pd.DataFrame(rows, columns=SUMMARY_COLUMNS)
+
+
+def latency_histogram(records, buckets=LATENCY_BUCKETS_S) -> pd.DataFrame:
+    """
+    Number of calls per latency bucket ("<=0.1s", ..., ">60.0s"), one row per stage (and "all").
+    """
+    labels = [f"<={bound}s" for bound in buckets] + [f">{buckets[-1]}s"]
+    rows = []
+    for stage, df in _stage_rows(records):
+        counts = np.bincount(np.searchsorted(buckets, df["latency_s"].to_numpy(), side="left"),
+                             minlength=len(labels))
+        rows.append({"stage": stage, **dict(zip(labels, counts.tolist()))})
+    return pd.DataFrame(rows, columns=["stage", *labels])
+
+
+_metrics = LMMetrics()
+
+
+def get_lm_metrics() -> LMMetrics:
+    """
+    Returns the process-wide collector that configure_lm's LMs report to.
+    """
+    return _metrics
+
+
+def render_lm_metrics(records, container=None):
+    """
+    Shows one run's LM calls in a Streamlit page: throughput, tokens and cost, then the
+    per-stage latency percentiles.
+    """
+    import streamlit as st
+
+    container = container or st
+    summary = summarize(records)
+    if summary.empty:
+        container.write("No LM calls recorded for this run.")
+        return
+    total = summary.iloc[0]
+    columns = container.columns(4)
+    columns[0].metric("LM calls", f"{total['calls']}", help=f"{total['cache_hits']} answered from the cache")
+    columns[1].metric("Calls/s", f"{total['calls_per_s']:.2f}")
+    columns[2].metric("Tokens", f"{total['prompt_tokens'] + total['completion_tokens']:,}",
+                      help=f"{total['prompt_tokens']:,} prompt, {total['completion_tokens']:,} completion")
+    columns[3].metric("Est. cost", f"${total['cost_usd']:.4f}")
+    container.dataframe(summary, hide_index=True)
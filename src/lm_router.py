@@ -0,0 +1,268 @@
+# src/lm_router.py
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import dspy
+import litellm
+import pandas as pd
+
+DEFAULT_TIMEOUT_S = 120.0
+# Problems with the request itself (e.g. a prompt over the context window) or with its
+# credentials: another attempt fails the same way, and the backend is not to blame.
+NON_RETRYABLE_ERRORS = (litellm.BadRequestError, litellm.AuthenticationError)
+
+logger = logging.getLogger(__name__)
+
+
+class RouterError(RuntimeError):
+    """
+    Raised when every attempt of a request failed; the last backend error is chained.
+    """
+
+
+class Backend:
+    """
+    One LM endpoint in a RouterLM pool.
+
+    Parameters:
+    name (str): Label used in logs, stats and LM metrics.
+    lm (dspy.BaseLM): The configured LM; it should not retry on its own (num_retries=0),
+        so failures surface quickly and the router can fail over, and its own request timeout
+        should not exceed the router's, so a hung request frees its slot (see build_router).
+    weight (float): Relative share of traffic when several backends have free capacity.
+    max_concurrency (int): Requests this backend may have in flight at once.
+    timeout (float, optional): Per-attempt timeout overriding the router's.
+    """
+
+    def __init__(self, name: str, lm, weight: float = 1.0, max_concurrency: int = 4, timeout: float = None):
+        self.name = name
+        self.lm = lm
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+        self.latency_ewma = None
+
+    def load(self) -> float:
+        return (self.in_flight + 1) / self.weight
+
+
+class RouterLM(dspy.BaseLM):
+    """
+    Spreads LM requests over a pool of backends and fails over between them.
+
+    - Routing: each request goes to the backend with free capacity and the lowest
+      (in flight + 1) / weight, ties broken by its recent latency. When every backend is
+      at max_concurrency the caller waits for a slot.
+    - Failover: an error or a timeout puts the backend in cooldown (doubling with consecutive
+      failures, up to max_cooldown) and the request is retried on another backend, up to
+      max_attempts attempts with exponential backoff. If every backend is cooling down they
+      are tried anyway rather than stalling the run. NON_RETRYABLE_ERRORS are raised to the
+      caller right away and don't count against the backend.
+    - Hedging: with hedge_after set, a request still unanswered after that many seconds is
+      sent once more (to another backend if one is free) and the first answer wins.
+
+    The response carries `backend`, `backend_model` and `retries` attributes, which
+    InstrumentedLM records. Drop-in replacement for a single dspy.LM, like CachedLM.
+    """
+
+    def __init__(self, backends, max_attempts: int = 3, timeout: float = DEFAULT_TIMEOUT_S,
+                 hedge_after: float = None, backoff: float = 0.5, cooldown: float = 5.0, max_cooldown: float = 300.0):
+        if not backends:
+            raise ValueError("RouterLM needs at least one backend")
+        first = backends[0].lm
+        super().__init__(model="router/" + "+".join(backend.name for backend in backends),
+                         model_type=first.model_type, cache=first.cache)
+        # Predict reads defaults such as temperature from lm.kwargs; each backend applies its own.
+        self.kwargs = dict(first.kwargs)
+        self.backends = list(backends)
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.hedges = 0
+        self.timeouts = 0
+        self._cond = threading.Condition()
+        # Every running call holds a backend slot, so this many threads are always enough.
+        self._pool = ThreadPoolExecutor(max_workers=sum(backend.max_concurrency for backend in backends),
+                                        thread_name_prefix="lm-router")
+
+    def __deepcopy__(self, memo):
+        # dspy copies LMs with copy.deepcopy; all copies should share one pool and its state.
+        return self
+
+    # --- backend selection ----------------------------------------------------
+
+    def _acquire(self, exclude=(), block: bool = True):
+        """
+        Reserves a slot on the best backend, preferring healthy backends not in exclude.
+        Returns None if block is False and no backend has a free slot.
+        """
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                healthy = [backend for backend in self.backends if backend.down_until <= now] or self.backends
+                preferred = [backend for backend in healthy if backend.name not in exclude] or healthy
+                free = [backend for backend in preferred if backend.in_flight < backend.max_concurrency]
+                if free:
+                    backend = min(free, key=lambda b: (b.load(), b.latency_ewma or 0.0))
+                    backend.in_flight += 1
+                    backend.calls += 1
+                    return backend
+                if not block:
+                    return None
+                self._cond.wait(timeout=0.5)
+
+    def _release(self, backend: Backend, latency: float = None, failed: bool = False):
+        with self._cond:
+            backend.in_flight -= 1
+            if failed:
+                self._mark_failed(backend)
+            elif latency is not None:
+                backend.consecutive_failures = 0
+                backend.down_until = 0.0
+                backend.latency_ewma = latency if backend.latency_ewma is None else (
+                    0.8 * backend.latency_ewma + 0.2 * latency)
+            self._cond.notify_all()
+
+    def _mark_failed(self, backend: Backend):
+        # Caller holds self._cond.
+        backend.errors += 1
+        backend.consecutive_failures += 1
+        pause = min(self.cooldown * 2 ** (backend.consecutive_failures - 1), self.max_cooldown)
+        backend.down_until = time.monotonic() + pause
+
+    def _call(self, backend: Backend, prompt, messages, kwargs, abandoned: threading.Event):
+        start = time.perf_counter()
+        try:
+            response = backend.lm.forward(prompt=prompt, messages=messages, **kwargs)
+        except NON_RETRYABLE_ERRORS:
+            self._release(backend)
+            raise
+        except Exception:
+            # A call the router already gave up on was counted as failed at its timeout.
+            self._release(backend, failed=not abandoned.is_set())
+            raise
+        self._release(backend, latency=time.perf_counter() - start)
+        return response
+
+    # --- requests -------------------------------------------------------------
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        last_error = None
+        tried = []
+        for attempt in range(self.max_attempts):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            backend = self._acquire(exclude=tried)
+            tried.append(backend.name)
+            try:
+                response, winner = self._attempt(backend, prompt, messages, kwargs)
+            except NON_RETRYABLE_ERRORS:
+                raise
+            except Exception as e:
+                last_error = e
+                logger.debug("LM attempt %d on %s failed: %r", attempt + 1, backend.name, e)
+                continue
+            for name, value in (("backend", winner.name), ("backend_model", winner.lm.model), ("retries", attempt)):
+                try:
+                    setattr(response, name, value)
+                except (AttributeError, TypeError, ValueError):
+                    pass
+            return response
+        raise RouterError(f"All {self.max_attempts} attempts failed (backends tried: {', '.join(tried)})") from last_error
+
+    def _attempt(self, backend: Backend, prompt, messages, kwargs):
+        """
+        Sends one attempt (plus at most one hedged duplicate) and returns (response, backend)
+        of the first success. Raises the last error if every copy failed, or TimeoutError.
+        """
+        timeout = backend.timeout or self.timeout
+        start = time.monotonic()
+        abandoned = threading.Event()
+        futures = {self._pool.submit(self._call, backend, prompt, messages, kwargs, abandoned): backend}
+        hedged = self.hedge_after is None
+        error = None
+        while futures:
+            elapsed = time.monotonic() - start
+            next_event = timeout if hedged else min(timeout, self.hedge_after)
+            done, _ = wait(list(futures), timeout=max(0.0, next_event - elapsed), return_when=FIRST_COMPLETED)
+            for future in done:
+                source = futures.pop(future)
+                if future.exception() is None:
+                    return future.result(), source
+                error = future.exception()
+                if isinstance(error, NON_RETRYABLE_ERRORS):
+                    raise error
+            if done:
+                continue
+            elapsed = time.monotonic() - start
+            if not hedged and elapsed >= self.hedge_after:
+                hedged = True
+                hedge = self._acquire(exclude=[b.name for b in futures.values()], block=False)
+                if hedge is not None:
+                    self.hedges += 1
+                    futures[self._pool.submit(self._call, hedge, prompt, messages, kwargs, abandoned)] = hedge
+                continue
+            if elapsed >= timeout:
+                # The calls keep running (and holding their slots) until the backend LM's own
+                # timeout ends them; their backends are put in cooldown so new requests go elsewhere.
+                with self._cond:
+                    abandoned.set()
+                    self.timeouts += 1
+                    for source in futures.values():
+                        self._mark_failed(source)
+                raise TimeoutError(f"No answer from {', '.join(b.name for b in futures.values())} "
+                                   f"within {timeout:.1f}s")
+        raise error
+
+    def stats(self) -> pd.DataFrame:
+        """
+        Per-backend calls, errors, requests in flight, latency (EWMA, seconds) and remaining cooldown.
+        """
+        now = time.monotonic()
+        with self._cond:
+            return pd.DataFrame([
+                {
+                    "backend": backend.name,
+                    "model": backend.lm.model,
+                    "weight": backend.weight,
+                    "calls": backend.calls,
+                    "errors": backend.errors,
+                    "in_flight": backend.in_flight,
+                    "latency_ewma_s": backend.latency_ewma,
+                    "cooldown_s": max(0.0, backend.down_until - now),
+                }
+                for backend in self.backends
+            ])
+
+
+def build_router(specs, **options) -> RouterLM:
+    """
+    Builds a RouterLM from backend specs such as config.LM_POOL.
+
+    Each spec is a dict with name, and optionally weight, max_concurrency and timeout; every
+    other key (model, api_base, api_key, max_tokens, ...) is passed to dspy.LM. Backends
+    don't retry on their own unless the spec sets num_retries. options go to RouterLM.
+    The attempt timeout (the spec's, else the router's) is also the backend's HTTP timeout,
+    so a request the router gave up on is aborted instead of holding its slot.
+    """
+    backends = []
+    for spec in specs:
+        spec = dict(spec)
+        name = spec.pop("name")
+        weight = spec.pop("weight", 1.0)
+        max_concurrency = spec.pop("max_concurrency", 4)
+        timeout = spec.pop("timeout", None)
+        spec.setdefault("num_retries", 0)
+        lm = dspy.LM(**spec, timeout=timeout or options.get("timeout", DEFAULT_TIMEOUT_S))
+        backends.append(Backend(name, lm, weight=weight, max_concurrency=max_concurrency, timeout=timeout))
+    return RouterLM(backends, **options)
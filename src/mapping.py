@@ -0,0 +1,334 @@
+# src/mapping.py
+import logging
+import time
+from collections import Counter, defaultdict
+from typing import Literal
+
+import dspy
+import pandas as pd
+
+from src.category_index import CategoryIndex
+from src.concurrency import iter_concurrently
+from src.embedding_store import get_embedding_store
+from src.lm_metrics import lm_tags
+from src.progress import Progress
+
+UNCATEGORIZED = "Uncategorized"
+
+logger = logging.getLogger(__name__)
+
+
+def load_extracted_causes(csv_path: str = "./data/result_df_31_Oct.csv") -> pd.DataFrame:
+    """
+    Loads the causality extraction results to be mapped onto driver categories,
+    renaming the OpenAI columns and keeping only the ones used by the mapping.
+    """
+    return (
+        pd.read_csv(csv_path)
+        .rename(
+            columns={
+                "Cause": "Cause_by_OpenAI",
+                "Effect": "Effect_by_OpenAI",
+                "Cause_category": "Cause_category_by_OpenAI",
+                "Effect_category": "Effect_category_by_OpenAI",
+            }
+        )
+        .filter(
+            [
+                "DonId",
+                "Cause_by_OpenAI",
+                "Effect_by_OpenAI",
+                "Cause_category_by_OpenAI",
+                "Effect_category_by_OpenAI",
+                "Raw_Text",
+            ]
+        )
+    )
+
+
+# --- DSPy Signature for Categorization ---
+def make_categorization_signature(driver_categories):
+    """
+    Builds the categorization signature for a given list of driver categories.
+    """
+    class CauseCategorizationSignature(dspy.Signature):
+        """
+        Categorize cause text into one of the predefined driver categories.
+        """
+        cause_text = dspy.InputField(desc="Cause text from causal extraction")
+        driver_category = dspy.OutputField(
+            desc=f"Category from: {', '.join(driver_categories)}",
+            type=Literal[tuple(driver_categories)]  # Enforcing a Literal output
+        )
+
+    return CauseCategorizationSignature
+
+
+# --- Category Validator Module with Semantic Similarity ---
+class CategoryValidator(dspy.Module):
+    def __init__(self, index: CategoryIndex, min_similarity: float = 0.5):
+        """
+        Initialize the category validator module.
+        Parameters:
+        index (CategoryIndex): Precompiled index of the valid categories to validate against.
+        min_similarity (float): Semantic similarity above which the closest category is accepted.
+        """
+        super().__init__()
+        self.index = index
+        self.categories = index.categories
+        self.min_similarity = min_similarity
+        # Shared on-disk embedding cache (the model itself is only loaded on a cache miss)
+        self.store = get_embedding_store(index.model_name)
+
+        # Precomputed, normalized embeddings for driver categories (at the index's precision)
+        self.category_vectors = index.vectors
+
+    def match_lexical(self, output: str):
+        """
+        Cheap matching tiers: direct, normalized and pattern match against the category names.
+        Returns (category, tier) or (None, None) when none of them applies.
+        """
+        # Direct or normalized match
+        category = self.index.lookup(output)
+        if category is not None:
+            return category, "direct" if category == output else "normalized"
+        # Pattern matching fallback (longest category name mentioned in the text)
+        category = self.index.find(output)
+        if category is not None:
+            return category, "pattern"
+        return None, None
+
+    def top_similarities_many(self, outputs, k: int = 2):
+        """
+        Encodes all outputs in one batch and scores them against the categories with a
+        single similarity matrix. Returns, per output, the k best (score, category) pairs.
+        """
+        if not outputs:
+            return []
+        scores, indices = self.index.top_k(self.store.encode(list(outputs)), k=k)
+        return [
+            [(float(score), self.categories[idx]) for score, idx in zip(row_scores, row_indices)]
+            for row_scores, row_indices in zip(scores, indices)
+        ]
+
+    def top_similarities(self, output: str, k: int = 2):
+        """
+        Returns the k best (score, category) pairs by cosine similarity, best first.
+        """
+        return self.top_similarities_many([output], k=k)[0]
+
+    def validate_many(self, outputs) -> list:
+        """
+        Batch version of forward: lexical matching per output, then one embedding
+        call and one similarity matrix for everything that is left.
+        """
+        results = [None] * len(outputs)
+        semantic = []
+        for i, output in enumerate(outputs):
+            results[i], _ = self.match_lexical(output)
+            if results[i] is None:
+                semantic.append(i)
+        ranked = self.top_similarities_many([outputs[i] for i in semantic], k=1)
+        for i, best in zip(semantic, ranked):
+            best_score, best_category = best[0]
+            results[i] = best_category if best_score > self.min_similarity else UNCATEGORIZED
+        return results
+
+    def forward(self, output: str) -> str:
+        category, tier = self.match_lexical(output)
+        if category is not None:
+            logger.debug("%s match found: %s", tier.capitalize(), category)
+            return category
+        # Semantic similarity matching
+        logger.debug("Performing semantic similarity matching for output: %s", output)
+        best_score, best_category = self.top_similarities(output, k=1)[0]
+        logger.debug("Semantic similarity score: %s for category: %s", best_score, best_category)
+        # Set a threshold for acceptance (tune as needed)
+        if best_score > self.min_similarity:
+            logger.debug("Semantic match accepted: %s", best_category)
+            return best_category
+        logger.debug("No suitable match found. Returning 'Uncategorized'")
+        return UNCATEGORIZED
+
+
+# --- DSPy Module for Cause Categorization ---
+class CauseCategorizationModule(dspy.Module):
+    def __init__(self, index: CategoryIndex, fast_path: bool = True, min_similarity: float = 0.6,
+                 min_margin: float = 0.1):
+        """
+        Initialize the cause categorization module.
+        This module is a wrapper around ChainOfThought that validates the output category
+        against the predefined driver categories.
+        Parameters:
+        index (CategoryIndex): Precompiled index of the driver categories.
+        fast_path (bool): Try cheap matching on the raw cause text before calling the LLM.
+        min_similarity (float): Minimum top-1 embedding similarity for the embedding tier.
+        min_margin (float): Minimum gap between the top-1 and top-2 similarity; below it the
+            embedding match is considered ambiguous and the cause is escalated to the LLM.
+        """
+        super().__init__()
+        self.driver_categories = index.categories
+        self.predict = dspy.ChainOfThought(make_categorization_signature(index.categories))
+        self.validator = CategoryValidator(index)
+        self.fast_path = fast_path
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self.tier_counts = Counter()
+        self.tier_scored = Counter()
+        self.tier_seconds = defaultdict(float)
+
+    def _record(self, tier: str, start: float, count: int = 1, scored: int = None):
+        # A batched tier spends its time on every cause it scored, not just the ones it resolved.
+        scored = count if scored is None else scored
+        if not scored:
+            return
+        self.tier_counts[tier] += count
+        self.tier_scored[tier] += scored
+        self.tier_seconds[tier] += time.perf_counter() - start
+
+    def tier_stats(self) -> pd.DataFrame:
+        """
+        Number of causes resolved by each tier of the cascade, the number it scored
+        (resolved or passed on to the next tier) and its mean latency per scored cause.
+        """
+        return pd.DataFrame(
+            [
+                {
+                    "tier": tier,
+                    "count": self.tier_counts[tier],
+                    "scored": scored,
+                    "mean_latency_ms": 1000 * self.tier_seconds[tier] / scored,
+                }
+                for tier, scored in self.tier_scored.items()
+            ]
+        )
+
+    def _is_confident(self, ranked) -> bool:
+        best_score = ranked[0][0]
+        margin = best_score - ranked[1][0] if len(ranked) > 1 else best_score
+        return best_score >= self.min_similarity and margin >= self.min_margin
+
+    def _ask_llm(self, cause_text: str) -> str:
+        """
+        Sends one cause to the ChainOfThought predictor and returns the raw category text.
+        """
+        # Construct a strict prompt to guide the LLM output
+        prompt = (
+            f"Analyze this cause text and categorize it EXACTLY as one of: {', '.join(self.driver_categories)}.\n"
+            f"Text: {cause_text}\n"
+            "Respond ONLY with the category name from the list. Do not include any extra text. "
+            "If unsure, respond with 'Uncategorized'."
+        )
+        with lm_tags(stage="categorize"):
+            response = self.predict(cause_text=prompt)
+        raw_response = response.driver_category if hasattr(response, "driver_category") else ""
+        # Extract the category output (assuming colon-separated format)
+        return raw_response.split(":")[-1].strip() if raw_response else ""
+
+    def forward(self, cause_text: str) -> str:
+        start = time.perf_counter()
+        cause_text = str(cause_text)
+        if self.fast_path:
+            # Tier 1: exact/normalized/pattern match on the raw cause text
+            category, tier = self.validator.match_lexical(cause_text)
+            if category is not None:
+                logger.debug("Fast path (%s): %s", tier, category)
+                self._record(tier, start)
+                return category
+            # Tier 2: embedding similarity, accepted only when it is clearly decisive
+            ranked = self.validator.top_similarities(cause_text, k=2)
+            if self._is_confident(ranked):
+                logger.debug("Fast path (embedding, score %.2f): %s", ranked[0][0], ranked[0][1])
+                self._record("embedding", start)
+                return ranked[0][1]
+
+        # Tier 3: LLM
+        raw_category = self._ask_llm(cause_text)
+        logger.debug("Extracted raw category: %s", raw_category)
+        # Validate and normalize the response
+        validated_category = self.validator(raw_category)
+        logger.debug("Validated category: %s", validated_category)
+        self._record("llm", start)
+        return validated_category
+
+    def categorize_many(self, causes, max_workers: int = 4, progress=None) -> list:
+        """
+        Categorizes a whole column of causes at once.
+
+        Identical cause strings are categorized once. Lexical matching runs per unique
+        cause; everything left is embedded in one batch and compared to the categories
+        with one similarity matrix; only ambiguous causes go to the LLM, with up to
+        max_workers requests in flight, and all LLM answers are validated in one batch.
+        Missing causes (NaN/empty) are Uncategorized without any model call.
+        `progress` advances once per unique cause and counts the causes resolved by each tier.
+
+        Returns:
+            list[str]: One category per input cause, in input order.
+        """
+        progress = progress or Progress()
+        causes = list(causes)
+        unique = list(dict.fromkeys(str(c) for c in causes if isinstance(c, str) and c.strip()))
+        resolved = {}
+        progress.start("categorize", total=len(unique))
+
+        remaining = []
+        for cause in unique:
+            start = time.perf_counter()
+            category, tier = self.validator.match_lexical(cause) if self.fast_path else (None, None)
+            if category is not None:
+                resolved[cause] = category
+                self._record(tier, start)
+                progress.incr(tier)
+                progress.advance()
+            else:
+                remaining.append(cause)
+
+        to_llm = remaining
+        if self.fast_path and remaining:
+            start = time.perf_counter()
+            to_llm = []
+            for cause, ranked in zip(remaining, self.validator.top_similarities_many(remaining, k=2)):
+                if self._is_confident(ranked):
+                    resolved[cause] = ranked[0][1]
+                else:
+                    to_llm.append(cause)
+            self._record("embedding", start, count=len(remaining) - len(to_llm), scored=len(remaining))
+            progress.incr("embedding", len(remaining) - len(to_llm))
+            progress.advance(len(remaining) - len(to_llm))
+
+        if to_llm:
+            start = time.perf_counter()
+            raw_categories = []
+            for raw_category in iter_concurrently(self._ask_llm, to_llm, max_workers=max_workers):
+                raw_categories.append(raw_category)
+                progress.incr("llm")
+                progress.advance()
+            for cause, category in zip(to_llm, self.validator.validate_many(raw_categories)):
+                resolved[cause] = category
+            self._record("llm", start, count=len(to_llm))
+        progress.finish()
+
+        return [
+            resolved[str(c)] if isinstance(c, str) and c.strip() else UNCATEGORIZED
+            for c in causes
+        ]
+
+
+# --- Processing Pipeline ---
+def process_dataframe(df: pd.DataFrame, categorizer: CauseCategorizationModule, cause_col: str = "Cause_by_OpenAI",
+                      max_workers: int = 4, progress=None) -> pd.DataFrame:
+    """
+    Process a given dataframe by categorizing the causes using the provided categorizer module.
+    Parameters:
+    df (pd.DataFrame): DataFrame to be processed.
+    categorizer (CauseCategorizationModule): Module to be used for categorization.
+    cause_col (str): Column holding the cause text.
+    max_workers (int): Maximum number of concurrent LLM requests.
+    progress (Progress, optional): Progress reporter, e.g. Progress(StreamlitSink()) in the UI.
+    Returns:
+    pd.DataFrame: Processed DataFrame with the categorized causes in the 'Cause_driver_category' column.
+    """
+    df = df.copy()
+    df["Cause_driver_category"] = categorizer.categorize_many(df[cause_col], max_workers=max_workers,
+                                                              progress=progress)
+    return df
@@ -1,11 +1,28 @@
+import json
+import logging
+import os
 import pandas as pd
-import streamlit as st
 import dspy
 import random
 from dspy.teleprompt import LabeledFewShot
-from dspy.evaluate.evaluate import Evaluate
 from config import configure_lm 
-from src.data_utils import chunk_text_by_sentences
+from src.data_utils import (
+    estimate_tokens,
+    iter_inference_data,
+    iter_sentence_chunks,
+    iter_token_chunks,
+    load_completed_keys,
+    merge_chunk_pairs,
+)
+from src.dedup import dedupe_texts
+from src.demo_retrieval import RetrievalFewShot
+from src.evaluation import parse_extracted_pairs
+from src.concurrency import iter_concurrently
+from src.lm_cache import file_hash, get_response_cache
+from src.lm_metrics import lm_tags
+from src.progress import Progress
+
+logger = logging.getLogger(__name__)
 
 # Updated Signature to match richer training data
 class CauseEffectSignature(dspy.Signature):
@@ -13,23 +30,25 @@ class CauseEffectSignature(dspy.Signature):
     marked_text = dspy.OutputField(desc="Text with inline annotations for cause/effect")
     extracted_pairs = dspy.OutputField(desc="Structured extracted cause-effect pairs (list of dicts)")
 
-def _initialize_lm():
+def _initialize_lm(use_cache=True, namespace="", lm_model=""):
     """
     Helper function to configure the LM and update DSPy's settings.
+    With use_cache, LM responses are served from the shared SQLite response cache;
+    namespace identifies the compiled program whose demos are in the prompt.
+    lm_model is passed on to configure_lm ("openai", "pool" or the local Llama default).
     Returns the LM instance.
     """
-    lm = configure_lm()
-    dspy.settings.configure(lm=lm)
-    return lm
+    response_cache = get_response_cache() if use_cache else None
+    return configure_lm(lm_model, response_cache=response_cache, namespace=namespace)
 
-def build_and_train_model(train_examples):
+def build_and_train_model(train_examples, lm_model=""):
     """
     Builds and compiles the DSPy Chain-of-Thought model using a few-shot approach.
     Expects training examples to contain keys corresponding to the new signature (e.g., text, marked_text, extracted_pairs).
     """
-    lm = _initialize_lm()
-    st.write("Before training, dspy.settings.lm:", dspy.settings.lm)
-    st.write("Before training, model.lm:", lm)  # This should be the same as dspy.settings.lm
+    lm = _initialize_lm(lm_model=lm_model)
+    logger.debug("Before training, dspy.settings.lm: %s", dspy.settings.lm)
+    logger.debug("Before training, model.lm: %s", lm)  # This should be the same as dspy.settings.lm
     cot_model = dspy.ChainOfThought(CauseEffectSignature)
     cot_model.lm = lm  # explicitly assign the LM
     few_shot_optimizer = LabeledFewShot(k=min(7, len(train_examples)))
@@ -39,54 +58,316 @@ def build_and_train_model(train_examples):
     )
     return few_shot_cause_effect
 
-def load_model(model_path: str):
+def with_demo_selector(model, demo_selector=None):
+    """
+    Wraps model so each call uses the demos demo_selector (a src.demo_retrieval.DemoSelector)
+    retrieves for its input. Returns model unchanged if there is no selector or it is already wrapped.
+    """
+    if demo_selector is None or isinstance(model, RetrievalFewShot):
+        return model
+    return RetrievalFewShot(model, demo_selector)
+
+def load_model(model_path: str, use_cache=True, lm_model="", demo_selector=None):
     """
     Loads a saved DSPy model from disk and reassigns the LM.
+    Cached responses are keyed on the model file's hash, so re-running the same
+    program on the same inputs (e.g. evaluating with several metrics) reuses them.
+    With a demo_selector, the returned program retrieves its demos per input instead
+    of using the ones saved in the file (see with_demo_selector).
     """
-    lm = _initialize_lm()
+    lm = _initialize_lm(use_cache=use_cache, namespace=file_hash(model_path), lm_model=lm_model)
     model = dspy.ChainOfThought(CauseEffectSignature)
     model.load(model_path)
     model.lm = lm
-    st.write("After loading, dspy.settings.lm:", dspy.settings.lm)
-    st.write("After loading, model.lm:", model.lm)
-    return model
+    # Bind the LM to every predictor so the program doesn't depend on dspy's global settings.
+    model.set_lm(lm)
+    logger.debug("After loading, dspy.settings.lm: %s", dspy.settings.lm)
+    logger.debug("After loading, model.lm: %s", model.lm)
+    return with_demo_selector(model, demo_selector)
 
-def predict_cause_effect(df: pd.DataFrame, model, text_col='Text') -> pd.DataFrame:
+def _predict_text(model, text, stage, original_index=None, don_id=None):
     """
-    Runs inference on each row's full text and returns a DataFrame with:
-    - The original text
-    - The model's predicted marked text
-    - The model's extracted cause/effect pairs.
+    Runs the model on one text with its LM calls tagged for src.lm_metrics.
+    """
+    with lm_tags(stage=stage, original_index=original_index, don_id=don_id):
+        return model(text=text)
+
+def _don_ids(df: pd.DataFrame) -> dict:
+    return df['DonId'].to_dict() if 'DonId' in df.columns else {}
+
+def iter_predict_cause_effect(df: pd.DataFrame, model, text_col='Text', max_workers=1, rate_limiter=None,
+                              progress=None, demo_selector=None):
     """
-    results = []
-    for idx, row in df.iterrows():
-        text_val = row[text_col]
-        prediction = model(text=text_val)
-        results.append({
+    Generator version of predict_cause_effect: yields one result dict per row
+    (OriginalIndex, DonId, Text, PredictedMarkedText, PredictedExtractedPairs) as soon as it and
+    every row before it have been predicted, so callers can show or write results while
+    later rows are still in flight.
+    """
+    progress = progress or Progress()
+    model = with_demo_selector(model, demo_selector)
+    rows = list(df[text_col].items())
+    don_ids = _don_ids(df)
+    predictions = progress.track(
+        iter_concurrently(
+            lambda item: _predict_text(model, item[1], "predict", item[0], don_ids.get(item[0])),
+            rows,
+            max_workers=max_workers,
+            rate_limiter=rate_limiter,
+            cost=lambda item: estimate_tokens(item[1]),
+        ),
+        "predict",
+        total=len(rows),
+    )
+    # predictions comes first so zip exhausts it and the progress stage gets finished.
+    for prediction, (idx, text_val) in zip(predictions, rows):
+        yield {
             'OriginalIndex': idx,
+            'DonId': don_ids.get(idx),
             'Text': text_val,
             'PredictedMarkedText': prediction.marked_text,
             'PredictedExtractedPairs': prediction.extracted_pairs
-        })
-    return pd.DataFrame(results)
+        }
+
+def predict_cause_effect(df: pd.DataFrame, model, text_col='Text', max_workers=1, rate_limiter=None,
+                         progress=None, demo_selector=None) -> pd.DataFrame:
+    """
+    Runs inference on each row's full text and returns a DataFrame with:
+    - The original text
+    - The model's predicted marked text
+    - The model's extracted cause/effect pairs.
+    With max_workers > 1, up to that many LM requests are in flight at once
+    (optionally throttled by a shared RateLimiter); rows are still returned in
+    the original OriginalIndex order. Progress is reported to `progress` (a
+    src.progress.Progress; by default a log sink). With a demo_selector, every text is
+    sent with the demos retrieved for it instead of the program's fixed demos.
+    """
+    return pd.DataFrame(list(iter_predict_cause_effect(
+        df, model, text_col=text_col, max_workers=max_workers, rate_limiter=rate_limiter, progress=progress,
+        demo_selector=demo_selector,
+    )))
+
+def _plan_chunks(df, text_col, chunk_size, overlap, max_tokens, dedupe, near_duplicates, near_duplicate_threshold):
+    """
+    Cuts every row into chunks and groups repeated chunks.
+    Returns (jobs, chunk_texts, unique_ids, assignment): one (idx, text, ChunkRecord) job per
+    chunk, its text, the jobs actually sent to the LM, and each job's slot among those.
+    """
+    jobs = []
+    for idx, text_val in df[text_col].items():
+        text_val = text_val if isinstance(text_val, str) else str(text_val)
+        if max_tokens:
+            records = iter_token_chunks(text_val, doc_id=idx, max_tokens=max_tokens, overlap=overlap)
+        else:
+            # e.g. 4 sentences per chunk with an overlap of 1 sentence
+            records = iter_sentence_chunks(text_val, doc_id=idx, chunk_size=chunk_size, overlap=overlap)
+        for record in records:
+            jobs.append((idx, text_val, record))
+    chunk_texts = [record.text_of(text_val) for _, text_val, record in jobs]
+    if dedupe:
+        unique_ids, assignment = dedupe_texts(chunk_texts, near_duplicates=near_duplicates,
+                                              threshold=near_duplicate_threshold)
+    else:
+        unique_ids, assignment = list(range(len(jobs))), list(range(len(jobs)))
+    return jobs, chunk_texts, unique_ids, assignment
+
+def _merged_row(idx, text_val, chunks, don_id=None):
+    return {
+        'OriginalIndex': idx,
+        'DonId': don_id,
+        'Text': text_val,
+        'NumChunks': len(chunks),
+        'PredictedExtractedPairs': merge_chunk_pairs(text_val, chunks)
+    }
+
+def _iter_chunk_rows(model, plan, merge, max_workers, rate_limiter, progress, don_ids=None):
+    jobs, chunk_texts, unique_ids, assignment = plan
+    don_ids = don_ids or {}
+    for name, count in (('lm_calls', len(unique_ids)), ('lm_calls_saved', len(jobs) - len(unique_ids))):
+        progress.incr(name, count)
+    unique_predictions = progress.track(
+        iter_concurrently(
+            lambda i: _predict_text(model, chunk_texts[i], "predict chunks", jobs[i][0], don_ids.get(jobs[i][0])),
+            unique_ids,
+            max_workers=max_workers,
+            rate_limiter=rate_limiter,
+            cost=lambda i: estimate_tokens(chunk_texts[i]),
+        ),
+        "predict chunks",
+        total=len(unique_ids),
+    )
+    # A job's representative is never later than the job itself, so jobs can be
+    # released in order as soon as the predictions up to their slot are in.
+    done = []
+    pending = None  # (idx, text, [(record, pairs), ...]) of the document being merged
+    job_id = 0
+    for prediction in unique_predictions:
+        done.append(prediction)
+        while job_id < len(jobs) and assignment[job_id] < len(done):
+            (idx, text_val, record), prediction_for_job = jobs[job_id], done[assignment[job_id]]
+            if merge:
+                if pending is not None and pending[0] != idx:
+                    yield _merged_row(*pending, don_id=don_ids.get(pending[0]))
+                    pending = None
+                if pending is None:
+                    pending = (idx, text_val, [])
+                pending[2].append((record, parse_extracted_pairs(prediction_for_job.extracted_pairs)))
+            else:
+                yield {
+                    'OriginalIndex': idx,
+                    'DonId': don_ids.get(idx),
+                    'Text': text_val,
+                    'Chunk': chunk_texts[job_id],
+                    'ChunkStart': record.start,
+                    'ChunkEnd': record.end,
+                    'SentenceIds': list(record.sentence_ids),
+                    'PredictedMarkedText': prediction_for_job.marked_text,
+                    'PredictedExtractedPairs': prediction_for_job.extracted_pairs
+                }
+            job_id += 1
+    if pending is not None:
+        yield _merged_row(*pending, don_id=don_ids.get(pending[0]))
 
-def predict_cause_effect_with_chunking(df: pd.DataFrame, model, text_col='Text', chunk_size=4, overlap=1) -> pd.DataFrame:
+def iter_predict_cause_effect_with_chunking(df: pd.DataFrame, model, text_col='Text', chunk_size=4, overlap=1,
+                                            max_workers=1, rate_limiter=None, max_tokens=None, merge=False,
+                                            dedupe=True, near_duplicates=False, near_duplicate_threshold=0.9,
+                                            progress=None):
+    """
+    Generator version of predict_cause_effect_with_chunking: yields one result dict per
+    chunk (or, with merge, per document) in order, as soon as its prediction is available.
+    The numbers of LM calls made and saved are added to the counters of `progress`.
+    """
+    progress = progress or Progress()
+    plan = _plan_chunks(df, text_col, chunk_size, overlap, max_tokens, dedupe, near_duplicates,
+                        near_duplicate_threshold)
+    yield from _iter_chunk_rows(model, plan, merge, max_workers, rate_limiter, progress, _don_ids(df))
+
+def predict_cause_effect_with_chunking(df: pd.DataFrame, model, text_col='Text', chunk_size=4, overlap=1,
+                                       max_workers=1, rate_limiter=None, max_tokens=None, merge=False,
+                                       dedupe=True, near_duplicates=False, near_duplicate_threshold=0.9,
+                                       progress=None) -> pd.DataFrame:
     """
     Splits each text into chunks (using sentence-based chunking), runs predictions on each chunk,
-    and aggregates the results.
-    """
-    results = []
-    for idx, row in df.iterrows():
-        text_val = row[text_col]
-        # Split text into chunks (e.g., 4 sentences per chunk with an overlap of 1 sentence)
-        chunks = chunk_text_by_sentences(text_val, chunk_size=chunk_size, overlap=overlap)
-        for chunk in chunks:
-            prediction = model(text=chunk)
-            results.append({
-                'OriginalIndex': idx,
-                'Text': text_val,
-                'Chunk': chunk,
-                'PredictedMarkedText': prediction.marked_text,
-                'PredictedExtractedPairs': prediction.extracted_pairs
-            })
-    return pd.DataFrame(results)
+    and aggregates the results. Chunks are predicted concurrently when max_workers > 1.
+
+    With max_tokens set, whole sentences are packed into chunks of at most that many LM
+    tokens instead of fixed windows of chunk_size sentences (overlap is then in sentences
+    as well). Every row records where its chunk came from (ChunkStart/ChunkEnd character
+    offsets and SentenceIds). With merge=True one row per OriginalIndex is returned and
+    pairs found in several overlapping chunks are kept once (see merge_chunk_pairs).
+
+    With dedupe, chunks repeated across rows (WHO-DON boilerplate) are sent to the LM only
+    once and the prediction is copied to every OriginalIndex containing them;
+    near_duplicates additionally merges chunks whose MinHash similarity reaches
+    near_duplicate_threshold. The number of LM calls made and saved is reported in
+    result.attrs['lm_calls'] and result.attrs['lm_calls_saved'], and added to the
+    counters of `progress`.
+    """
+    progress = progress or Progress()
+    plan = _plan_chunks(df, text_col, chunk_size, overlap, max_tokens, dedupe, near_duplicates,
+                        near_duplicate_threshold)
+    jobs, _, unique_ids, _ = plan
+    results_df = pd.DataFrame(list(_iter_chunk_rows(model, plan, merge, max_workers, rate_limiter, progress,
+                                                    _don_ids(df))))
+    results_df.attrs.update({'lm_calls': len(unique_ids), 'lm_calls_saved': len(jobs) - len(unique_ids)})
+    return results_df
+
+def _truncate_partial_line(path: str, block_size: int = 64 * 1024):
+    """
+    Drops an incomplete trailing line (left by an interrupted write) so new records
+    start on a fresh line. The last newline is searched backwards from the end of the
+    file, block_size bytes at a time, so only the partial line is read.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        f.seek(end - 1)
+        if f.read(1) == b"\n":
+            return
+        while end > 0:
+            start = max(0, end - block_size)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline != -1:
+                f.truncate(start + newline + 1)
+                return
+            end = start
+        f.truncate(0)
+
+def stream_predict_cause_effect(csv_path: str, model, output_path: str, text_col='Text', key_col='OriginalIndex',
+                                chunksize=500, max_rows=None, max_workers=1, rate_limiter=None, progress=None):
+    """
+    Streams the inference CSV through the model in bounded memory and appends every
+    prediction to a JSONL file as soon as it is produced.
+
+    The CSV is read `chunksize` rows at a time. Rows whose `key_col` (OriginalIndex, or
+    DonId if the corpus has one DonId per row) is already present in `output_path` are
+    skipped, so an interrupted run resumes where it stopped.
+
+    Args:
+        csv_path (str): Corpus CSV with a text column (and optionally DonId).
+        model: Loaded DSPy model (any callable accepting text=...).
+        output_path (str): JSONL file the predictions are appended to.
+        key_col (str): Column used to recognize already processed rows. A ValueError is
+            raised up front if it (or text_col) is not in the CSV.
+        max_rows (int, optional): Stop after this many new predictions.
+        max_workers (int): Concurrent LM requests per chunk.
+        rate_limiter (RateLimiter, optional): Shared request/token limiter.
+        progress (Progress, optional): Receives one advance per new prediction and a
+            "skipped" counter for rows already in output_path.
+
+    Yields:
+        dict: One prediction record per processed row, in corpus order.
+    """
+    # OriginalIndex is the row position, assigned below; every other column must be in the CSV.
+    columns = pd.read_csv(csv_path, nrows=0).columns
+    missing = [col for col in dict.fromkeys([text_col, key_col]) if col != 'OriginalIndex' and col not in columns]
+    if missing:
+        raise ValueError(f"{csv_path} has no {', '.join(map(repr, missing))} column (columns: {', '.join(columns)})")
+    progress = progress or Progress()
+    progress.start("stream predict", total=max_rows)
+    completed = load_completed_keys(output_path, key_col=key_col)
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    _truncate_partial_line(output_path)
+    remaining = max_rows
+
+    with open(output_path, "a", encoding="utf-8") as out:
+        for chunk in iter_inference_data(csv_path, chunksize=chunksize):
+            chunk = chunk.assign(OriginalIndex=chunk.index)
+            todo = chunk[~chunk[key_col].isin(completed)]
+            progress.incr("skipped", len(chunk) - len(todo))
+            if remaining is not None:
+                todo = todo.head(remaining)
+            if todo.empty:
+                if remaining == 0:
+                    break
+                continue
+
+            rows = todo.to_dict("records")
+            predictions = iter_concurrently(
+                lambda row: _predict_text(model, row[text_col], "stream predict", row['OriginalIndex'],
+                                          row.get('DonId')),
+                rows,
+                max_workers=max_workers,
+                rate_limiter=rate_limiter,
+                cost=lambda row: estimate_tokens(row[text_col]),
+            )
+            for row, prediction in zip(rows, predictions):
+                record = {
+                    'OriginalIndex': row['OriginalIndex'],
+                    'DonId': row.get('DonId'),
+                    'Text': row[text_col],
+                    'PredictedMarkedText': prediction.marked_text,
+                    'PredictedExtractedPairs': prediction.extracted_pairs
+                }
+                out.write(json.dumps(record, default=str) + "\n")
+                out.flush()
+                completed.add(record[key_col])
+                progress.advance()
+                yield record
+
+            if remaining is not None:
+                remaining -= len(rows)
+                if remaining <= 0:
+                    break
+    progress.finish()
@@ -0,0 +1,186 @@
+# src/model_search.py
+import json
+import os
+import random
+import time
+from typing import NamedTuple
+
+import dspy
+import pandas as pd
+from dspy.teleprompt import BootstrapFewShot, LabeledFewShot
+
+from src.concurrency import iter_concurrently
+from src.evaluation import extracted_pairs_exact_match, extracted_pairs_semantic_match, score_predictions
+from src.lm_metrics import lm_tags
+from src.model_pipeline import CauseEffectSignature, _initialize_lm
+from src.progress import Progress
+
+LEADERBOARD_COLUMNS = ["name", "optimizer", "k", "seed", "num_demos", "exact", "semantic", "errors", "mean_latency_s"]
+
+
+class Candidate(NamedTuple):
+    """
+    One few-shot configuration to compile: k demos drawn with `seed` by `optimizer`
+    ("labeled" or "bootstrap").
+    """
+    name: str
+    optimizer: str
+    k: int
+    seed: int
+
+
+def make_candidates(num_train: int, k_values=(3, 5, 7), subsets_per_k: int = 2, bootstrap: bool = False) -> list:
+    """
+    Enumerates candidate configurations: for every k, `subsets_per_k` different random demo
+    subsets (one per seed), plus one BootstrapFewShot candidate per k if bootstrap is set.
+    k values larger than the training set are clipped and duplicates dropped.
+    """
+    candidates = []
+    for k in sorted({min(k, num_train) for k in k_values if k > 0}):
+        for seed in range(subsets_per_k if k < num_train else 1):
+            candidates.append(Candidate(f"labeled_k{k}_s{seed}", "labeled", k, seed))
+        if bootstrap:
+            candidates.append(Candidate(f"bootstrap_k{k}", "bootstrap", k, 0))
+    return candidates
+
+
+def _bootstrap_metric(example, prediction, trace=None):
+    return extracted_pairs_exact_match(example, prediction) >= 1.0
+
+
+def compile_candidate(candidate: Candidate, train_examples, lm):
+    """
+    Compiles one candidate program and binds it to lm.
+    """
+    student = dspy.ChainOfThought(CauseEffectSignature)
+    if candidate.optimizer == "bootstrap":
+        optimizer = BootstrapFewShot(metric=_bootstrap_metric, max_bootstrapped_demos=candidate.k,
+                                     max_labeled_demos=candidate.k)
+        student.set_lm(lm)
+        program = optimizer.compile(student, trainset=train_examples)
+    else:
+        # LabeledFewShot always samples with Random(0); shuffling first gives each seed its own subset.
+        trainset = list(train_examples)
+        random.Random(candidate.seed).shuffle(trainset)
+        program = LabeledFewShot(k=candidate.k).compile(student=student, trainset=trainset)
+    program.lm = lm
+    program.set_lm(lm)
+    return program
+
+
+def search_few_shot_models(train_examples, dev_examples, k_values=(3, 5, 7), subsets_per_k: int = 2,
+                           bootstrap: bool = False, metric: str = "semantic", max_workers: int = 4,
+                           rate_limiter=None, lm_model: str = "", use_cache: bool = True, progress=None):
+    """
+    Compiles several few-shot candidates and scores all of them on the dev set in parallel.
+
+    Every (candidate, dev example) prediction is one job for a shared worker pool, so
+    max_workers requests are in flight across all candidates. All candidates share the
+    LM response cache, so re-running a search only pays for new prompts.
+
+    Args:
+        train_examples (list[dspy.Example]): Pool the demos are drawn from.
+        dev_examples (list[dspy.Example]): Examples the candidates are scored on.
+        k_values, subsets_per_k, bootstrap: Candidate grid (see make_candidates).
+        metric (str): "semantic" or "exact"; used to rank the candidates.
+        max_workers (int): Concurrent LM requests across all candidates.
+
+    Returns:
+        (dspy.Module, pd.DataFrame, dict): The best program, the leaderboard sorted by
+        `metric` (ties broken by fewer demos), and {candidate name: program}. With no
+        candidates (no positive k or no training examples) the best program is None and
+        the leaderboard is empty.
+    """
+    progress = progress or Progress()
+    candidates = make_candidates(len(train_examples), k_values=k_values, subsets_per_k=subsets_per_k,
+                                 bootstrap=bootstrap)
+    if not candidates:
+        return None, pd.DataFrame(columns=LEADERBOARD_COLUMNS), {}
+    lm = _initialize_lm(use_cache=use_cache, namespace="model_search", lm_model=lm_model)
+    programs = {}
+    for candidate in progress.track(candidates, "compile candidates", total=len(candidates)):
+        with lm_tags(stage="compile candidates", candidate=candidate.name):
+            programs[candidate.name] = compile_candidate(candidate, train_examples, lm)
+
+    def run(job):
+        name, example = job
+        start = time.perf_counter()
+        try:
+            with lm_tags(stage="score candidates", candidate=name):
+                prediction, error = programs[name](**example.inputs()), None
+        except Exception as e:
+            prediction, error = None, repr(e)
+            progress.incr("errors")
+        return prediction, time.perf_counter() - start, error
+
+    jobs = [(candidate.name, example) for candidate in candidates for example in dev_examples]
+    outcomes = list(progress.track(
+        iter_concurrently(run, jobs, max_workers=max_workers, rate_limiter=rate_limiter),
+        "score candidates",
+        total=len(jobs),
+    ))
+
+    metrics = [extracted_pairs_exact_match, extracted_pairs_semantic_match]
+    rows = []
+    for i, candidate in enumerate(candidates):
+        results = outcomes[i * len(dev_examples):(i + 1) * len(dev_examples)]
+        scores = score_predictions(dev_examples, [prediction for prediction, _, _ in results], metrics)
+        demos = programs[candidate.name].predictors()[0].demos
+        rows.append({
+            "name": candidate.name,
+            "optimizer": candidate.optimizer,
+            "k": candidate.k,
+            "seed": candidate.seed,
+            "num_demos": len(demos),
+            "exact": sum(scores["extracted_pairs_exact_match"]) / max(len(dev_examples), 1),
+            "semantic": sum(scores["extracted_pairs_semantic_match"]) / max(len(dev_examples), 1),
+            "errors": sum(error is not None for _, _, error in results),
+            "mean_latency_s": sum(latency for _, latency, _ in results) / max(len(results), 1),
+        })
+    leaderboard = (
+        pd.DataFrame(rows, columns=LEADERBOARD_COLUMNS)
+        .sort_values([metric, "num_demos"], ascending=[False, True], kind="stable")
+        .reset_index(drop=True)
+    )
+    best = programs[leaderboard.loc[0, "name"]] if len(leaderboard) else None
+    return best, leaderboard, programs
+
+
+def save_program(program, path: str):
+    """
+    Saves a program without the LM bound to its predictors, like build_and_train_model's
+    output: the LM is configured again on load_model, and its settings (API keys included)
+    must not end up in the model file.
+    """
+    predictors = program.predictors()
+    bound = [predictor.lm for predictor in predictors]
+    try:
+        for predictor in predictors:
+            predictor.lm = None
+        program.save(path)
+    finally:
+        for predictor, lm in zip(predictors, bound):
+            predictor.lm = lm
+
+
+def save_search_results(best, leaderboard: pd.DataFrame, model_path: str = "./models/cause_effect_model.json",
+                        leaderboard_path: str = None, programs: dict = None, candidates_dir: str = None):
+    """
+    Saves the best program to model_path and the leaderboard next to it (JSON records with the
+    creation time). If candidates_dir is given, every candidate program is saved there as well.
+    Returns the leaderboard path.
+    """
+    if best is None:
+        raise ValueError("No best program to save: the search had no candidates")
+    os.makedirs(os.path.dirname(model_path) or ".", exist_ok=True)
+    save_program(best, model_path)
+    leaderboard_path = leaderboard_path or os.path.splitext(model_path)[0] + "_leaderboard.json"
+    if candidates_dir and programs:
+        os.makedirs(candidates_dir, exist_ok=True)
+        leaderboard = leaderboard.assign(path=[os.path.join(candidates_dir, f"{name}.json") for name in leaderboard["name"]])
+        for name, path in zip(leaderboard["name"], leaderboard["path"]):
+            save_program(programs[name], path)
+    with open(leaderboard_path, "w", encoding="utf-8") as f:
+        json.dump({"model_path": model_path, "created": time.time(),
+                   "candidates": leaderboard.to_dict(orient="records")}, f, indent=4)
+    return leaderboard_path
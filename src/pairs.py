@@ -0,0 +1,175 @@
+# src/pairs.py
+import ast
+import json
+import logging
+import threading
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class CausalPair:
+    """
+    One extracted cause/effect pair, with the optional fields of the training format.
+    """
+    cause: str
+    effect: str
+    cause_polarity: Optional[str] = None
+    effect_polarity: Optional[str] = None
+    type: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, item):
+        """
+        Builds a pair from a dict, or returns None if cause/effect are missing or not text.
+        """
+        if not isinstance(item, dict):
+            return None
+        cause, effect = item.get("cause"), item.get("effect")
+        if not isinstance(cause, str) or not isinstance(effect, str):
+            return None
+
+        def optional(key):
+            value = item.get(key)
+            return None if value is None else str(value)
+
+        return cls(cause, effect, optional("cause_polarity"), optional("effect_polarity"), optional("type"))
+
+    @property
+    def key(self) -> tuple:
+        """
+        (cause, effect) stripped and lowercased, as compared by the exact-match metric.
+        """
+        return self.cause.strip().lower(), self.effect.strip().lower()
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class ParseStats:
+    """
+    Counts how raw LM strings were parsed. Each distinct string is counted once,
+    since repeated strings are answered from the parse cache.
+    """
+
+    FIELDS = ("json", "literal", "repaired", "failed", "invalid_items")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counts = dict.fromkeys(self.FIELDS, 0)
+
+    def add(self, field: str, n: int = 1):
+        with self._lock:
+            self.counts[field] += n
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            counts = dict(self.counts)
+        parsed = counts["json"] + counts["literal"] + counts["repaired"]
+        cache = _parse_raw.cache_info()
+        return {
+            **counts,
+            "parsed": parsed,
+            "failure_rate": counts["failed"] / (parsed + counts["failed"]) if parsed + counts["failed"] else 0.0,
+            "cache_hits": cache.hits,
+        }
+
+
+PARSE_STATS = ParseStats()
+
+
+def _load_list(raw: str):
+    """
+    Tries strict JSON, then a Python literal (the repr form the LM and the training
+    data mostly use), then json_repair for truncated or sloppy output.
+    Returns (value, method) or (None, "failed").
+    """
+    try:
+        return json.loads(raw), "json"
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(raw), "literal"
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+        pass
+    try:
+        import json_repair
+
+        repaired = json_repair.loads(raw)
+    except Exception as e:
+        logger.debug("Repair failed: %s", e)
+        return None, "failed"
+    # json_repair returns "" for text it cannot make sense of.
+    return (repaired, "repaired") if isinstance(repaired, (list, dict)) else (None, "failed")
+
+
+def _to_pairs(items) -> tuple:
+    """
+    Returns (valid pairs, number of items dropped because they are not a valid pair).
+    """
+    if isinstance(items, dict):
+        items = [items]
+    pairs = []
+    invalid = 0
+    for item in items:
+        pair = item if isinstance(item, CausalPair) else CausalPair.from_dict(item)
+        if pair is None:
+            invalid += 1
+        else:
+            pairs.append(pair)
+    if invalid:
+        PARSE_STATS.add("invalid_items", invalid)
+    return tuple(pairs), invalid
+
+
+@lru_cache(maxsize=65536)
+def _parse_raw(raw: str) -> tuple:
+    value, method = _load_list(raw.strip())
+    if not isinstance(value, (list, dict)):
+        PARSE_STATS.add("failed")
+        logger.debug("Could not parse extracted pairs: %.200s", raw)
+        return (), 0
+    PARSE_STATS.add(method)
+    return _to_pairs(value)
+
+
+def parse_pairs_checked(value) -> tuple:
+    """
+    Like parse_pairs, but also returns how many items were dropped for lacking a text
+    cause or effect: (tuple[CausalPair], int).
+    """
+    if isinstance(value, str):
+        return _parse_raw(value)
+    if isinstance(value, (list, tuple)):
+        return _to_pairs(value)
+    return (), 0
+
+
+def parse_pairs(value) -> tuple:
+    """
+    Parses extracted pairs into a tuple of CausalPair.
+
+    Args:
+        value: The LM's raw string (JSON, Python repr or something json_repair can fix),
+            a list of pair dicts, or a list of CausalPair. Anything else gives ().
+
+    Returns:
+        tuple[CausalPair]: The valid pairs; items without a text cause and effect are dropped
+        (see parse_pairs_checked to tell). String inputs are memoized, so parsing the same
+        output twice costs a dict lookup.
+    """
+    return parse_pairs_checked(value)[0]
+
+
+def parse_stats() -> dict:
+    """
+    Returns the parse counters (json/literal/repaired/failed/invalid_items, failure rate, cache hits).
+    """
+    return PARSE_STATS.as_dict()
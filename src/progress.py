@@ -0,0 +1,152 @@
+# src/progress.py
+import logging
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+class NullSink:
+    """
+    Discards all progress updates.
+    """
+
+    def update(self, stage: str, done: int, total, counters: dict, elapsed: float):
+        pass
+
+    def message(self, text: str):
+        pass
+
+
+class LogSink:
+    """
+    Writes progress as one structured log line per update, e.g.
+    "stage=predict done=120 total=500 elapsed_s=40.2 rate=2.99/s lm_calls=80".
+    Nothing is shown unless logging is configured for that level (the CLI does).
+    """
+
+    def __init__(self, level: int = logging.INFO, log: logging.Logger = None):
+        self.level = level
+        self.log = log or logger
+
+    def update(self, stage: str, done: int, total, counters: dict, elapsed: float):
+        if not self.log.isEnabledFor(self.level):
+            return
+        fields = {"stage": stage, "done": done, "total": total, "elapsed_s": round(elapsed, 1),
+                  "rate": f"{done / elapsed:.2f}/s" if elapsed > 0 else None, **counters}
+        self.log.log(self.level, " ".join(f"{key}={value}" for key, value in fields.items() if value is not None))
+
+    def message(self, text: str):
+        self.log.log(self.level, text)
+
+
+class StreamlitSink:
+    """
+    Shows progress in a Streamlit page as one progress bar and one status line,
+    both updated in place instead of appending a new element per update.
+    """
+
+    def __init__(self, container=None):
+        import streamlit as st
+
+        container = container or st
+        self._bar = container.progress(0.0)
+        self._status = container.empty()
+
+    def update(self, stage: str, done: int, total, counters: dict, elapsed: float):
+        if total:
+            self._bar.progress(min(done / total, 1.0))
+        status = f"{stage}: {done}" + (f"/{total}" if total else "") + f" in {elapsed:.1f}s"
+        if counters:
+            status += " (" + ", ".join(f"{key}: {value}" for key, value in counters.items()) + ")"
+        self._status.write(status)
+
+    def message(self, text: str):
+        self._status.write(text)
+
+
+_default_sink = LogSink()
+
+
+def set_default_sink(sink):
+    """
+    Sets the sink used by Progress objects created without one.
+    """
+    global _default_sink
+    _default_sink = sink
+
+
+class Progress:
+    """
+    Progress reporter handed to the pipeline functions.
+
+    advance() and incr() only update in-memory totals; the sink is called at most once
+    every `min_interval` seconds (and once more in finish()), so per-row progress costs
+    a counter increment rather than a UI or log write. Safe to use from worker threads.
+    """
+
+    def __init__(self, sink=None, min_interval: float = 1.0):
+        self.sink = sink if sink is not None else _default_sink
+        self.min_interval = min_interval
+        self.stage = ""
+        self.total = None
+        self.done = 0
+        self.counters = Counter()
+        self._start = time.perf_counter()
+        self._last_emit = 0.0
+        self._lock = threading.Lock()
+
+    def start(self, stage: str, total: int = None):
+        """
+        Begins a new stage; counters keep accumulating across stages.
+        """
+        with self._lock:
+            self.stage, self.total, self.done = stage, total, 0
+            self._start = time.perf_counter()
+            self._last_emit = 0.0
+
+    def advance(self, n: int = 1):
+        with self._lock:
+            self.done += n
+            self._maybe_emit()
+
+    def incr(self, name: str, n: int = 1):
+        """
+        Adds n to an aggregated counter (reported with the next progress update).
+        """
+        with self._lock:
+            self.counters[name] += n
+
+    def message(self, text: str):
+        self.sink.message(text)
+
+    def finish(self):
+        with self._lock:
+            self._emit()
+
+    def track(self, iterable, stage: str, total: int = None):
+        """
+        Yields the items of iterable, advancing by one per item, and finishes the stage
+        once the iterable is exhausted.
+        """
+        self.start(stage, total)
+        for item in iterable:
+            yield item
+            self.advance()
+        self.finish()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"stage": self.stage, "done": self.done, "total": self.total,
+                    "elapsed_s": time.perf_counter() - self._start, **self.counters}
+
+    def _maybe_emit(self):
+        now = time.perf_counter()
+        if now - self._last_emit >= self.min_interval:
+            self._emit(now)
+
+    def _emit(self, now: float = None):
+        now = now or time.perf_counter()
+        self._last_emit = now
+        self.sink.update(self.stage, self.done, self.total, dict(self.counters), now - self._start)
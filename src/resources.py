@@ -0,0 +1,154 @@
+# src/resources.py
+"""
+Streamlit-cached access to the heavy resources used by the pages.
+
+Streamlit re-executes a page script on every interaction. The loaders below keep
+the configured LM, the loaded DSPy program, the embedding store, the category index
+and parsed data files alive across reruns. File-backed entries are keyed on the
+file's (mtime, size), so editing a file on disk invalidates its cache entry.
+
+The modules behind each loader are imported inside it, so a page only pays for
+dspy and the embedding stack when it actually uses them.
+"""
+import os
+
+import pandas as pd
+import streamlit as st
+
+from src.category_index import file_signature
+from src.embedding_store import DEFAULT_EMBEDDING_MODEL
+
+
+def _signature(path: str) -> tuple:
+    return tuple(file_signature(path)) if os.path.exists(path) else None
+
+
+@st.cache_resource(show_spinner=False)
+def get_lm(model: str = ""):
+    """
+    Configures the LM once per server process instead of on every rerun.
+    """
+    from config import configure_lm
+
+    return configure_lm(model)
+
+
+@st.cache_resource(show_spinner="Loading model...")
+def _load_dspy_model(model_path: str, signature):
+    from src.model_pipeline import load_model
+
+    return load_model(model_path)
+
+
+def get_dspy_model(model_path: str):
+    """
+    Returns the DSPy program saved at model_path, reloaded only when the file changes.
+    """
+    return _load_dspy_model(model_path, _signature(model_path))
+
+
+@st.cache_resource(show_spinner=False)
+def get_cached_embedding_store(model_name: str = DEFAULT_EMBEDDING_MODEL):
+    """
+    Returns the shared embedding store (and with it the SentenceTransformer, once loaded).
+    """
+    from src.embedding_store import get_embedding_store
+
+    return get_embedding_store(model_name)
+
+
+@st.cache_resource(show_spinner="Loading driver categories...")
+def _load_category_index(drivers_path: str, signature):
+    from src.category_index import load_or_build_category_index
+
+    index = load_or_build_category_index(drivers_path)
+    index.vectors  # compute/load the category embedding matrix once
+    return index
+
+
+def get_category_index(drivers_path: str = "./data/drivers.xlsx"):
+    """
+    Returns the CategoryIndex for drivers_path, rebuilt only when the file changes.
+    """
+    return _load_category_index(drivers_path, _signature(drivers_path))
+
+
+@st.cache_resource(show_spinner="Indexing training examples...")
+def _load_demo_index(train_path: str, signature):
+    from src.demo_retrieval import load_or_build_demo_index
+
+    index = load_or_build_demo_index(train_path)
+    index.vectors  # compute/load the training embedding matrix once
+    return index
+
+
+def get_demo_index(train_path: str = "./data/train_set.json"):
+    """
+    Returns the DemoIndex over the training examples, rebuilt only when the file changes.
+    """
+    return _load_demo_index(train_path, _signature(train_path))
+
+
+@st.cache_data(show_spinner=False)
+def _read_csv(path: str, signature, nrows=None) -> pd.DataFrame:
+    return pd.read_csv(path, nrows=nrows)
+
+
+def read_csv_cached(path: str, nrows: int = None) -> pd.DataFrame:
+    """
+    pd.read_csv with the parsed frame cached until the file changes.
+    With nrows only the first nrows rows are read (0 reads just the header).
+    """
+    return _read_csv(path, _signature(path), nrows)
+
+
+@st.cache_resource(show_spinner=False)
+def get_review_store(path: str = "./data/cache/review.sqlite"):
+    """
+    Returns the SQLite review store shared by all sessions of the review page.
+    """
+    from src.review_store import ReviewStore
+
+    return ReviewStore(path)
+
+
+@st.cache_data(show_spinner=False)
+def _read_parquet(path: str, columns, signature) -> pd.DataFrame:
+    from src.columnar import read_pairs
+
+    return read_pairs(path, columns=columns)
+
+
+def read_parquet_cached(path: str, columns=None) -> pd.DataFrame:
+    """
+    Reads only `columns` of a Parquet file, cached until the file changes.
+    """
+    return _read_parquet(path, tuple(columns) if columns else None, _signature(path))
+
+
+@st.cache_data(show_spinner=False)
+def _load_train_data(path: str, signature) -> pd.DataFrame:
+    from src.data_utils import load_train_data
+
+    return load_train_data(path)
+
+
+def load_train_data_cached(path: str) -> pd.DataFrame:
+    """
+    load_train_data with the parsed frame cached until the JSON file changes.
+    """
+    return _load_train_data(path, _signature(path))
+
+
+@st.cache_data(show_spinner=False)
+def _load_extracted_causes(path: str, signature) -> pd.DataFrame:
+    from src.mapping import load_extracted_causes
+
+    return load_extracted_causes(path)
+
+
+def load_extracted_causes_cached(path: str = "./data/result_df_31_Oct.csv") -> pd.DataFrame:
+    """
+    load_extracted_causes with the prepared frame cached until the CSV changes.
+    """
+    return _load_extracted_causes(path, _signature(path))
@@ -0,0 +1,310 @@
+# src/review_store.py
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from src.category_index import file_signature
+from src.columnar import PAIR_FIELDS, pairs_to_table
+
+DEFAULT_REVIEW_DB = "./data/cache/review.sqlite"
+EDITABLE_COLUMNS = ("cause", "effect", "cause_polarity", "effect_polarity", "type")
+PAGE_COLUMNS = ["id", "OriginalIndex", "DonId", "pair_index", *PAIR_FIELDS, "category"]
+
+
+def _normalize(text) -> str:
+    return " ".join(str(text).lower().split())
+
+
+class ReviewStore:
+    """
+    Queryable local copy of a predictions file for the review page.
+
+    The long-format pairs (Parquet, or a predictions CSV converted on import) are loaded
+    into SQLite once per version of the source file. Pages are fetched with LIMIT/OFFSET
+    and filtered in SQL, aggregates are cached until the data changes, and reviewer edits
+    are appended to an edit log instead of rewriting the output file. Edits are keyed on
+    (OriginalIndex, chunk_start, pair_index) and remember the file they were made on; when
+    that file is re-imported they are replayed, as long as the file is unchanged or the
+    edited cell still holds the value the reviewer saw.
+    """
+
+    def __init__(self, path: str = DEFAULT_REVIEW_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._aggregates = {}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS pairs (
+                id INTEGER PRIMARY KEY,
+                OriginalIndex INTEGER,
+                DonId TEXT,
+                chunk_start INTEGER,
+                pair_index INTEGER,
+                cause TEXT,
+                effect TEXT,
+                cause_polarity TEXT,
+                effect_polarity TEXT,
+                type TEXT,
+                cause_key TEXT
+            );
+            CREATE INDEX IF NOT EXISTS pairs_don ON pairs(DonId);
+            CREATE INDEX IF NOT EXISTS pairs_type ON pairs(type);
+            CREATE INDEX IF NOT EXISTS pairs_cause_key ON pairs(cause_key);
+            CREATE TABLE IF NOT EXISTS cause_categories (cause_key TEXT PRIMARY KEY, category TEXT);
+            CREATE INDEX IF NOT EXISTS cause_categories_category ON cause_categories(category);
+            CREATE TABLE IF NOT EXISTS edits (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                OriginalIndex INTEGER,
+                chunk_start INTEGER,
+                pair_index INTEGER,
+                source TEXT,
+                column_name TEXT,
+                old_value TEXT,
+                new_value TEXT,
+                edited_at REAL
+            );
+            """
+        )
+        # Databases created before chunk_start/source were tracked.
+        for table, column, sql_type in (("pairs", "chunk_start", "INTEGER"), ("edits", "chunk_start", "INTEGER"),
+                                        ("edits", "source", "TEXT")):
+            if column not in [row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")]:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {sql_type}")
+        self._conn.execute("DROP INDEX IF EXISTS pairs_natural")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pairs_key ON pairs(OriginalIndex, chunk_start, pair_index)")
+        self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pairs").fetchone()[0]
+
+    # --- metadata -------------------------------------------------------------
+
+    def _get_meta(self, key: str, default=None):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _set_meta(self, key: str, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, json.dumps(value)))
+
+    def _bump_version(self):
+        self._set_meta("version", self._get_meta("version", 0) + 1)
+
+    @property
+    def version(self) -> int:
+        """
+        Changes whenever the pairs, categories or edits change; aggregates are cached per version.
+        """
+        with self._lock:
+            return self._get_meta("version", 0)
+
+    # --- loading --------------------------------------------------------------
+
+    @staticmethod
+    def _iter_source_batches(source_path: str, batch_size: int):
+        if source_path.endswith(".parquet"):
+            import pyarrow.parquet as pq
+
+            for batch in pq.ParquetFile(source_path).iter_batches(batch_size=batch_size):
+                yield batch.to_pandas()
+        else:
+            # Per-text predictions CSV: converted to one row per pair on the fly.
+            for chunk in pd.read_csv(source_path, chunksize=batch_size):
+                yield pairs_to_table(chunk).to_pandas()
+
+    def sync(self, source_path: str, batch_size: int = 10_000) -> bool:
+        """
+        (Re)imports source_path if it changed since the last import and replays the edit log.
+        Returns True if an import happened.
+        """
+        signature = [os.path.abspath(source_path), *file_signature(source_path)]
+        with self._lock:
+            if self._get_meta("source") == signature:
+                return False
+            self._conn.execute("DELETE FROM pairs")
+            columns = ["OriginalIndex", "DonId", "chunk_start", "pair_index", *PAIR_FIELDS]
+            for batch in self._iter_source_batches(source_path, batch_size):
+                batch = batch.reindex(columns=columns)
+                batch = batch.astype(object).where(batch.notna(), None)
+                rows = [(*values, _normalize(values[4]) if values[4] is not None else None)
+                        for values in batch.itertuples(index=False, name=None)]
+                self._conn.executemany(
+                    "INSERT INTO pairs (OriginalIndex, DonId, chunk_start, pair_index, cause, effect, cause_polarity, "
+                    "effect_polarity, type, cause_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+            self._replay_edits(signature)
+            self._set_meta("source", signature)
+            self._bump_version()
+            self._conn.commit()
+            return True
+
+    def attach_categories(self, mapped_path: str, cause_col: str = "Cause_by_OpenAI",
+                          category_col: str = "Cause_driver_category") -> bool:
+        """
+        Loads cause -> driver category assignments (the mapping output) so pairs can be
+        filtered and counted by category. Causes are matched ignoring case and whitespace.
+        Returns True if the categories were (re)loaded.
+        """
+        signature = [os.path.abspath(mapped_path), *file_signature(mapped_path)]
+        with self._lock:
+            if self._get_meta("categories") == signature:
+                return False
+            if mapped_path.endswith(".parquet"):
+                mapped = pd.read_parquet(mapped_path, columns=[cause_col, category_col])
+            else:
+                mapped = pd.read_csv(mapped_path, usecols=[cause_col, category_col])
+            mapped = mapped.dropna()
+            self._conn.execute("DELETE FROM cause_categories")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO cause_categories VALUES (?, ?)",
+                ((_normalize(cause), str(category)) for cause, category in mapped.itertuples(index=False, name=None)),
+            )
+            self._set_meta("categories", signature)
+            self._bump_version()
+            self._conn.commit()
+            return True
+
+    # --- queries --------------------------------------------------------------
+
+    @staticmethod
+    def _where(filters: dict):
+        clauses, params = [], []
+        filters = filters or {}
+        if filters.get("don_id"):
+            clauses.append("p.DonId = ?")
+            params.append(str(filters["don_id"]))
+        if filters.get("cause"):
+            clauses.append("p.cause_key LIKE ?")
+            params.append(f"%{_normalize(filters['cause'])}%")
+        if filters.get("type"):
+            clauses.append("p.type = ?")
+            params.append(filters["type"])
+        if filters.get("category"):
+            clauses.append("c.category = ?")
+            params.append(filters["category"])
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    _FROM = " FROM pairs p LEFT JOIN cause_categories c ON c.cause_key = p.cause_key"
+
+    def count(self, filters: dict = None) -> int:
+        where, params = self._where(filters)
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*)" + self._FROM + where, params).fetchone()[0]
+
+    def fetch_page(self, page: int = 0, page_size: int = 50, filters: dict = None) -> pd.DataFrame:
+        """
+        Returns one page (0-based) of pairs matching filters, in file order.
+        Supported filters: don_id (exact), cause (substring, case-insensitive), type, category.
+        """
+        where, params = self._where(filters)
+        query = (
+            "SELECT p.id, p.OriginalIndex, p.DonId, p.pair_index, p.cause, p.effect, p.cause_polarity, "
+            "p.effect_polarity, p.type, c.category" + self._FROM + where + " ORDER BY p.id LIMIT ? OFFSET ?"
+        )
+        with self._lock:
+            rows = self._conn.execute(query, [*params, page_size, page * page_size]).fetchall()
+        return pd.DataFrame(rows, columns=PAGE_COLUMNS)
+
+    def value_counts(self, column: str, filters: dict = None, limit: int = 20) -> pd.DataFrame:
+        """
+        Most frequent values of column among the filtered pairs, cached until the data changes.
+        """
+        if column not in (*PAIR_FIELDS, "DonId", "category"):
+            raise ValueError(f"Unknown column: {column}")
+        where, params = self._where(filters)
+        # Streamlit reruns call this from different threads: the version, the cache and the
+        # query are read and updated together, so a sync or edit can't slip in between.
+        with self._lock:
+            version = self._get_meta("version", 0)
+            key = (version, column, json.dumps(filters or {}, sort_keys=True), limit)
+            if key not in self._aggregates:
+                target = "c.category" if column == "category" else f"p.{column}"
+                query = (f"SELECT {target} AS value, COUNT(*) AS n" + self._FROM + where +
+                         f" GROUP BY {target} HAVING value IS NOT NULL ORDER BY n DESC LIMIT ?")
+                rows = self._conn.execute(query, [*params, limit]).fetchall()
+                # Only aggregates of the current version are kept.
+                self._aggregates = {k: v for k, v in self._aggregates.items() if k[0] == version}
+                self._aggregates[key] = pd.DataFrame(rows, columns=[column, "Count"])
+            return self._aggregates[key]
+
+    def distinct(self, column: str, limit: int = 5000) -> list:
+        """
+        Sorted distinct values of column (for filter drop-downs).
+        """
+        return sorted(self.value_counts(column, limit=limit)[column].tolist())
+
+    # --- edits ----------------------------------------------------------------
+
+    def apply_edits(self, edits) -> int:
+        """
+        Records reviewer edits given as (pair id, column, new value) and updates the pairs.
+        Every change is appended to the edit log; the source file is never rewritten.
+        Returns the number of cells that actually changed.
+        """
+        changed = 0
+        now = time.time()
+        with self._lock:
+            source = json.dumps(self._get_meta("source"))
+            for pair_id, column, new_value in edits:
+                if column not in EDITABLE_COLUMNS:
+                    raise ValueError(f"Column {column} cannot be edited")
+                row = self._conn.execute(
+                    f"SELECT OriginalIndex, chunk_start, pair_index, {column} FROM pairs WHERE id = ?", (int(pair_id),)
+                ).fetchone()
+                if row is None or row[3] == new_value:
+                    continue
+                self._conn.execute(
+                    "INSERT INTO edits (OriginalIndex, chunk_start, pair_index, source, column_name, old_value, "
+                    "new_value, edited_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (*row[:3], source, column, row[3], new_value, now),
+                )
+                self._set_value(int(pair_id), column, new_value)
+                changed += 1
+            if changed:
+                self._bump_version()
+            self._conn.commit()
+        return changed
+
+    def _set_value(self, pair_id: int, column: str, value):
+        self._conn.execute(f"UPDATE pairs SET {column} = ? WHERE id = ?", (value, pair_id))
+        if column == "cause":
+            self._conn.execute("UPDATE pairs SET cause_key = ? WHERE id = ?",
+                               (_normalize(value) if value is not None else None, pair_id))
+
+    def _replay_edits(self, signature):
+        """
+        Re-applies the edits made on this source file (same path). If the file changed since an
+        edit, it is only applied where the cell still holds the value the reviewer replaced, so
+        edits never land on the predictions of a different run.
+        """
+        for original_index, chunk_start, pair_index, source, column, old_value, new_value in self._conn.execute(
+            "SELECT OriginalIndex, chunk_start, pair_index, source, column_name, old_value, new_value "
+            "FROM edits ORDER BY id"
+        ).fetchall():
+            source = json.loads(source) if source else None
+            if not source or source[0] != signature[0]:
+                continue
+            row = self._conn.execute(
+                f"SELECT id, {column} FROM pairs WHERE OriginalIndex IS ? AND chunk_start IS ? AND pair_index IS ?",
+                (original_index, chunk_start, pair_index),
+            ).fetchone()
+            if row is not None and (source == signature or row[1] == old_value):
+                self._set_value(row[0], column, new_value)
+
+    def edit_log(self) -> pd.DataFrame:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, OriginalIndex, chunk_start, pair_index, column_name, old_value, new_value, edited_at "
+                "FROM edits ORDER BY id"
+            ).fetchall()
+        return pd.DataFrame(rows, columns=["id", "OriginalIndex", "chunk_start", "pair_index", "column", "old_value",
+                                           "new_value", "edited_at"])
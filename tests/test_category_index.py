@@ -0,0 +1,45 @@
+# tests/test_category_index.py
+import random
+import re
+
+import pytest
+
+from src.category_index import CategoryIndex
+
+CATEGORIES = ["Climate change", "Climate", "Change in land use", "Land use", "Travel", "COVID-19", "Health system"]
+
+
+@pytest.fixture(scope="module")
+def index():
+    return CategoryIndex(CATEGORIES, precision="float32")
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Climate change drives outbreaks", [(0, 14, "Climate change")]),
+    ("A change in land use near the forest", [(2, 20, "Change in land use")]),
+    ("Travel and COVID-19 spread", [(0, 6, "Travel"), (11, 19, "COVID-19")]),
+    ("  CLIMATE   change  ", [(0, 14, "Climate change")]),
+    ("Travelling is not a category", []),
+    ("climatechange", []),
+    ("the health system and land use", [(4, 17, "Health system"), (22, 30, "Land use")]),
+])
+def test_find_all_leftmost_longest(index, text, expected):
+    assert index.find_all(text) == expected
+
+
+def test_find_returns_first_match(index):
+    assert index.find("Weak health system and climate") == "Health system"
+    assert index.find("nothing to see") is None
+
+
+def test_find_all_matches_regex_reference(index):
+    # Python's regex alternation is leftmost-first, so longest-first ordering gives
+    # the leftmost-longest whole-word matches find_all promises.
+    patterns = sorted({index.normalize(cat) for cat in CATEGORIES}, key=len, reverse=True)
+    reference = re.compile(r"(?<!\w)(?:" + "|".join(map(re.escape, patterns)) + r")(?!\w)")
+    words = ["climate", "change", "in", "land", "use", "travel", "covid-19", "health", "system", "x", "travelling"]
+    rng = random.Random(0)
+    for _ in range(500):
+        text = index.normalize(" ".join(rng.choice(words) for _ in range(rng.randint(0, 12))))
+        expected = [(m.start(), m.end(), index.lookup(m.group())) for m in reference.finditer(text)]
+        assert index.find_all(text) == expected, text
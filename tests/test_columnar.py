@@ -0,0 +1,37 @@
+# tests/test_columnar.py
+import pandas as pd
+import pyarrow.parquet as pq
+
+from src.columnar import PairParquetWriter, ResultWriter, read_pairs
+
+
+def _prediction_rows(start, n):
+    return [{"OriginalIndex": i, "DonId": f"DON{i}",
+             "PredictedExtractedPairs": str([{"cause": f"cause {i}", "effect": "spread", "type": "Type 1"}])}
+            for i in range(start, start + n)]
+
+
+def test_pair_writer_buffers_small_batches_into_row_groups(tmp_path):
+    path = tmp_path / "pairs.parquet"
+    with PairParquetWriter(str(path), row_group_size=25) as writer:
+        for start in range(0, 60, 3):
+            writer.write(pd.DataFrame(_prediction_rows(start, 3)))
+        assert writer.rows_written == 60
+
+    metadata = pq.ParquetFile(path).metadata
+    # 20 batches of 3 pairs: two full row groups of 27 pairs, the rest on close().
+    assert [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)] == [27, 27, 6]
+    assert read_pairs(str(path), columns=["OriginalIndex"])["OriginalIndex"].tolist() == list(range(60))
+
+
+def test_result_writer_flushes_csv_per_batch_and_pairs_on_close(tmp_path):
+    csv_path, pairs_path = tmp_path / "predictions.csv", tmp_path / "pairs.parquet"
+    with ResultWriter(str(csv_path), pairs_path=str(pairs_path)) as writer:
+        for row in _prediction_rows(0, 10):
+            writer.add(row)
+            writer.flush()
+        assert len(pd.read_csv(csv_path)) == 10
+
+    assert pq.ParquetFile(pairs_path).metadata.num_row_groups == 1
+    assert read_pairs(str(pairs_path), filters=[("type", "=", "Type 1")])["cause"].tolist() == [
+        f"cause {i}" for i in range(10)]
@@ -0,0 +1,109 @@
+# tests/test_concurrent_inference.py
+import re
+import threading
+import time
+
+import dspy
+import pandas as pd
+
+from src.concurrency import RateLimiter
+from src.lm_cache import CachedLM, ResponseCache
+from src.model_pipeline import CauseEffectSignature, predict_cause_effect
+
+TEXT_FIELD = re.compile(r"\[\[ ## text ## \]\]\n(.*?)\n\n", re.S)
+
+
+class _Response:
+    def __init__(self, content):
+        self.choices = [{"text": content}]
+        self.usage = {}
+        self.model = "fake/sleepy"
+
+
+class SleepyLM(dspy.BaseLM):
+    """
+    Local fake LM: sleeps `latency` seconds per request, like a remote provider would, and
+    answers with the input text and one pair made from it. Counts calls and peak concurrency.
+    """
+
+    def __init__(self, latency: float = 0.1):
+        super().__init__(model="fake/sleepy")
+        self.latency = latency
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        text = TEXT_FIELD.search(messages[-1]["content"]).group(1)
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        pairs = [{"cause": text, "effect": "outbreak"}]
+        return _Response(f"[[ ## marked_text ## ]]\n{text}\n\n[[ ## extracted_pairs ## ]]\n{pairs!r}\n\n"
+                         "[[ ## completed ## ]]")
+
+
+def _program(lm):
+    program = dspy.Predict(CauseEffectSignature)
+    program.set_lm(lm)
+    return program
+
+
+def _corpus(n=12):
+    # A shuffled index checks that results follow the rows' order, not completion order.
+    return pd.DataFrame({"Text": [f"Report number {i} about rainfall." for i in range(n)]},
+                        index=[(i * 5) % n for i in range(n)])
+
+
+def test_concurrent_predictions_keep_original_order():
+    lm = SleepyLM(latency=0.1)
+    df = _corpus()
+
+    start = time.perf_counter()
+    results = predict_cause_effect(df, _program(lm), max_workers=6)
+    elapsed = time.perf_counter() - start
+
+    assert results["OriginalIndex"].tolist() == df.index.tolist()
+    assert results["PredictedMarkedText"].tolist() == df["Text"].tolist()
+    assert 1 < lm.max_in_flight <= 6
+    # 12 requests of 0.1s take 1.2s one at a time.
+    assert elapsed < 0.8
+
+
+def test_cached_lm_answers_repeated_run_without_calls(tmp_path):
+    fake = SleepyLM(latency=0.05)
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    program = _program(CachedLM(fake, cache, namespace="model-hash"))
+    df = _corpus()
+
+    first = predict_cause_effect(df, program, max_workers=4)
+    assert fake.calls == len(df)
+    assert cache.stats()["misses"] == len(df)
+
+    second = predict_cause_effect(df, program, max_workers=4)
+    assert fake.calls == len(df)
+    assert cache.stats()["hits"] == len(df)
+    pd.testing.assert_frame_equal(first, second)
+
+    # Another demo set (namespace) must not be served the first one's answers.
+    predict_cause_effect(df.head(2), _program(CachedLM(fake, cache, namespace="other-model")))
+    assert fake.calls == len(df) + 2
+
+
+def test_rate_limiter_throttles_requests():
+    limiter = RateLimiter(requests_per_minute=600)
+    for _ in range(600):
+        limiter.acquire()
+
+    start = time.perf_counter()
+    for _ in range(3):
+        limiter.acquire()
+    # The bucket refills at 10 requests per second.
+    assert 0.2 <= time.perf_counter() - start < 1.0
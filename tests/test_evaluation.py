@@ -0,0 +1,19 @@
+# tests/test_evaluation.py
+import dspy
+import pytest
+
+from src.evaluation import extracted_pairs_exact_match
+
+GOLD = dspy.Example(extracted_pairs="[{'cause': 'Heavy rain', 'effect': 'flooding'}]")
+
+
+@pytest.mark.parametrize("predicted, score", [
+    ("[{'cause': 'heavy rain ', 'effect': 'Flooding'}]", 1.0),
+    ('[{"cause": "Heavy rain", "effect": "flooding"}]', 1.0),
+    ("[{'cause': 'Heavy rain', 'effect': 'flooding'}, {'cause': 'drought'}]", 0.0),
+    ("[{'cause': 'Heavy rain', 'effect': 'flooding'}, {'cause': 'heat', 'effect': 'drought'}]", 0.0),
+    ("[]", 0.0),
+    ("not a list", 0.0),
+])
+def test_exact_match(predicted, score):
+    assert extracted_pairs_exact_match(GOLD, dspy.Prediction(extracted_pairs=predicted)) == score
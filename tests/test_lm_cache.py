@@ -0,0 +1,50 @@
+# tests/test_lm_cache.py
+from src.lm_cache import ResponseCache, request_key
+
+
+def test_hit_and_miss(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    key = request_key("openai/o3-mini", "model-hash", messages=[{"role": "user", "content": "text"}])
+
+    assert cache.get(key) is None
+    cache.put(key, ["answer"])
+    assert cache.get(key) == ["answer"]
+    assert {k: cache.stats()[k] for k in ("hits", "misses", "entries")} == {"hits": 1, "misses": 1, "entries": 1}
+
+
+def test_key_ignores_api_settings_but_not_namespace():
+    messages = [{"role": "user", "content": "text"}]
+    key = request_key("m", "a", messages=messages, kwargs={"temperature": 0.0, "api_key": "one"})
+
+    assert key == request_key("m", "a", messages=messages, kwargs={"temperature": 0.0, "api_key": "two"})
+    assert key != request_key("m", "b", messages=messages, kwargs={"temperature": 0.0})
+    assert key != request_key("m", "a", messages=messages, kwargs={"temperature": 1.0})
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"), max_entries=2)
+    cache.put("a", ["1"])
+    cache.put("b", ["2"])
+    cache.get("a")  # "b" is now the least recently used
+    cache.put("c", ["3"])
+
+    assert cache.get("b") is None
+    assert cache.get("a") == ["1"] and cache.get("c") == ["3"]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_evicts_by_size(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"), max_bytes=100)
+    for key in "abcd":
+        cache.put(key, ["x" * 40])
+
+    stats = cache.stats()
+    assert stats["bytes"] <= 100 and stats["entries"] == 2
+    assert cache.get("d") is not None
+
+
+def test_persists_across_instances(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    ResponseCache(path).put("a", ["1"])
+
+    assert ResponseCache(path).get("a") == ["1"]
@@ -0,0 +1,115 @@
+# tests/test_lm_router.py
+import time
+
+import dspy
+import litellm
+import pytest
+
+from src.lm_router import Backend, RouterError, RouterLM
+
+MESSAGES = [{"role": "user", "content": "text"}]
+
+
+class _Response:
+    def __init__(self, content, model):
+        self.choices = [{"text": content}]
+        self.usage = {}
+        self.model = model
+
+
+class FakeBackendLM(dspy.BaseLM):
+    """
+    Answers with its own name after `latency` seconds, or raises `error` on every call.
+    """
+
+    def __init__(self, name, latency=0.0, error=None):
+        super().__init__(model=f"fake/{name}")
+        self.name = name
+        self.latency = latency
+        self.error = error
+        self.calls = 0
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        if self.error is not None:
+            raise self.error
+        return _Response(self.name, self.model)
+
+
+def _router(*lms, **options):
+    options = {"backoff": 0.0, "cooldown": 60.0, **options}
+    return RouterLM([Backend(lm.name, lm) for lm in lms], **options)
+
+
+def _stats(router):
+    return router.stats().set_index("backend")
+
+
+def test_fails_over_to_healthy_backend():
+    broken = FakeBackendLM("broken", error=RuntimeError("HTTP 500"))
+    healthy = FakeBackendLM("healthy")
+    router = _router(broken, healthy)
+    router.backends[1].latency_ewma = 1.0  # the broken backend looks faster, so it is tried first
+
+    response = router.forward(messages=MESSAGES)
+
+    assert response.choices[0]["text"] == "healthy"
+    assert (response.backend, response.retries) == ("healthy", 1)
+    stats = _stats(router)
+    assert stats.loc["broken", "errors"] == 1 and stats.loc["broken", "cooldown_s"] > 0
+    # While it cools down, new requests skip the broken backend.
+    router.forward(messages=MESSAGES)
+    assert broken.calls == 1 and healthy.calls == 2
+
+
+def test_raises_router_error_when_every_attempt_fails():
+    router = _router(FakeBackendLM("a", error=RuntimeError("down")), FakeBackendLM("b", error=RuntimeError("down")))
+
+    with pytest.raises(RouterError) as excinfo:
+        router.forward(messages=MESSAGES)
+    assert isinstance(excinfo.value.__cause__, RuntimeError)
+    assert _stats(router)["in_flight"].tolist() == [0, 0]
+
+
+@pytest.mark.parametrize("error", [
+    litellm.BadRequestError(message="bad", model="m", llm_provider="openai"),
+    litellm.ContextWindowExceededError(message="too long", model="m", llm_provider="openai"),
+    litellm.AuthenticationError(message="no key", model="m", llm_provider="openai"),
+])
+def test_non_retryable_errors_are_raised_without_failover(error):
+    a, b = FakeBackendLM("a", error=error), FakeBackendLM("b", error=error)
+    router = _router(a, b)
+
+    with pytest.raises(type(error)):
+        router.forward(messages=MESSAGES)
+    assert a.calls + b.calls == 1
+    stats = _stats(router)
+    assert stats["errors"].tolist() == [0, 0] and stats["cooldown_s"].tolist() == [0.0, 0.0]
+    assert stats["in_flight"].tolist() == [0, 0]
+
+
+def test_timeout_counts_as_one_failure_and_fails_over():
+    slow, fast = FakeBackendLM("slow", latency=0.5), FakeBackendLM("fast")
+    router = _router(slow, fast, timeout=0.1)
+    router.backends[1].latency_ewma = 1.0
+
+    response = router.forward(messages=MESSAGES)
+
+    assert response.backend == "fast"
+    assert router.timeouts == 1
+    time.sleep(0.6)  # let the abandoned call finish
+    stats = _stats(router)
+    assert stats.loc["slow", "errors"] == 1 and stats.loc["slow", "in_flight"] == 0
+
+
+def test_hedged_request_returns_first_answer():
+    slow, fast = FakeBackendLM("slow", latency=0.5), FakeBackendLM("fast", latency=0.05)
+    router = _router(slow, fast, hedge_after=0.05)
+    router.backends[1].latency_ewma = 1.0
+
+    start = time.perf_counter()
+    response = router.forward(messages=MESSAGES)
+
+    assert response.backend == "fast" and router.hedges == 1
+    assert time.perf_counter() - start < 0.4
@@ -0,0 +1,92 @@
+# tests/test_review_store.py
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import dspy
+import pandas as pd
+
+from src.columnar import pairs_to_table
+from src.model_pipeline import predict_cause_effect_with_chunking
+from src.review_store import ReviewStore
+
+
+class FirstWordModel:
+    """
+    Stands in for the extraction program: one pair per chunk, caused by its first word.
+    """
+
+    def __call__(self, text):
+        return dspy.Prediction(marked_text=text,
+                               extracted_pairs=str([{"cause": text.split()[0], "effect": "spread"}]))
+
+
+def _chunked_predictions_csv(path):
+    df = pd.DataFrame({
+        "Text": ["Rain fell. Floods came. Mosquitoes bred. Dengue spread.", "War started. People fled."],
+        "DonId": ["DON1", "DON2"],
+    })
+    predictions = predict_cause_effect_with_chunking(df, FirstWordModel(), chunk_size=2, overlap=0)
+    predictions.to_csv(path, index=False)
+    return predictions
+
+
+def test_pairs_to_table_parses_csv_columns(tmp_path):
+    path = tmp_path / "predictions.csv"
+    predictions = _chunked_predictions_csv(path)
+
+    table = pairs_to_table(pd.read_csv(path)).to_pandas()
+
+    assert table["cause"].tolist() == ["Rain", "Mosquitoes", "War"]
+    assert table["DonId"].tolist() == ["DON1", "DON1", "DON2"]
+    assert table["chunk_start"].tolist() == predictions["ChunkStart"].tolist()
+    assert [list(ids) for ids in table["sentence_ids"]] == predictions["SentenceIds"].tolist()
+
+
+def test_pairs_to_table_treats_missing_csv_values_as_none():
+    df = pd.DataFrame([{"OriginalIndex": 3, "DonId": float("nan"), "ChunkStart": float("nan"),
+                        "SentenceIds": float("nan"), "PredictedExtractedPairs": "[{'cause': 'heat', 'effect': 'drought'}]"}])
+
+    row = pairs_to_table(df).to_pylist()[0]
+
+    assert (row["DonId"], row["chunk_start"], row["sentence_ids"]) == (None, None, None)
+    assert (row["cause"], row["effect"]) == ("heat", "drought")
+
+
+def test_sync_from_chunked_csv_and_replay_edit(tmp_path):
+    source = tmp_path / "predictions.csv"
+    _chunked_predictions_csv(source)
+    store = ReviewStore(str(tmp_path / "review.sqlite"))
+
+    assert store.sync(str(source))
+    page = store.fetch_page(page_size=10)
+    assert page["cause"].tolist() == ["Rain", "Mosquitoes", "War"]
+    assert store.value_counts("DonId")["DonId"].tolist() == ["DON1", "DON2"]
+
+    # Both DON1 pairs have pair_index 0; the edit must stay on the chunk it was made on.
+    mosquitoes = int(page.loc[page["cause"] == "Mosquitoes", "id"].iloc[0])
+    assert store.apply_edits([(mosquitoes, "cause", "Stagnant water")]) == 1
+    assert not store.sync(str(source))
+
+    # Re-running the same predictions rewrites the file: the edit is replayed onto the new import.
+    _chunked_predictions_csv(source)
+    os.utime(source, (time.time() + 5, time.time() + 5))
+    assert store.sync(str(source))
+    assert store.fetch_page(page_size=10)["cause"].tolist() == ["Rain", "Stagnant water", "War"]
+
+
+def test_value_counts_from_many_threads(tmp_path):
+    source = tmp_path / "predictions.csv"
+    _chunked_predictions_csv(source)
+    store = ReviewStore(str(tmp_path / "review.sqlite"))
+    store.sync(str(source))
+    pair_ids = store.fetch_page(page_size=10)["id"].tolist()
+
+    def work(i):
+        if i % 4 == 0:
+            store.apply_edits([(pair_ids[0], "type", f"Type {i}")])
+        return store.value_counts("DonId")["Count"].sum()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        assert set(pool.map(work, range(200))) == {3}
+    assert len(store._aggregates) == 1
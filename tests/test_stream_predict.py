@@ -0,0 +1,78 @@
+# tests/test_stream_predict.py
+import json
+
+import dspy
+import pandas as pd
+import pytest
+
+from src.model_pipeline import _truncate_partial_line, stream_predict_cause_effect
+
+
+class EchoModel:
+    """
+    Stands in for the extraction program and remembers which texts it was asked about.
+    """
+
+    def __init__(self):
+        self.texts = []
+
+    def __call__(self, text):
+        self.texts.append(text)
+        return dspy.Prediction(marked_text=text, extracted_pairs=str([{"cause": text, "effect": "spread"}]))
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    path = tmp_path / "corpus.csv"
+    pd.DataFrame({"Text": [f"text {i}" for i in range(6)], "DonId": [f"DON{i}" for i in range(6)]}).to_csv(
+        path, index=False)
+    return str(path)
+
+
+@pytest.mark.parametrize("block_size", [1, 3, 64 * 1024])
+def test_truncate_partial_line(tmp_path, block_size):
+    path = tmp_path / "out.jsonl"
+    for content, expected in [
+        (b"", b""),
+        (b'{"a": 1}\n', b'{"a": 1}\n'),
+        (b'{"a": 1}\n{"a": 2}\n{"a"', b'{"a": 1}\n{"a": 2}\n'),
+        (b'{"a": 1', b""),
+    ]:
+        path.write_bytes(content)
+        _truncate_partial_line(str(path), block_size=block_size)
+        assert path.read_bytes() == expected
+
+
+def test_stream_resumes_after_interrupted_write(tmp_path, corpus):
+    output = tmp_path / "out.jsonl"
+    first = EchoModel()
+    assert len(list(stream_predict_cause_effect(corpus, first, str(output), max_rows=3))) == 3
+    # A crash in the middle of the next record leaves half a line behind.
+    with open(output, "a", encoding="utf-8") as f:
+        f.write('{"OriginalIndex": 3, "Predicted')
+
+    second = EchoModel()
+    records = list(stream_predict_cause_effect(corpus, second, str(output)))
+
+    assert second.texts == ["text 3", "text 4", "text 5"]
+    assert [record["OriginalIndex"] for record in records] == [3, 4, 5]
+    lines = output.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["OriginalIndex"] for line in lines] == [0, 1, 2, 3, 4, 5]
+
+
+def test_stream_resumes_on_don_id(tmp_path, corpus):
+    output = tmp_path / "out.jsonl"
+    list(stream_predict_cause_effect(corpus, EchoModel(), str(output), key_col="DonId", max_rows=2))
+
+    model = EchoModel()
+    list(stream_predict_cause_effect(corpus, model, str(output), key_col="DonId"))
+
+    assert model.texts == ["text 2", "text 3", "text 4", "text 5"]
+
+
+def test_stream_rejects_missing_key_column(tmp_path):
+    path = tmp_path / "corpus.csv"
+    pd.DataFrame({"Text": ["text 0"]}).to_csv(path, index=False)
+
+    with pytest.raises(ValueError, match="DonId"):
+        list(stream_predict_cause_effect(str(path), EchoModel(), str(tmp_path / "out.jsonl"), key_col="DonId"))